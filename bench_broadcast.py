@@ -0,0 +1,95 @@
+"""
+Micro-benchmark del camino de broadcast: compara el camino antiguo
+(decode + f-string + encode + send por destinatario) con el nuevo
+(prefijo precalculado + tupla de buffers compartida + sendmsg).
+
+Los destinatarios son sockets nulos que solo cuentan llamadas, de modo que se
+mide el costo del lado de Python (formateo, copias y asignaciones) y no el
+del kernel.
+
+Uso:
+    python bench_broadcast.py [--repeticiones N] [--json]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from protocolo import empaquetar, prefijo_para
+
+DESTINATARIOS = (1, 100, 10_000)
+DIREC = ('127.0.0.1', 54321)
+
+class SocketNulo:
+    """Destino que acepta todo y solo cuenta las llamadas (mismo costo para ambos caminos)."""
+
+    def __init__(self):
+        self.llamadas = 0
+
+    def send(self, datos):
+        self.llamadas += 1
+
+    def sendmsg(self, buffers):
+        self.llamadas += 1
+
+def camino_antiguo(datos, destinatarios):
+    mensaje = datos.decode('utf-8').strip()
+    mensaje_para_broadcast = f"[{DIREC[0]}:{DIREC[1]}] {mensaje}\n"
+    bytes_mensajes = mensaje_para_broadcast.encode('utf-8')
+    for socket_cliente in destinatarios:
+        socket_cliente.send(bytes_mensajes)
+
+def camino_nuevo(datos, destinatarios, prefijo):
+    cuerpo = bytes(datos).strip()
+    buffers_mensaje = empaquetar(prefijo, cuerpo)
+    for socket_cliente in destinatarios:
+        socket_cliente.sendmsg(buffers_mensaje)
+
+def medir(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    duracion = time.perf_counter() - inicio
+
+    # Asignaciones de una sola ejecución (pico de memoria durante el broadcast)
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'us_por_broadcast': duracion / repeticiones * 1e6, 'bytes_asignados': pico}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark del broadcast")
+    parser.add_argument('--repeticiones', type=int, default=200)
+    parser.add_argument('--tamano', type=int, default=512, help="Tamaño del cuerpo del mensaje en bytes")
+    parser.add_argument('--json', action='store_true', help="Imprime el resultado como JSON")
+    args = parser.parse_args(argv)
+
+    # El camino antiguo recibía bytes de recv(); el nuevo, una vista del buffer de recepción
+    datos = b"x" * args.tamano + b"\n"
+    vista = memoryview(datos)
+    prefijo = prefijo_para(DIREC)
+
+    resultados = []
+    for cantidad in DESTINATARIOS:
+        destinatarios = [SocketNulo() for _ in range(cantidad)]
+        # Menos repeticiones para las salas grandes, así todas tardan parecido
+        repeticiones = max(1, args.repeticiones * 100 // max(cantidad, 100))
+
+        antiguo = medir(lambda: camino_antiguo(datos, destinatarios), repeticiones)
+        nuevo = medir(lambda: camino_nuevo(vista, destinatarios, prefijo), repeticiones)
+        resultados.append({'destinatarios': cantidad, 'antiguo': antiguo, 'nuevo': nuevo})
+
+    if args.json:
+        print(json.dumps(resultados, indent=2))
+        return
+
+    print(f"{'destinatarios':>13} | {'antiguo us':>11} | {'nuevo us':>11} | {'antiguo B':>10} | {'nuevo B':>10}")
+    for r in resultados:
+        print(f"{r['destinatarios']:>13} | {r['antiguo']['us_por_broadcast']:>11.1f} | "
+              f"{r['nuevo']['us_por_broadcast']:>11.1f} | {r['antiguo']['bytes_asignados']:>10} | "
+              f"{r['nuevo']['bytes_asignados']:>10}")
+
+if __name__ == '__main__':
+    main()
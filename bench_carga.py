@@ -0,0 +1,251 @@
+"""
+Generador de carga y medición de latencia para el servidor de chat.
+
+Abre muchas conexiones simuladas (como conectar_cliente en los tests de
+integración, pero con asyncio para poder sostener miles en un solo proceso),
+hace que una parte de ellas envíe mensajes a una tasa y tamaño configurables y
+mide en los receptores la latencia de punta a punta de cada entrega.
+
+El resultado se imprime como JSON para poder guardarlo y comparar versiones:
+
+    python bench_carga.py --clientes 2000 --emisores 20 --tasa 10 --duracion 10 > resultado.json
+
+Con --lanzar-servidor el propio benchmark arranca server.py (con las opciones
+extra que se pasen después de --) y lo detiene al terminar. Con --port 0 usa
+un puerto libre, así que se pueden correr varios benchmarks a la vez:
+
+    python bench_carga.py --lanzar-servidor --port 0 -- --engine asyncio --protocolo binario
+
+Con --comprimir (solo binario) cada receptor pide los broadcasts comprimidos y
+'bytes_entregados_por_segundo' pasa a contar los bytes tal como llegan por la red.
+"""
+import argparse
+import asyncio
+import json
+import struct
+import time
+from array import array
+
+from compresion import leer_cabecera, descomprimir
+from servidor_chat import ServidorChat
+
+MARCA = b"bench "
+MARCA_SINCRONIZACION = b"bench-sync"
+LATIDO = b"[servidor] /ping"
+CABECERA = struct.Struct('!I')
+
+def subir_limite_de_descriptores():
+    # Miles de conexiones necesitan miles de descriptores de archivo
+    try:
+        import resource
+    except ImportError:
+        return
+    blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if blando < duro:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+class Resultados:
+    def __init__(self):
+        self.enviados = 0
+        self.recibidos = 0
+        self.bytes_recibidos = 0
+        self.errores = 0
+        self.sincronizados = 0
+        self.latencias_ns = array('q')
+        self.fin_lectura = float('inf')
+
+    def registrar_entrega(self, linea, ahora_ns, bytes_red=None):
+        # Formato del cuerpo: "bench <emisor> <secuencia> <t_envio_ns> <relleno>"
+        inicio = linea.find(MARCA)
+        if inicio == -1:
+            return
+        campos = linea[inicio + len(MARCA):].split(b' ', 3)
+        self.recibidos += 1
+        self.bytes_recibidos += len(linea) if bytes_red is None else bytes_red
+        self.latencias_ns.append(ahora_ns - int(campos[2]))
+
+def armar_mensaje(id_emisor, secuencia, tamano, protocolo):
+    cuerpo = b"%s%d %d %d " % (MARCA, id_emisor, secuencia, time.perf_counter_ns())
+    if len(cuerpo) < tamano:
+        cuerpo += b"x" * (tamano - len(cuerpo))
+    return entramar(cuerpo, protocolo)
+
+def entramar(cuerpo, protocolo):
+    if protocolo == 'binario':
+        return CABECERA.pack(len(cuerpo)) + cuerpo
+    return cuerpo + b"\n"
+
+async def leer_mensajes(reader, writer, protocolo, resultados, comprimir=False):
+    sincronizado = False
+    if comprimir:
+        writer.write(entramar(b"/comprimir", protocolo))
+    while time.monotonic() < resultados.fin_lectura:
+        bytes_red = None
+        if protocolo == 'binario':
+            longitud, comprimida = leer_cabecera(await reader.readexactly(CABECERA.size))
+            datos = await reader.readexactly(longitud)
+            if comprimida:
+                bytes_red = CABECERA.size + longitud
+                datos = descomprimir(datos)
+        else:
+            datos = await reader.readline()
+            if not datos:
+                return
+        if datos.startswith(LATIDO):
+            # Un receptor que no envía nada igual tiene que contestar los latidos
+            writer.write(entramar(b"/pong", protocolo))
+            continue
+        if not sincronizado and MARCA_SINCRONIZACION in datos:
+            sincronizado = True
+            resultados.sincronizados += 1
+            continue
+        resultados.registrar_entrega(datos, time.perf_counter_ns(), bytes_red)
+
+async def emitir(writer, id_emisor, args, resultados, fin):
+    intervalo = 1 / args.tasa
+    secuencia = 0
+    proximo = time.monotonic()
+    while time.monotonic() < fin:
+        writer.write(armar_mensaje(id_emisor, secuencia, args.tamano, args.protocolo))
+        await writer.drain()
+        resultados.enviados += 1
+        secuencia += 1
+        proximo += intervalo
+        espera = proximo - time.monotonic()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+async def conectar(args, resultados, limite_conexiones):
+    try:
+        async with limite_conexiones:
+            return await asyncio.open_connection(args.host, args.port)
+    except OSError:
+        resultados.errores += 1
+        return None
+
+async def sincronizar(writer, args, resultados, esperados):
+    """
+    Que connect() haya terminado no garantiza que el servidor ya aceptó la
+    conexión (puede seguir en su backlog). Se repite un mensaje de
+    sincronización hasta que todos los receptores lo vieron: recién entonces
+    todos están registrados y empieza la medición.
+    """
+    limite = time.monotonic() + args.espera_sincronizacion
+    while resultados.sincronizados < esperados and time.monotonic() < limite:
+        writer.write(entramar(MARCA_SINCRONIZACION, args.protocolo))
+        await writer.drain()
+        await asyncio.sleep(0.5)
+    return resultados.sincronizados
+
+async def ejecutar(args):
+    resultados = Resultados()
+    limite_conexiones = asyncio.Semaphore(args.conexiones_simultaneas)
+
+    inicio_conexion = time.monotonic()
+    conexiones = await asyncio.gather(*(conectar(args, resultados, limite_conexiones)
+                                        for _ in range(args.clientes)))
+    conexiones = [c for c in conexiones if c]
+    if not conexiones:
+        raise SystemExit("No se pudo abrir ninguna conexión con el servidor")
+
+    lectores = [asyncio.create_task(leer_mensajes(reader, writer, args.protocolo, resultados, args.comprimir))
+                for reader, writer in conexiones]
+    sincronizados = await sincronizar(conexiones[0][1], args, resultados, len(conexiones) - 1)
+    tiempo_conexion = time.monotonic() - inicio_conexion
+
+    inicio = time.monotonic()
+    fin_envio = inicio + args.duracion
+    resultados.fin_lectura = fin_envio + args.espera_final
+
+    emisores = [asyncio.create_task(emitir(writer, i, args, resultados, fin_envio))
+                for i, (_, writer) in enumerate(conexiones[:args.emisores])]
+    await asyncio.gather(*emisores, return_exceptions=True)
+
+    # Se dejan terminar las entregas en vuelo y luego se corta la lectura
+    await asyncio.wait(lectores, timeout=max(0, resultados.fin_lectura - time.monotonic()))
+    for tarea in lectores:
+        tarea.cancel()
+    for _, writer in conexiones:
+        writer.close()
+    duracion_real = time.monotonic() - inicio
+
+    latencias = sorted(resultados.latencias_ns)
+    ms = lambda ns: None if ns is None else ns / 1e6
+    return {
+        'configuracion': {
+            'clientes': args.clientes,
+            'emisores': args.emisores,
+            'tasa_por_emisor': args.tasa,
+            'tamano': args.tamano,
+            'duracion': args.duracion,
+            'protocolo': args.protocolo,
+            'comprimir': args.comprimir,
+        },
+        'tiempo_conexion_s': tiempo_conexion,
+        'errores_conexion': resultados.errores,
+        'receptores_sincronizados': sincronizados,
+        'mensajes_enviados': resultados.enviados,
+        'mensajes_por_segundo': resultados.enviados / args.duracion,
+        'entregas': resultados.recibidos,
+        'entregas_esperadas': resultados.enviados * (len(conexiones) - 1),
+        'entregas_por_segundo': resultados.recibidos / duracion_real,
+        'bytes_entregados_por_segundo': resultados.bytes_recibidos / duracion_real,
+        'latencia_ms': {
+            'p50': ms(percentil(latencias, 50)),
+            'p99': ms(percentil(latencias, 99)),
+            'p999': ms(percentil(latencias, 99.9)),
+            'max': ms(latencias[-1] if latencias else None),
+        },
+    }
+
+def lanzar_servidor(args, opciones_servidor):
+    servidor = ServidorChat('--protocolo', args.protocolo, *opciones_servidor, host=args.host, puerto=args.port)
+    # Con --port 0 el servidor elige un puerto libre y el benchmark usa ese
+    args.host, args.port = servidor.iniciar()
+    return servidor
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de carga del servidor de chat")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3001)
+    parser.add_argument('--clientes', type=int, default=1000, help="Conexiones simuladas en total")
+    parser.add_argument('--emisores', type=int, default=10, help="Cuántas de ellas envían mensajes")
+    parser.add_argument('--tasa', type=float, default=10, help="Mensajes por segundo de cada emisor")
+    parser.add_argument('--tamano', type=int, default=128, help="Tamaño del cuerpo de cada mensaje en bytes")
+    parser.add_argument('--duracion', type=float, default=10, help="Segundos de envío")
+    parser.add_argument('--espera-final', type=float, default=2,
+                        help="Segundos que se siguen leyendo entregas después de dejar de enviar")
+    parser.add_argument('--protocolo', choices=('lineas', 'binario'), default='lineas')
+    parser.add_argument('--comprimir', action='store_true',
+                        help="Los receptores negocian /comprimir (requiere --protocolo binario)")
+    parser.add_argument('--conexiones-simultaneas', type=int, default=200,
+                        help="Conexiones en curso a la vez durante el arranque (no saturar el backlog)")
+    parser.add_argument('--espera-sincronizacion', type=float, default=30,
+                        help="Segundos máximos esperando a que el servidor registre todas las conexiones")
+    parser.add_argument('--lanzar-servidor', action='store_true',
+                        help="Arranca server.py con las opciones que siguen a '--'")
+    args, opciones_servidor = parser.parse_known_args(argv)
+    if args.comprimir and args.protocolo != 'binario':
+        parser.error("--comprimir requiere --protocolo binario")
+    if opciones_servidor and opciones_servidor[0] == '--':
+        opciones_servidor = opciones_servidor[1:]
+
+    subir_limite_de_descriptores()
+
+    servidor = lanzar_servidor(args, opciones_servidor) if args.lanzar_servidor else None
+    try:
+        resultado = asyncio.run(ejecutar(args))
+    finally:
+        if servidor:
+            servidor.detener()
+
+    print(json.dumps(resultado, indent=2))
+
+if __name__ == '__main__':
+    main()
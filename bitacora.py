@@ -0,0 +1,430 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+from colas import ColaSalida, DESCARTAR_NUEVO
+import registro
+
+# Entrada del log: cabecera + sala + prefijo + cuerpo.
+# La cabecera lleva el largo del resto, la secuencia, el tiempo en ns y los largos de sala y prefijo.
+CABECERA_ENTRADA = struct.Struct('!IQqHH')
+# Entrada del índice disperso (.idx): secuencia, tiempo en ns y posición dentro del segmento
+ENTRADA_INDICE = struct.Struct('!QqQ')
+
+# Políticas de fsync (group commit: se sincroniza una vez por lote escrito)
+SIEMPRE = 'siempre'       # después de cada lote, antes de tomar el siguiente
+INTERVALO = 'intervalo'   # como mucho cada --bitacora-intervalo-ms
+NUNCA = 'nunca'           # lo decide el sistema operativo
+
+POLITICAS_FSYNC = (SIEMPRE, INTERVALO, NUNCA)
+
+BYTES_ENTRE_INDICES = 4096   # una entrada de índice cada ~4 KiB de log
+BYTES_ENTRE_COMPACTACIONES = 1024 * 1024   # la retención se revisa cada ~1 MiB escrito, no solo al rotar
+_FIN = None                  # marca en la cola para que el escritor termine
+
+class _Segmento:
+    """
+    Un archivo del log (`<secuencia_base>.log`) con su índice disperso
+    (`<secuencia_base>.idx`). El índice en memoria son tres arrays paralelos.
+    """
+
+    def __init__(self, directorio, base):
+        self.base = base
+        self.ruta = os.path.join(directorio, f"{base:020d}.log")
+        self.ruta_indice = os.path.join(directorio, f"{base:020d}.idx")
+        self.secuencias = array('Q')
+        self.tiempos = array('q')
+        self.posiciones = array('Q')
+        self.fin = 0              # bytes con entradas completas
+        self.ultima = base - 1    # última secuencia escrita
+        self.mapa = None
+        self.archivo_indice = None
+
+    def indexar(self, secuencia, tiempo, posicion):
+        self.secuencias.append(secuencia)
+        self.tiempos.append(tiempo)
+        self.posiciones.append(posicion)
+        if self.archivo_indice:
+            self.archivo_indice.write(ENTRADA_INDICE.pack(secuencia, tiempo, posicion))
+
+    def cargar_indice(self):
+        try:
+            with open(self.ruta_indice, 'rb') as archivo:
+                datos = archivo.read()
+        except FileNotFoundError:
+            return
+        completos = len(datos) - len(datos) % ENTRADA_INDICE.size
+        for secuencia, tiempo, posicion in ENTRADA_INDICE.iter_unpack(datos[:completos]):
+            self.secuencias.append(secuencia)
+            self.tiempos.append(tiempo)
+            self.posiciones.append(posicion)
+
+    def cerrar(self):
+        if self.mapa is not None:
+            self.mapa.close()
+            self.mapa = None
+        if self.archivo_indice is not None:
+            self.archivo_indice.close()
+            self.archivo_indice = None
+
+def _entradas(mapa, posicion, fin):
+    """Recorre las entradas entre `posicion` y `fin`: (secuencia, tiempo, sala, prefijo, cuerpo)."""
+    while posicion + CABECERA_ENTRADA.size <= fin:
+        largo, secuencia, tiempo, largo_sala, largo_prefijo = CABECERA_ENTRADA.unpack_from(mapa, posicion)
+        inicio = posicion + CABECERA_ENTRADA.size
+        sala = str(mapa[inicio:inicio + largo_sala], 'utf-8')
+        inicio += largo_sala
+        prefijo = mapa[inicio:inicio + largo_prefijo]
+        cuerpo = mapa[inicio + largo_prefijo:posicion + CABECERA_ENTRADA.size + largo]
+        yield secuencia, tiempo, sala, prefijo, cuerpo
+        posicion += CABECERA_ENTRADA.size + largo
+
+class BitacoraMensajes:
+    """
+    Log durable de broadcasts: solo se agrega al final, en segmentos
+    preasignados que se escriben a través de mmap. Un índice disperso por
+    segmento permite reproducir desde una secuencia o desde un instante con
+    dos búsquedas binarias y un recorrido corto.
+
+    agregar() solo encola: la escritura, el fsync y la rotación los hace un
+    hilo propio, así que no suma latencia a Broadcast_mensajes. Si ese hilo
+    no da abasto la entrada se pierde: se cuenta en `descartados`, se avisa
+    a `al_descartar()` y se registra una advertencia.
+
+    Las lecturas toman el lock solo para anotar qué rango de cada segmento
+    leer; el recorrido se hace sin él, con un mapeo propio.
+    """
+
+    def __init__(self, directorio, tamano_segmento=64 * 1024 * 1024, politica_fsync=INTERVALO,
+                 intervalo_ms=100, retencion_bytes=None, retencion_segundos=None, capacidad_cola=65536,
+                 al_descartar=None):
+        if politica_fsync not in POLITICAS_FSYNC:
+            raise ValueError(f"Política de fsync desconocida: {politica_fsync}")
+
+        self.directorio = directorio
+        self.tamano_segmento = tamano_segmento
+        self.politica_fsync = politica_fsync
+        self.intervalo = intervalo_ms / 1000
+        self.retencion_bytes = retencion_bytes
+        self.retencion_segundos = retencion_segundos
+
+        self._segmentos = []   # del más viejo al más nuevo; el último es el activo
+        self._ultimo_tiempo = 0
+        self._ultima_sincronizacion = time.monotonic()
+        self._sin_sincronizar = False
+        self._escritos_sin_compactar = 0
+        self._lock = threading.Lock()
+        self._al_descartar = al_descartar
+        self._cola = ColaSalida(capacidad_cola, DESCARTAR_NUEVO, al_descartar=self._descarte)
+        self._hilo = None
+
+        os.makedirs(directorio, exist_ok=True)
+        self._recuperar()
+        self._abrir_segmento(self.ultima_secuencia + 1)
+        self.compactar()
+
+    # --- API pública ---
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._escritor, daemon=True)
+        self._hilo.start()
+
+    def agregar(self, sala, prefijo, cuerpo):
+        """Encola un broadcast para escribirlo en el log. No bloquea."""
+        self._cola.encolar((time.time_ns(), sala, prefijo, cuerpo))
+
+    @property
+    def descartados(self):
+        """Entradas perdidas porque el escritor no daba abasto (cola llena)."""
+        return self._cola.descartados
+
+    def _descarte(self):
+        if self._al_descartar:
+            self._al_descartar()
+        # El registro ya corta las advertencias repetidas del mismo evento
+        registro.advertencia('bitacora_llena', "Cola de la bitácora llena, la entrada no queda en el log",
+                             descartados=self._cola.descartados)
+
+    @property
+    def ultima_secuencia(self):
+        return self._segmentos[-1].ultima if self._segmentos else 0
+
+    def leer_desde(self, secuencia, limite=None):
+        """
+        Entradas con secuencia >= `secuencia`, en orden, como tuplas
+        (secuencia, tiempo_ns, sala, prefijo, cuerpo).
+        """
+        with self._lock:
+            i = max(0, bisect.bisect_right([s.base for s in self._segmentos], secuencia) - 1)
+            tramos = self._tramos(i, lambda segmento: segmento.secuencias, secuencia)
+        return self._leer(tramos, lambda entrada: entrada[0] >= secuencia, limite)
+
+    def leer_desde_tiempo(self, tiempo_ns, limite=None):
+        """Entradas escritas en `tiempo_ns` o después (tiempo de time.time_ns())."""
+        with self._lock:
+            primeros = [s.tiempos[0] if s.tiempos else tiempo_ns for s in self._segmentos]
+            i = max(0, bisect.bisect_left(primeros, tiempo_ns) - 1)
+            tramos = self._tramos(i, lambda segmento: segmento.tiempos, tiempo_ns)
+        return self._leer(tramos, lambda entrada: entrada[1] >= tiempo_ns, limite)
+
+    def ultimos(self, cantidad):
+        """Las últimas `cantidad` entradas del log."""
+        return self.leer_desde(max(1, self.ultima_secuencia - cantidad + 1), cantidad)
+
+    def compactar(self):
+        """
+        Borra los segmentos cerrados más viejos mientras el log supere
+        retencion_bytes o el segmento sea más viejo que retencion_segundos.
+        """
+        with self._lock:
+            self._compactar()
+
+    def cerrar(self):
+        """Escribe lo pendiente, sincroniza y cierra el segmento activo."""
+        if self._hilo is not None:
+            self._cola.encolar(_FIN)
+            self._hilo.join(timeout=5)
+            self._hilo = None
+        self._cola.cerrar()
+        with self._lock:
+            self._sincronizar()
+            self._sellar(self._segmentos[-1])
+            for segmento in self._segmentos:
+                segmento.cerrar()
+
+    # --- Lectura ---
+
+    def _tramos(self, i, claves, valor):
+        # Con el lock tomado: (ruta, desde, hasta) de cada segmento a recorrer.
+        # Desde la última entrada del índice anterior al valor buscado.
+        tramos = []
+        for segmento in self._segmentos[i:]:
+            if segmento.fin:
+                j = bisect.bisect_left(claves(segmento), valor) - 1
+                tramos.append((segmento.ruta, segmento.posiciones[j] if j >= 0 else 0, segmento.fin))
+        return tramos
+
+    def _leer(self, tramos, incluir, limite):
+        # Sin el lock: lo que se escriba después queda más allá de cada `hasta`,
+        # y un segmento que la retención borre mientras tanto ya no se lee
+        resultado = []
+        for ruta, posicion, fin in tramos:
+            try:
+                archivo = open(ruta, 'rb')
+            except FileNotFoundError:
+                continue
+            with archivo, mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                for entrada in _entradas(mapa, posicion, fin):
+                    if incluir(entrada):
+                        resultado.append(entrada)
+                        if limite is not None and len(resultado) >= limite:
+                            return resultado
+        return resultado
+
+    # --- Escritura (hilo propio) ---
+
+    def _escritor(self):
+        espera = self.intervalo if self.politica_fsync == INTERVALO else None
+        terminar = False
+        while not terminar:
+            pendientes = self._cola.extraer(timeout=espera)
+            if pendientes is None:
+                break
+            if pendientes:
+                if _FIN in pendientes:
+                    pendientes = pendientes[:pendientes.index(_FIN)]
+                    terminar = True
+                try:
+                    with self._lock:
+                        for entrada in pendientes:
+                            self._escribir(*entrada)
+                        if self.politica_fsync == SIEMPRE:
+                            self._sincronizar()
+                except (OSError, ValueError) as e:
+                    registro.error('bitacora', "Error al escribir en el log de mensajes", error=e)
+            if (self.politica_fsync == INTERVALO and self._sin_sincronizar and
+                    time.monotonic() - self._ultima_sincronizacion >= self.intervalo):
+                with self._lock:
+                    self._sincronizar()
+
+    def _escribir(self, tiempo, sala, prefijo, cuerpo):
+        # Los tiempos del log nunca retroceden, así la búsqueda binaria por tiempo es válida
+        tiempo = max(tiempo, self._ultimo_tiempo)
+        self._ultimo_tiempo = tiempo
+
+        sala_bytes = sala.encode('utf-8')
+        largo = len(sala_bytes) + len(prefijo) + len(cuerpo)
+        total = CABECERA_ENTRADA.size + largo
+
+        segmento = self._segmentos[-1]
+        if segmento.fin + total > len(segmento.mapa):
+            self._rotar(total)
+            segmento = self._segmentos[-1]
+
+        secuencia = segmento.ultima + 1
+        posicion = segmento.fin
+        if not segmento.posiciones or posicion - segmento.posiciones[-1] >= BYTES_ENTRE_INDICES:
+            segmento.indexar(secuencia, tiempo, posicion)
+
+        # Primero el contenido y al final la cabecera: una entrada a medias
+        # queda con largo 0 y la recuperación la ignora
+        inicio = posicion + CABECERA_ENTRADA.size
+        for parte in (sala_bytes, prefijo, cuerpo):
+            segmento.mapa[inicio:inicio + len(parte)] = parte
+            inicio += len(parte)
+        CABECERA_ENTRADA.pack_into(segmento.mapa, posicion, largo, secuencia, tiempo,
+                                   len(sala_bytes), len(prefijo))
+
+        segmento.fin = posicion + total
+        segmento.ultima = secuencia
+        self._sin_sincronizar = True
+
+        self._escritos_sin_compactar += total
+        if self._escritos_sin_compactar >= BYTES_ENTRE_COMPACTACIONES:
+            self._compactar()
+
+    def _sincronizar(self):
+        segmento = self._segmentos[-1]
+        if segmento.mapa is not None:
+            segmento.mapa.flush()   # msync: el fsync de un archivo mapeado
+        if segmento.archivo_indice is not None:
+            segmento.archivo_indice.flush()
+            os.fsync(segmento.archivo_indice.fileno())
+        self._sin_sincronizar = False
+        self._ultima_sincronizacion = time.monotonic()
+
+    def _rotar(self, necesario):
+        activo = self._segmentos[-1]
+        self._sincronizar()
+        self._sellar(activo)
+        self._abrir_segmento(activo.ultima + 1, necesario)
+        registro.info('bitacora', "Nuevo segmento del log de mensajes", base=activo.ultima + 1)
+        self._compactar()
+
+    def _compactar(self):
+        self._escritos_sin_compactar = 0
+        limite_edad = time.time() - self.retencion_segundos if self.retencion_segundos else None
+        total = sum(segmento.fin for segmento in self._segmentos)
+        while len(self._segmentos) > 1:
+            viejo = self._segmentos[0]
+            por_tamano = self.retencion_bytes is not None and total > self.retencion_bytes
+            por_edad = limite_edad is not None and os.path.getmtime(viejo.ruta) < limite_edad
+            if not (por_tamano or por_edad):
+                break
+            total -= viejo.fin
+            self._borrar(viejo)
+
+    def _sellar(self, segmento):
+        # Un segmento cerrado se recorta a lo usado; las lecturas lo mapean aparte
+        segmento.cerrar()
+        if segmento.fin:
+            os.truncate(segmento.ruta, segmento.fin)
+        else:
+            self._borrar(segmento)
+
+    def _borrar(self, segmento):
+        segmento.cerrar()
+        for ruta in (segmento.ruta, segmento.ruta_indice):
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+        self._segmentos.remove(segmento)
+
+    def _abrir_segmento(self, base, necesario=0):
+        segmento = _Segmento(self.directorio, base)
+        tamano = max(self.tamano_segmento, necesario)
+        with open(segmento.ruta, 'w+b') as archivo:
+            archivo.truncate(tamano)
+            segmento.mapa = mmap.mmap(archivo.fileno(), tamano)
+        segmento.archivo_indice = open(segmento.ruta_indice, 'wb')
+        self._segmentos.append(segmento)
+
+    # --- Recuperación al arrancar ---
+
+    def _recuperar(self):
+        bases = sorted(int(nombre[:-4]) for nombre in os.listdir(self.directorio)
+                       if nombre.endswith('.log') and nombre[:-4].isdigit())
+        for base in bases:
+            segmento = _Segmento(self.directorio, base)
+            segmento.cargar_indice()
+            segmento.fin = os.path.getsize(segmento.ruta)
+            if segmento.tiempos:
+                self._ultimo_tiempo = max(self._ultimo_tiempo, segmento.tiempos[-1])
+            self._segmentos.append(segmento)
+
+        # Los segmentos cerrados terminan en la siguiente base; el último pudo
+        # quedar abierto (preasignado y con ceros al final) y se recorre
+        for anterior, siguiente in zip(self._segmentos, self._segmentos[1:]):
+            anterior.ultima = siguiente.base - 1
+        if self._segmentos:
+            self._recuperar_ultimo(self._segmentos[-1])
+
+    def _recuperar_ultimo(self, segmento):
+        fin_valido = 0
+        ultima = segmento.base - 1
+        if segmento.fin:
+            with open(segmento.ruta, 'rb') as archivo:
+                with mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                    # Se recorre desde la última entrada del índice; si esa entrada
+                    # no llegó a escribirse, desde el principio del segmento
+                    if segmento.posiciones:
+                        fin_valido, ultima = self._recorrer(mapa, segmento.posiciones[-1],
+                                                            segmento.secuencias[-1] - 1)
+                    if fin_valido == 0 or (segmento.posiciones and fin_valido == segmento.posiciones[-1]):
+                        fin_valido, ultima = self._recorrer(mapa, 0, segmento.base - 1)
+
+        # Se descarta lo que el índice apunte más allá de lo válido
+        while segmento.posiciones and segmento.posiciones[-1] >= fin_valido:
+            segmento.secuencias.pop()
+            segmento.tiempos.pop()
+            segmento.posiciones.pop()
+        segmento.fin = fin_valido
+        segmento.ultima = ultima
+        self._sellar(segmento)
+        if segmento in self._segmentos:
+            # El índice en disco se reescribe con solo las entradas válidas
+            with open(segmento.ruta_indice, 'wb') as archivo:
+                for entrada in zip(segmento.secuencias, segmento.tiempos, segmento.posiciones):
+                    archivo.write(ENTRADA_INDICE.pack(*entrada))
+
+    def _recorrer(self, mapa, posicion, ultima):
+        """
+        Avanza por las entradas completas y consecutivas desde `posicion`.
+        Devuelve (fin de la última entrada válida, su secuencia).
+        """
+        while posicion + CABECERA_ENTRADA.size <= len(mapa):
+            largo, secuencia, tiempo, _, _ = CABECERA_ENTRADA.unpack_from(mapa, posicion)
+            siguiente = posicion + CABECERA_ENTRADA.size + largo
+            if largo == 0 or secuencia != ultima + 1 or siguiente > len(mapa):
+                break
+            ultima = secuencia
+            self._ultimo_tiempo = max(self._ultimo_tiempo, tiempo)
+            posicion = siguiente
+        return posicion, ultima
+
+def abrir_bitacora(config, al_descartar=None):
+    """
+    Crea e inicia la bitácora según las opciones --bitacora* de server.py.
+    Con --workers N cada worker escribe en su propio subdirectorio.
+    `al_descartar()` se llama por cada entrada perdida con la cola llena.
+    """
+    directorio = config.bitacora
+    if config.workers > 1:
+        directorio = os.path.join(directorio, f"worker-{config.id_worker}")
+
+    bitacora = BitacoraMensajes(
+        directorio,
+        tamano_segmento=int(config.bitacora_segmento_mb * 1024 * 1024),
+        politica_fsync=config.bitacora_fsync,
+        intervalo_ms=config.bitacora_intervalo_ms,
+        retencion_bytes=int(config.bitacora_retencion_mb * 1024 * 1024) if config.bitacora_retencion_mb else None,
+        retencion_segundos=config.bitacora_retencion_horas * 3600 if config.bitacora_retencion_horas else None,
+        al_descartar=al_descartar,
+    )
+    bitacora.iniciar()
+    return bitacora
@@ -0,0 +1,121 @@
+import selectors
+import socket
+import struct
+import threading
+
+from colas import ColaSalida, DESCARTAR_ANTIGUO
+from protocolo import LectorTramas, BINARIO, CABECERA, enviar_vectorizado
+import registro
+
+# Trama del bus: CABECERA (longitud total) + longitudes de sala y prefijo + sala + prefijo + cuerpo
+CABECERA_BUS = struct.Struct('!HH')
+
+def crear_malla(cantidad):
+    """
+    Crea una malla completa de socketpairs Unix entre `cantidad` workers.
+    Devuelve, para cada worker, un dict id_del_par -> socket conectado con él.
+    Debe llamarse antes del fork para que cada hijo herede sus extremos.
+    """
+    extremos = [{} for _ in range(cantidad)]
+    for i in range(cantidad):
+        for j in range(i + 1, cantidad):
+            a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            extremos[i][j] = a
+            extremos[j][i] = b
+    return extremos
+
+def extremos_del_worker(malla, id_worker):
+    """
+    Cierra en este proceso todos los extremos que pertenecen a otros workers
+    y devuelve los propios.
+    """
+    for otro, extremos in enumerate(malla):
+        if otro != id_worker:
+            for sock in extremos.values():
+                sock.close()
+    return malla[id_worker]
+
+class BusDifusion:
+    """
+    Bus local entre workers de un mismo servidor. Cada broadcast se publica a
+    todos los demás workers, que lo reparten a sus propios clientes. Cada par
+    tiene su cola de salida y su hilo escritor, así que publicar nunca bloquea
+    el hilo del cliente.
+    """
+
+    def __init__(self, extremos, capacidad_cola=65536):
+        self._extremos = extremos   # id_par -> socket
+        self._capacidad_cola = capacidad_cola
+        self._colas = {}
+        self._activo = False
+
+    def iniciar(self, al_recibir):
+        """
+        Arranca los hilos del bus. `al_recibir(sala, prefijo, cuerpo)` se llama
+        desde el hilo lector por cada mensaje publicado por otro worker.
+        """
+        self._activo = True
+        for par, sock in self._extremos.items():
+            cola = ColaSalida(self._capacidad_cola, DESCARTAR_ANTIGUO)
+            self._colas[par] = cola
+            threading.Thread(target=self._escritor, args=(sock, cola), daemon=True).start()
+        threading.Thread(target=self._lector, args=(al_recibir,), daemon=True).start()
+
+    def publicar(self, sala, prefijo, cuerpo):
+        sala_bytes = sala.encode('utf-8')
+        longitud = CABECERA_BUS.size + len(sala_bytes) + len(prefijo) + len(cuerpo)
+        cabecera = CABECERA.pack(longitud) + CABECERA_BUS.pack(len(sala_bytes), len(prefijo))
+        # La misma tupla de buffers se encola para todos los pares
+        mensaje = (cabecera, sala_bytes, prefijo, cuerpo)
+        for cola in self._colas.values():
+            cola.encolar(mensaje)
+
+    def cerrar(self):
+        """Detiene los hilos del bus y cierra los extremos de este worker."""
+        self._activo = False
+        for cola in self._colas.values():
+            cola.cerrar()
+        for sock in self._extremos.values():
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _escritor(self, sock, cola):
+        try:
+            while True:
+                pendientes = cola.extraer()
+                if pendientes is None:
+                    break
+                for mensaje in pendientes:
+                    enviar_vectorizado(sock, mensaje)
+        except OSError as e:
+            if self._activo:
+                registro.error('bus', "Error en el bus al enviar a otro worker", error=e)
+
+    def _lector(self, al_recibir):
+        selector = selectors.DefaultSelector()
+        for sock in self._extremos.values():
+            selector.register(sock, selectors.EVENT_READ, LectorTramas(BINARIO))
+
+        try:
+            while self._activo and selector.get_map():
+                for clave, _ in selector.select(timeout=1.0):
+                    lector = clave.data
+                    if lector.recibir_de(clave.fileobj) == 0:
+                        # El otro worker terminó
+                        selector.unregister(clave.fileobj)
+                        continue
+                    for trama in lector.tramas():
+                        largo_sala, largo_prefijo = CABECERA_BUS.unpack_from(trama)
+                        inicio = CABECERA_BUS.size
+                        sala = str(trama[inicio:inicio + largo_sala], 'utf-8')
+                        inicio += largo_sala
+                        prefijo = bytes(trama[inicio:inicio + largo_prefijo])
+                        cuerpo = bytes(trama[inicio + largo_prefijo:])
+                        al_recibir(sala, prefijo, cuerpo)
+        except OSError as e:
+            if self._activo:
+                registro.error('bus', "Error en el bus al recibir de otro worker", error=e)
+        finally:
+            selector.close()
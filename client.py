@@ -1,101 +1,64 @@
-import socket
+import argparse
+import asyncio
 import threading
-import time
 
-cliente_activo = True
+from cliente_chat import ClienteChat
 
-def main():
-    global cliente_activo
-
-    host = '127.0.0.1'
-    port = 3000
-
-    socket_cliente = None
+def mostrar_mensaje(mensaje):
+    print(f"\r{mensaje.decode('utf-8', 'replace')}\n> ", end="")
 
+def leer_teclado(bucle, lineas):
+    # input() bloquea: se lee en un hilo daemon para no frenar la recepción ni la salida
+    while True:
+        try:
+            linea = input("> ")
+        except EOFError:
+            linea = None
+        bucle.call_soon_threadsafe(lineas.put_nowait, linea)
+        if linea is None:
+            return
+
+async def chatear(host, port):
+    """
+    Cliente interactivo sobre ClienteChat: lo que se escribe se envía y lo que
+    llega se muestra. Los latidos y las reconexiones los maneja la biblioteca.
+    """
+    cliente = ClienteChat(host, port, al_recibir=mostrar_mensaje)
+    bucle = asyncio.get_running_loop()
+
+    print(f"Intentando conectar a {host}:{port}...")
     try:
-        socket_cliente = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        
-        print(f"Intentando conectar a {host}:{port}...")
-        socket_cliente.connect((host, port))
-        print("¡Conectado al servidor!")
+        await cliente.iniciar(timeout=5)
+    except TimeoutError:
+        print(f"Error: no se pudo conectar. Asegúrate de que el servidor esté ejecutándose en {host}:{port}.")
+        return
+    print("¡Conectado al servidor!")
 
-        recibir_thread = threading.Thread(target=recibir_mensaje, args=(socket_cliente,), daemon=True)
-        recibir_thread.start()
-
-        enviar_mensajes(socket_cliente)
-
-    except ConnectionRefusedError: 
-        print(f"Error: Conexión rechazada. Asegúrate de que el servidor esté ejecutándose en {host}:{port}.")
-    except Exception as e:
-        print(f"Ocurrió un error inesperado en el cliente: {e}")
-    finally:
-        
-        cliente_activo = False   
-
-        if socket_cliente: 
-            print("Cerrando conexión del cliente...")
-            try:
-                socket_cliente.shutdown(socket.SHUT_RDWR)  
-            except OSError:  
-                pass 
-            except Exception as e:
-                print(f"Advertencia al apagar el socket: {e}")
-            finally:
-                socket_cliente.close()  
-            
-        time.sleep(0.1)
-                        
-        print("Cliente finalizado.")
-
-def enviar_mensajes(client_socket):
     print("Escribe tus mensajes. Escribe 'salir' para desconectarte.")
-    while True:
-        try:
-            mensaje_usuario = input("> ")
+    lineas = asyncio.Queue()
+    threading.Thread(target=leer_teclado, args=(bucle, lineas), daemon=True).start()
+    try:
+        while True:
+            mensaje_usuario = await lineas.get()
+            if mensaje_usuario is None:
+                break
             if mensaje_usuario.lower() == 'salir':
                 print("Desconectando...")
                 break
-            client_socket.sendall(mensaje_usuario.encode('utf-8'))
-
-        except OSError as e:
-            print(f"Error de conexión al enviar: {e}")
-            break
-        except Exception as e:
-            print(f"Error inesperado al enviar: {e}")
-            break
-    
-    print("Hilo de envío terminado.")
-
-def recibir_mensaje(socket_cliente):
-
-    global cliente_activo
-
-    socket_cliente.settimeout(0.5) 
-
-    while cliente_activo:
-        try:
-            data = socket_cliente.recv(1024) 
-
-            if not data: 
-                print(f"El servidor se desconecto.")
-                break 
-
-            mensaje = data.decode('utf-8').strip()
-            print(f"\r{mensaje}\n> ", end="")
-        
-        except socket.timeout:
-            continue
-        except OSError as e: 
-            if cliente_activo: 
-                print(f"Error al recibir mensaje: {e}")
-            break 
-            
-        except Exception as e:
-            if cliente_activo: 
-                print(f"Error inesperado al recibir mensaje: {e}")
-            break
+            if not cliente.conectado.is_set():
+                print("Sin conexión: el mensaje se enviará al reconectar.")
+            cliente.enviar(mensaje_usuario)
+    finally:
+        print("Cerrando conexión del cliente...")
+        await cliente.cerrar()
+        print("Cliente finalizado.")
 
-    print("Saliendo del cliente...")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cliente de chat interactivo")
+    parser.add_argument('--host', default='127.0.0.1', help="Dirección del servidor")
+    parser.add_argument('--port', type=int, default=3001, help="Puerto del servidor")
+    args = parser.parse_args(argv)
+    asyncio.run(chatear(args.host, args.port))
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,295 @@
+import asyncio
+import collections
+import random
+import zlib
+
+from protocolo import LINEAS, BINARIO, CABECERA, SALTO, PREFIJO_SERVIDOR, PING, PONG, interpretar_comando, \
+    ErrorProtocolo
+from compresion import COMPRIMIR, DESACTIVAR, leer_cabecera, descomprimir
+from directos import NICK, MSG
+
+LATIDO = PREFIJO_SERVIDOR + PING.encode('utf-8')
+
+# Errores que solo significan que se perdió la conexión (o que el flujo quedó
+# desincronizado): se reconecta en lugar de terminar
+ERRORES_CONEXION = (OSError, asyncio.IncompleteReadError, ErrorProtocolo)
+
+class ClienteChat:
+    """
+    Cliente asíncrono del chat, pensado para bots y puentes que manejan muchas
+    conexiones en un mismo bucle de eventos.
+
+    - enviar() no espera a la red: deja la trama en un buffer de salida que una
+      tarea escritora vacía en lotes (una sola escritura por lote).
+    - Lo recibido se reensambla por línea o por trama binaria (y se
+      descomprime si se negoció /comprimir); se entrega sin el salto de línea,
+      como bytes, a `al_recibir` o a recibir() / `async for`.
+    - enviar_a() manda un mensaje directo a un apodo o '#id'; el servidor
+      contesta '[servidor] Entregado a ...' o el motivo por el que no llegó.
+    - Los latidos del servidor se contestan solos.
+    - Si se corta la conexión se reconecta con espera exponencial y se
+      recupera la sala, el apodo y la compresión. Lo que quedaba en el buffer de salida
+      se envía al reconectar; lo ya escrito en el socket caído se pierde.
+    """
+
+    def __init__(self, host='127.0.0.1', port=3001, protocolo=LINEAS, comprimir=False, reconectar=True,
+                 espera_inicial=0.1, espera_maxima=10.0, capacidad_envio=10000, capacidad_recepcion=10000,
+                 lote_bytes=64 * 1024, al_recibir=None):
+        if comprimir and protocolo != BINARIO:
+            raise ValueError("La compresión solo está disponible con el protocolo binario")
+
+        self.host = host
+        self.port = port
+        self.protocolo = protocolo
+        self.comprimir = comprimir
+        self.reconectar = reconectar
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.capacidad_envio = capacidad_envio
+        self.lote_bytes = lote_bytes
+        self.al_recibir = al_recibir
+
+        self.sala = None          # última sala pedida con /join, se recupera al reconectar
+        self.apodo = None         # último /nick, ídem
+        self.reconexiones = 0
+        self.conectado = asyncio.Event()
+
+        self._pendientes = collections.deque()   # tramas ya armadas, listas para escribir
+        self._hay_pendientes = asyncio.Event()
+        self._vacio = asyncio.Event()             # el buffer de salida se escribió entero
+        self._vacio.set()
+        self._recibidos = asyncio.Queue(capacidad_recepcion)
+        self._writer = None
+        self._tarea = None
+        self._cerrando = False
+        if comprimir:
+            self._encolar(self._entramar(COMPRIMIR.encode('utf-8')))   # lo primero que se envía
+
+    async def __aenter__(self):
+        return await self.iniciar()
+
+    async def __aexit__(self, *exc):
+        await self.cerrar()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        mensaje = await self.recibir()
+        if mensaje is None:
+            raise StopAsyncIteration
+        return mensaje
+
+    async def iniciar(self, timeout=None):
+        """
+        Lanza la tarea que mantiene la conexión y espera a la primera conexión.
+        Sin reconexión, un error al conectar se propaga.
+        """
+        self._tarea = asyncio.create_task(self._mantener())
+        espera = asyncio.ensure_future(self.conectado.wait())
+        await asyncio.wait({espera, self._tarea}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not espera.done():
+            espera.cancel()
+            if self._tarea.done():
+                self._tarea.result()
+            await self.cerrar()
+            raise TimeoutError(f"No se pudo conectar a {self.host}:{self.port}")
+        return self
+
+    def enviar(self, mensaje):
+        """
+        Encola un mensaje (str o bytes) sin esperar a la red. Devuelve False si
+        el buffer de salida está lleno.
+        """
+        if isinstance(mensaje, str):
+            mensaje = mensaje.encode('utf-8')
+        if len(self._pendientes) >= self.capacidad_envio:
+            return False
+        self._anotar_estado(mensaje)
+        self._encolar(self._entramar(mensaje))
+        return True
+
+    def enviar_a(self, destino, mensaje):
+        """Mensaje directo a un apodo o a '#id' (ver enviar())."""
+        if isinstance(mensaje, bytes):
+            mensaje = mensaje.decode('utf-8')
+        return self.enviar(f"{MSG} {destino} {mensaje}")
+
+    async def recibir(self):
+        """
+        Próximo mensaje recibido (bytes sin el salto de línea), o None cuando el
+        cliente terminó.
+        """
+        if not self._recibidos.empty():
+            return self._recibidos.get_nowait()
+        if self._tarea is None or self._tarea.done():
+            return None
+        obtener = asyncio.ensure_future(self._recibidos.get())
+        await asyncio.wait({obtener, self._tarea}, return_when=asyncio.FIRST_COMPLETED)
+        if obtener.done():
+            return obtener.result()
+        obtener.cancel()
+        return self._recibidos.get_nowait() if not self._recibidos.empty() else None
+
+    async def cerrar(self, timeout=1.0):
+        """
+        Espera (como mucho `timeout`) a que se escriba lo pendiente, cierra la
+        conexión y deja de reconectar.
+        """
+        self._cerrando = True
+        if self.conectado.is_set():
+            try:
+                await asyncio.wait_for(self._vacio.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+        if self._tarea is not None:
+            if not self.conectado.is_set():
+                self._tarea.cancel()   # puede estar esperando para reconectar
+            await asyncio.gather(self._tarea, return_exceptions=True)
+
+    def _entramar(self, cuerpo):
+        if self.protocolo == BINARIO:
+            return CABECERA.pack(len(cuerpo)) + cuerpo
+        return cuerpo + SALTO
+
+    def _encolar(self, trama, al_frente=False):
+        if al_frente:
+            self._pendientes.appendleft(trama)
+        else:
+            self._pendientes.append(trama)
+        self._vacio.clear()
+        self._hay_pendientes.set()
+
+    def _anotar_estado(self, mensaje):
+        # Lo que hay que repetir tras una reconexión para volver al mismo estado
+        comando = interpretar_comando(mensaje)
+        if comando is None:
+            return
+        nombre, argumento = comando
+        if nombre == '/join':
+            self.sala = argumento
+        elif nombre == '/leave':
+            self.sala = None
+        elif nombre == NICK and argumento:
+            self.apodo = argumento
+        elif nombre == COMPRIMIR:
+            self.comprimir = argumento.lower() not in DESACTIVAR
+
+    def _restaurar_estado(self):
+        # Va delante de lo pendiente: los mensajes encolados son para esa sala
+        if self.sala:
+            self._encolar(self._entramar(f"/join {self.sala}".encode('utf-8')), al_frente=True)
+        if self.apodo:
+            self._encolar(self._entramar(f"{NICK} {self.apodo}".encode('utf-8')), al_frente=True)
+        if self.comprimir:
+            self._encolar(self._entramar(COMPRIMIR.encode('utf-8')), al_frente=True)
+
+    def _espera(self, intentos):
+        # Espera exponencial con jitter: miles de clientes no reconectan todos a la vez
+        espera = min(self.espera_maxima, self.espera_inicial * (2 ** intentos))
+        return espera * random.uniform(0.5, 1.0)
+
+    async def _mantener(self):
+        intentos = 0
+        primera = True
+        while not self._cerrando:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                if not self.reconectar:
+                    raise
+                await asyncio.sleep(self._espera(intentos))
+                intentos += 1
+                continue
+
+            intentos = 0
+            self._writer = writer
+            if not primera:
+                # En la primera conexión los /join, /nick y /comprimir ya están en lo pendiente
+                self._restaurar_estado()
+            primera = False
+            self.conectado.set()
+            # La conexión termina cuando termina cualquiera de las dos tareas:
+            # un error al escribir también la da por perdida
+            lector = asyncio.ensure_future(self._leer(reader))
+            escritor = asyncio.create_task(self._escribir(writer))
+            try:
+                await asyncio.wait({lector, escritor}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                self.conectado.clear()
+                lector.cancel()
+                escritor.cancel()
+                resultados = await asyncio.gather(lector, escritor, return_exceptions=True)
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+                self._writer = None
+            for resultado in resultados:
+                if isinstance(resultado, Exception) and not isinstance(resultado, ERRORES_CONEXION):
+                    raise resultado
+
+            if self._cerrando or not self.reconectar:
+                break
+            self.reconexiones += 1
+            await asyncio.sleep(self._espera(0))
+
+    async def _escribir(self, writer):
+        while True:
+            await self._hay_pendientes.wait()
+            lote = []
+            tamano = 0
+            while self._pendientes and tamano < self.lote_bytes:
+                trama = self._pendientes.popleft()
+                lote.append(trama)
+                tamano += len(trama)
+            if not self._pendientes:
+                self._hay_pendientes.clear()
+            writer.write(b''.join(lote))
+            await writer.drain()
+            if not self._pendientes:
+                self._vacio.set()
+
+    async def _leer(self, reader):
+        while True:
+            if self.protocolo == BINARIO:
+                longitud, comprimida = leer_cabecera(await reader.readexactly(CABECERA.size))
+                mensaje = await reader.readexactly(longitud)
+                if comprimida:
+                    try:
+                        mensaje = descomprimir(mensaje)
+                    except zlib.error as error:
+                        raise ErrorProtocolo(f"Trama comprimida inválida: {error}") from error
+            else:
+                try:
+                    mensaje = await reader.readline()
+                except ValueError as error:   # línea mayor que el límite del StreamReader
+                    raise ErrorProtocolo(str(error)) from error
+                if not mensaje:
+                    return   # el servidor cerró la conexión
+                mensaje = mensaje.rstrip(SALTO)
+
+            if mensaje == LATIDO:
+                self._encolar(self._entramar(PONG.encode('utf-8')), al_frente=True)
+                continue
+            if self.al_recibir is not None:
+                self.al_recibir(mensaje)
+            else:
+                await self._recibidos.put(mensaje)
+
+async def conectar_muchos(cantidad, host='127.0.0.1', port=3001, simultaneas=200, **opciones):
+    """
+    Abre `cantidad` clientes en el bucle actual, con como mucho `simultaneas`
+    conexiones en curso a la vez para no desbordar el backlog del servidor.
+    """
+    limite = asyncio.Semaphore(simultaneas)
+
+    async def uno():
+        cliente = ClienteChat(host, port, **opciones)
+        async with limite:
+            return await cliente.iniciar()
+
+    return await asyncio.gather(*(uno() for _ in range(cantidad)))
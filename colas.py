@@ -0,0 +1,108 @@
+import threading
+from collections import deque
+
+# Políticas ante una cola llena
+DESCARTAR_ANTIGUO = 'descartar_antiguo'   # se pierde el mensaje más viejo pendiente
+DESCARTAR_NUEVO = 'descartar_nuevo'       # se pierde el mensaje que se intentaba encolar
+DESCONECTAR = 'desconectar'               # el consumidor lento se desconecta
+
+POLITICAS = (DESCARTAR_ANTIGUO, DESCARTAR_NUEVO, DESCONECTAR)
+
+class ColaSalida:
+    """
+    Cola de salida acotada de una conexión. Broadcast_mensajes encola sin
+    bloquear y un escritor propio de la conexión la vacía, de modo que un
+    cliente lento solo se retrasa a sí mismo.
+    """
+
+    def __init__(self, capacidad=1024, politica=DESCARTAR_ANTIGUO, notificar=None, al_descartar=None):
+        if capacidad < 1:
+            raise ValueError("La capacidad de la cola debe ser al menos 1")
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de desborde desconocida: {politica}")
+
+        self.capacidad = capacidad
+        self.politica = politica
+        self.cerrada = False
+
+        # Contadores de la cola (se leen sin lock, son solo informativos)
+        self.encolados = 0
+        self.descartados = 0
+        self.profundidad_maxima = 0
+
+        self._items = deque()
+        self._condicion = threading.Condition(threading.Lock())
+        # Callback opcional que despierta a un escritor que no usa la condición (asyncio)
+        self._notificar = notificar
+        # Callback opcional por cada mensaje perdido (p. ej. un contador de métricas)
+        self._al_descartar = al_descartar
+
+    @property
+    def profundidad(self):
+        return len(self._items)
+
+    def encolar(self, item):
+        """
+        Encola un mensaje aplicando la política de desborde.
+        Devuelve False si el consumidor debe desconectarse (cola cerrada o
+        política 'desconectar' con la cola llena), True en otro caso.
+        """
+        with self._condicion:
+            if self.cerrada:
+                return False
+
+            if len(self._items) >= self.capacidad:
+                self.descartados += 1
+                if self._al_descartar:
+                    self._al_descartar()
+                if self.politica == DESCONECTAR:
+                    return False
+                if self.politica == DESCARTAR_NUEVO:
+                    return True
+                self._items.popleft()
+
+            self._items.append(item)
+            self.encolados += 1
+            if len(self._items) > self.profundidad_maxima:
+                self.profundidad_maxima = len(self._items)
+            self._condicion.notify()
+
+        if self._notificar:
+            self._notificar()
+        return True
+
+    def extraer(self, timeout=None):
+        """
+        Espera hasta que haya mensajes y los devuelve todos de una vez.
+        Devuelve [] si vence el timeout y None si la cola está cerrada.
+        """
+        with self._condicion:
+            if not self._items and not self.cerrada:
+                self._condicion.wait(timeout)
+            if self.cerrada and not self._items:
+                return None
+            pendientes = list(self._items)
+            self._items.clear()
+            return pendientes
+
+    def cerrar(self, vaciar=False):
+        """
+        Cierra la cola y despierta al consumidor. Con vaciar=True lo pendiente
+        se sigue entregando y extraer() devuelve None recién cuando se vació.
+        """
+        with self._condicion:
+            self.cerrada = True
+            if not vaciar:
+                self._items.clear()
+            self._condicion.notify_all()
+
+        if self._notificar:
+            self._notificar()
+
+    def estadisticas(self):
+        return {
+            'profundidad': len(self._items),
+            'profundidad_maxima': self.profundidad_maxima,
+            'encolados': self.encolados,
+            'descartados': self.descartados,
+        }
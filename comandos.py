@@ -0,0 +1,53 @@
+from compresion import COMPRIMIR, negociar_compresion
+from directos import NICK, MSG, procesar_nick, enviar_directo
+from protocolo import mensaje_del_servidor, PING, PONG
+from salas import procesar_comando_sala
+
+class Comandos:
+    """
+    Comandos del cliente, iguales en los dos motores: /ping, /pong,
+    /comprimir, /nick, /msg y los de salas. Cada motor crea uno con su
+    configuración y sus estructuras, y con `enviar(conexion, mensaje)`: su
+    forma de encolar en una conexión, que devuelve False (y da de baja al
+    cliente) si su cola pide desconectarlo.
+    """
+
+    def __init__(self, config, tabla, salas, metricas, enviar):
+        self.config = config
+        self.tabla = tabla
+        self.salas = salas
+        self.metricas = metricas
+        self.enviar = enviar
+
+    def responder(self, conexion, texto):
+        self.enviar(conexion, mensaje_del_servidor(texto, self.config.protocolo))
+
+    def procesar(self, conexion, comando, argumento):
+        """
+        Ejecuta un comando del cliente y le responde por su propia cola.
+        Devuelve la sala en la que queda el cliente.
+        """
+        sala = conexion.sala
+        if comando == PONG:
+            return sala   # respuesta a un latido: ya contó como actividad
+        if comando == PING:
+            self.responder(conexion, PONG)
+            return sala
+        if comando == COMPRIMIR:
+            self.responder(conexion, negociar_compresion(conexion, argumento, self.config.protocolo))
+            return sala
+        if comando == NICK:
+            self.responder(conexion, procesar_nick(self.tabla, conexion, argumento))
+            return sala
+        if comando == MSG:
+            acuse = enviar_directo(self.tabla, conexion, argumento, self.config, self.metricas, self.enviar)
+            self.responder(conexion, acuse)
+            return sala
+
+        resultado = procesar_comando_sala(self.salas, conexion, conexion, sala, comando, argumento)
+        if resultado is None:
+            resultado = sala, f"Comando desconocido: {comando}"
+
+        sala, respuesta = resultado
+        self.responder(conexion, respuesta)
+        return sala
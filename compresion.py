@@ -0,0 +1,71 @@
+import zlib
+
+from protocolo import CABECERA, BINARIO
+
+# Comando con el que un cliente pide recibir los broadcasts comprimidos
+COMPRIMIR = '/comprimir'
+ZLIB = 'zlib'
+DESACTIVAR = ('no', 'off')
+
+# En el protocolo binario una trama comprimida lleva este bit en la cabecera de
+# longitud. Las tramas nunca superan el buffer de recepción (64 KiB), así que
+# el bit no se usa para otra cosa.
+BIT_COMPRIMIDO = 0x80000000
+
+# Diccionario compartido por servidor y clientes. Cada mensaje se comprime por
+# separado (deflate crudo, sin estado entre mensajes) para que los mismos bytes
+# sirvan a todos los destinatarios; el diccionario compensa en parte lo
+# que se pierde al no tener contexto. Lo más frecuente va al final.
+DICCIONARIO = (
+    "que de no a la el en y es lo un por para con una los se del las me te "
+    "pero como si ya más bien hola gracias bueno vale ok jaja alguien sabe "
+    "dónde cuando porque hay está estoy tengo puedo hacer ahora hoy mañana "
+    "mensaje servidor sala cliente conexión error prueba "
+    "/join /leave /ping /pong /comprimir "
+    "[servidor] [127.0.0.1:"
+).encode('utf-8')
+
+def comprimir(carga, nivel=6):
+    """Comprime una carga con deflate crudo y el diccionario compartido."""
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=DICCIONARIO)
+    return compresor.compress(carga) + compresor.flush()
+
+def descomprimir(datos):
+    descompresor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=DICCIONARIO)
+    return descompresor.decompress(datos) + descompresor.flush()
+
+def comprimir_mensaje(buffers, umbral, nivel=6):
+    """
+    Versión comprimida de un mensaje binario ya empaquetado (cabecera, prefijo,
+    cuerpo), para los destinatarios que la negociaron. Devuelve los mismos
+    buffers si la carga es menor que `umbral` o si comprimida no ocupa menos.
+    """
+    carga = b''.join(buffers[1:])
+    if len(carga) < umbral:
+        return buffers
+    comprimida = comprimir(carga, nivel)
+    if len(comprimida) >= len(carga):
+        return buffers
+    return (CABECERA.pack(len(comprimida) | BIT_COMPRIMIDO), comprimida)
+
+def leer_cabecera(cabecera):
+    """Devuelve (longitud, comprimida) de una cabecera binaria recibida del servidor."""
+    (valor,) = CABECERA.unpack(cabecera)
+    return valor & ~BIT_COMPRIMIDO, bool(valor & BIT_COMPRIMIDO)
+
+def negociar_compresion(conexion, argumento, modo):
+    """
+    Atiende '/comprimir [zlib|no]' marcando la conexión. Devuelve el texto de
+    respuesta. En modo líneas no se ofrece: los bytes comprimidos pueden
+    contener '\\n' y romperían el entramado de los clientes como client.py.
+    """
+    argumento = argumento.lower()
+    if argumento in DESACTIVAR:
+        conexion.comprime = False
+        return "Compresión desactivada"
+    if modo != BINARIO:
+        return "La compresión solo está disponible con el protocolo binario"
+    if argumento and argumento != ZLIB:
+        return f"Compresión desconocida: {argumento}"
+    conexion.comprime = True
+    return f"Compresión {ZLIB} activada"
@@ -0,0 +1,131 @@
+import itertools
+import threading
+import time
+
+class Conexion:
+    """
+    Registro compacto de una conexión aceptada. Todo lo que antes se recalculaba
+    por mensaje (etiqueta del par, prefijo codificado) se arma una sola vez.
+    `transporte` es el socket (motor de hilos) o el StreamWriter (asyncio).
+    """
+    __slots__ = ('id', 'transporte', 'peer', 'etiqueta', 'prefijo', 'cola', 'sala', 'activa',
+                 'conectada_en', 'ultima_actividad', 'mensajes_recibidos', 'bytes_recibidos',
+                 'limitador', 'comprime', 'lector', 'entrada', 'tareas', 'apodo')
+
+    def __init__(self, id_conexion, transporte, peer, prefijo, cola, sala):
+        self.id = id_conexion
+        self.transporte = transporte
+        self.peer = peer
+        self.etiqueta = f"{peer[0]}:{peer[1]}" if peer else "<desconocido>"
+        self.prefijo = prefijo
+        self.cola = cola
+        self.sala = sala
+        self.activa = True
+        self.conectada_en = self.ultima_actividad = time.monotonic()
+        self.mensajes_recibidos = 0
+        self.bytes_recibidos = 0
+        self.limitador = None   # LimitadorCliente si hay límites por conexión
+        self.comprime = False   # pidió los broadcasts comprimidos con /comprimir
+        self.lector = None      # LectorTramas: lo que quede sin consumir viaja en un traspaso
+        self.entrada = None     # StreamReader (solo asyncio)
+        self.tareas = ()        # hilos o tareas (lector, escritor) de la conexión
+        self.apodo = None       # elegido con /nick, único en la tabla
+
+    def __repr__(self):
+        return f"Conexion({self.id}, {self.etiqueta})"
+
+class TablaConexiones:
+    """
+    Conexiones activas por id. Alta y baja son O(1) (un dict); la instantánea
+    para recorrerlas es una tupla que se arma solo cuando hubo cambios. Un
+    segundo dict indexa los apodos y se actualiza bajo el mismo lock, así una
+    baja nunca deja un apodo apuntando a una conexión cerrada.
+    """
+
+    def __init__(self, lock=None):
+        self._conexiones = {}   # id -> Conexion
+        self._apodos = {}       # apodo.casefold() -> Conexion
+        self._ids = itertools.count(1)
+        self._lock = lock or threading.Lock()
+        self._instantanea = ()
+        self._vigente = True    # False si hubo altas o bajas desde la última instantánea
+
+    def __len__(self):
+        return len(self._conexiones)
+
+    def __contains__(self, conexion):
+        return conexion.id in self._conexiones
+
+    def agregar(self, transporte, peer, prefijo, cola, sala):
+        """Crea el registro de una conexión nueva y lo da de alta."""
+        with self._lock:
+            conexion = Conexion(next(self._ids), transporte, peer, prefijo, cola, sala)
+            self._conexiones[conexion.id] = conexion
+            self._vigente = False
+        return conexion
+
+    def quitar(self, conexion):
+        """
+        Da de baja la conexión. Devuelve la cantidad de conexiones que quedan, o
+        None si ya se había quitado (solo la primera baja tiene efecto).
+        """
+        with self._lock:
+            if self._conexiones.pop(conexion.id, None) is None:
+                return None
+            self._soltar_apodo(conexion)
+            conexion.activa = False
+            self._vigente = False
+            return len(self._conexiones)
+
+    def obtener(self, id_conexion):
+        return self._conexiones.get(id_conexion)
+
+    def renombrar(self, conexion, apodo):
+        """
+        Asigna el apodo a la conexión, liberando el que tenía. Devuelve False
+        si lo usa otra conexión o si la conexión ya se dio de baja.
+        """
+        clave = apodo.casefold()
+        with self._lock:
+            if conexion.id not in self._conexiones:
+                return False
+            duenio = self._apodos.get(clave)
+            if duenio is not None and duenio is not conexion:
+                return False
+            self._soltar_apodo(conexion)
+            self._apodos[clave] = conexion
+            conexion.apodo = apodo
+            return True
+
+    def _soltar_apodo(self, conexion):
+        # Debe llamarse con el lock tomado
+        if conexion.apodo is not None and self._apodos.get(conexion.apodo.casefold()) is conexion:
+            del self._apodos[conexion.apodo.casefold()]
+
+    def buscar(self, destino):
+        """Conexión por apodo o por '#id', en O(1). None si no hay ninguna."""
+        if destino.startswith('#') and destino[1:].isdigit():
+            return self._conexiones.get(int(destino[1:]))
+        return self._apodos.get(destino.casefold())
+
+    def instantanea(self):
+        """Tupla inmutable de las conexiones activas, para recorrerla sin lock."""
+        if not self._vigente:
+            with self._lock:
+                if not self._vigente:
+                    self._instantanea = tuple(self._conexiones.values())
+                    self._vigente = True
+        return self._instantanea
+
+    def estadisticas_colas(self):
+        """Contadores de la cola de salida de cada conexión activa, por id."""
+        return {conexion.id: dict(peer=conexion.etiqueta, **conexion.cola.estadisticas())
+                for conexion in self.instantanea()}
+
+    def rutas(self):
+        """Ruta para el servidor de estadísticas: GET /colas, una línea clave=valor por cliente."""
+        def atender(consulta):
+            lineas = [f"id={id_conexion} " + " ".join(f"{clave}={valor}" for clave, valor in campos.items())
+                      for id_conexion, campos in self.estadisticas_colas().items()]
+            return 200, "".join(linea + "\n" for linea in lineas)
+        return {'/colas': atender}
@@ -0,0 +1,70 @@
+import time
+
+from compresion import comprimir_mensaje
+from limites import FRENAR
+from protocolo import empaquetar
+
+# Mensajes directos: '/msg <apodo|#id> <texto>' llega solo a ese cliente, con
+# un único encolado en lugar del reparto a toda la sala, y el emisor recibe un
+# acuse. '/nick <apodo>' elige el apodo (único, sin distinguir mayúsculas).
+NICK = '/nick'
+MSG = '/msg'
+MAX_LEN_APODO = 32
+USO_MSG = f"Uso: {MSG} <apodo|#id> <mensaje>"
+
+def apodo_valido(apodo):
+    # '#' queda reservado para direccionar por id
+    return 0 < len(apodo) <= MAX_LEN_APODO and apodo.isprintable() and ' ' not in apodo \
+        and not apodo.startswith('#')
+
+def nombre_visible(conexion):
+    return conexion.apodo or conexion.etiqueta
+
+def prefijo_directo(origen):
+    return f"[privado de {nombre_visible(origen)}] ".encode('utf-8')
+
+def procesar_nick(tabla, conexion, argumento):
+    """
+    Atiende /nick [apodo]: sin argumento informa el apodo y el id propios.
+    Devuelve el texto de respuesta.
+    """
+    if not argumento:
+        return f"Eres {nombre_visible(conexion)} (#{conexion.id})"
+    if not apodo_valido(argumento):
+        return f"Apodo inválido: '{argumento}'"
+    if not tabla.renombrar(conexion, argumento):
+        return f"El apodo {argumento} ya está en uso"
+    return f"Ahora eres {argumento} (#{conexion.id})"
+
+def separar_directo(argumento):
+    """Argumento de /msg -> (destino, texto); alguno queda vacío si falta."""
+    destino, _, texto = argumento.partition(' ')
+    return destino, texto.strip()
+
+def enviar_directo(tabla, origen, argumento, config, metricas, enviar):
+    """
+    Entrega un /msg solo a su destinatario (un encolado con `enviar`, sin
+    recorrer la sala) y devuelve el acuse para el emisor: 'Entregado'
+    significa que el mensaje quedó en la cola de salida del destinatario.
+    """
+    destino, texto = separar_directo(argumento)
+    if not destino or not texto:
+        return USO_MSG
+    destinatario = tabla.buscar(destino)
+    if destinatario is None:
+        return f"No hay nadie conectado como {destino}"
+
+    cuerpo = texto.encode('utf-8')
+    # Con la política de descartar, un directo cuenta como cualquier otro mensaje
+    if origen.limitador is not None and config.limite_politica != FRENAR:
+        if not origen.limitador.admitir(len(cuerpo), time.monotonic()):
+            metricas.mensajes_limitados.incrementar()
+            return f"Límite de mensajes superado, no se entregó a {destino}"
+
+    mensaje = empaquetar(prefijo_directo(origen), cuerpo, config.protocolo)
+    if destinatario.comprime:
+        mensaje = comprimir_mensaje(mensaje, config.compresion_umbral, config.compresion_nivel)
+    if not enviar(destinatario, mensaje):
+        return f"No se pudo entregar a {destino}"
+    metricas.mensajes_directos.incrementar()
+    return f"Entregado a {destino}"
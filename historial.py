@@ -0,0 +1,115 @@
+import threading
+from array import array
+
+class HistorialMensajes:
+    """
+    Historial circular de los últimos broadcasts, acotado por cantidad de
+    mensajes y por bytes. Los mensajes se guardan ya codificados (tal como se
+    envían) en un único bytearray preasignado; de cada uno solo se anotan su
+    posición, su largo y su sala en arrays de enteros, sin un objeto de
+    Python por mensaje.
+    """
+
+    def __init__(self, capacidad_mensajes=100, capacidad_bytes=256 * 1024):
+        if capacidad_mensajes < 1 or capacidad_bytes < 1:
+            raise ValueError("La capacidad del historial debe ser al menos 1")
+
+        self.capacidad_mensajes = capacidad_mensajes
+        self.capacidad_bytes = capacidad_bytes
+
+        self._datos = bytearray(capacidad_bytes)
+        self._vista = memoryview(self._datos)
+        # Por entrada: posición virtual de inicio (crece siempre), largo y sala
+        self._inicios = array('Q', [0]) * capacidad_mensajes
+        self._largos = array('L', [0]) * capacidad_mensajes
+        self._salas = array('H', [0]) * capacidad_mensajes
+
+        self._primero = 0    # entrada más antigua
+        self._cantidad = 0
+        self._fin = 0        # posición virtual donde se escribe el próximo mensaje
+        self._ids_sala = {}  # sala -> número usado en _salas
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._cantidad
+
+    def _id_sala(self, sala):
+        id_sala = self._ids_sala.get(sala)
+        if id_sala is None:
+            # Sin números libres (65535 salas distintas): se vacía el historial
+            # completo antes de reutilizarlos
+            if len(self._ids_sala) > 0xFFFF:
+                self._ids_sala.clear()
+                self._cantidad = 0
+            id_sala = self._ids_sala[sala] = len(self._ids_sala)
+        return id_sala
+
+    def agregar(self, sala, buffers):
+        """
+        Guarda un mensaje (tupla de buffers como la de empaquetar()). Los que
+        no entran en el historial completo simplemente no se guardan.
+        """
+        largo = 0
+        for buffer in buffers:
+            largo += len(buffer)
+        if largo == 0 or largo > self.capacidad_bytes:
+            return
+
+        with self._lock:
+            id_sala = self._id_sala(sala)
+            inicio = self._fin
+            posicion = inicio % self.capacidad_bytes
+            if posicion + largo > self.capacidad_bytes:
+                # No cabe antes del final del buffer: se salta al principio
+                inicio += self.capacidad_bytes - posicion
+                posicion = 0
+            fin = inicio + largo
+
+            # Se descartan las entradas más viejas que se van a pisar
+            while self._cantidad and (self._cantidad == self.capacidad_mensajes or
+                                      self._inicios[self._primero] < fin - self.capacidad_bytes):
+                self._primero = (self._primero + 1) % self.capacidad_mensajes
+                self._cantidad -= 1
+
+            for buffer in buffers:
+                n = len(buffer)
+                self._vista[posicion:posicion + n] = buffer
+                posicion += n
+
+            indice = (self._primero + self._cantidad) % self.capacidad_mensajes
+            self._inicios[indice] = inicio
+            self._largos[indice] = largo
+            self._salas[indice] = id_sala
+            self._cantidad += 1
+            self._fin = fin
+
+    def entradas(self):
+        """Todos los mensajes guardados como pares (sala, bytes), del más viejo al más nuevo."""
+        with self._lock:
+            salas = {id_sala: sala for sala, id_sala in self._ids_sala.items()}
+            entradas = []
+            for i in range(self._cantidad):
+                indice = (self._primero + i) % self.capacidad_mensajes
+                posicion = self._inicios[indice] % self.capacidad_bytes
+                entradas.append((salas[self._salas[indice]],
+                                 bytes(self._vista[posicion:posicion + self._largos[indice]])))
+        return entradas
+
+    def recientes(self, sala, limite=None):
+        """
+        Devuelve los mensajes guardados de la sala, del más viejo al más nuevo,
+        como bytes listos para enviar (como mucho los últimos `limite`).
+        """
+        with self._lock:
+            id_sala = self._ids_sala.get(sala)
+            if id_sala is None:
+                return []
+            mensajes = []
+            for i in range(self._cantidad):
+                indice = (self._primero + i) % self.capacidad_mensajes
+                if self._salas[indice] == id_sala:
+                    posicion = self._inicios[indice] % self.capacidad_bytes
+                    mensajes.append(bytes(self._vista[posicion:posicion + self._largos[indice]]))
+        if limite is not None:
+            mensajes = mensajes[-limite:] if limite > 0 else []
+        return mensajes
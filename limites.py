@@ -0,0 +1,92 @@
+import time
+
+# Qué hacer con un cliente que supera su límite
+FRENAR = 'frenar'         # se deja de leer su socket hasta que recupere tokens (contrapresión TCP)
+DESCARTAR = 'descartar'   # se siguen leyendo sus mensajes pero los que exceden no se reparten
+
+POLITICAS_LIMITE = (FRENAR, DESCARTAR)
+
+class CuboTokens:
+    """
+    Cubo de tokens: se recarga a `tasa` tokens por segundo hasta `capacidad`.
+    No usa hilos ni timers; la recarga se calcula al consultarlo.
+    """
+    __slots__ = ('tasa', 'capacidad', 'tokens', 'ultimo')
+
+    def __init__(self, tasa, capacidad=None, ahora=None):
+        if tasa <= 0:
+            raise ValueError("La tasa del cubo de tokens debe ser positiva")
+        self.tasa = tasa
+        self.capacidad = capacidad if capacidad is not None else tasa
+        self.tokens = self.capacidad
+        self.ultimo = time.monotonic() if ahora is None else ahora
+
+    def _recargar(self, ahora):
+        if ahora > self.ultimo:
+            self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+            self.ultimo = ahora
+
+    def disponible(self, cantidad, ahora):
+        self._recargar(ahora)
+        return self.tokens >= cantidad
+
+    def consumir(self, cantidad, ahora):
+        """Toma `cantidad` tokens si los hay. Devuelve False (sin tomar nada) si no."""
+        if not self.disponible(cantidad, ahora):
+            return False
+        self.tokens -= cantidad
+        return True
+
+    def adeudar(self, cantidad, ahora):
+        """
+        Toma `cantidad` tokens aunque el saldo quede negativo y devuelve los
+        segundos que hay que esperar para saldar la deuda (0 si no hay deuda).
+        """
+        self._recargar(ahora)
+        self.tokens -= cantidad
+        return -self.tokens / self.tasa if self.tokens < 0 else 0.0
+
+class LimitadorCliente:
+    """
+    Límites de una conexión: mensajes por segundo y bytes por segundo, cada
+    uno con una ráfaga de `rafaga_s` segundos. Un límite en 0 no se aplica.
+    """
+    __slots__ = ('mensajes', 'bytes')
+
+    def __init__(self, mensajes_por_s=0, bytes_por_s=0, rafaga_s=1.0, ahora=None):
+        ahora = time.monotonic() if ahora is None else ahora
+        self.mensajes = CuboTokens(mensajes_por_s, max(1, mensajes_por_s * rafaga_s), ahora) if mensajes_por_s > 0 else None
+        self.bytes = CuboTokens(bytes_por_s, bytes_por_s * rafaga_s, ahora) if bytes_por_s > 0 else None
+
+    def admitir(self, tamano, ahora):
+        """
+        Política 'descartar': True si el mensaje entra en ambos límites (y los
+        descuenta); False si excede alguno, sin descontar nada.
+        """
+        if self.mensajes and not self.mensajes.disponible(1, ahora):
+            return False
+        if self.bytes and not self.bytes.disponible(tamano, ahora):
+            return False
+        if self.mensajes:
+            self.mensajes.consumir(1, ahora)
+        if self.bytes:
+            self.bytes.consumir(tamano, ahora)
+        return True
+
+    def adeudar(self, mensajes, tamano, ahora):
+        """
+        Política 'frenar': descuenta lo leído y devuelve cuántos segundos hay que
+        dejar de leer para volver a estar dentro de los límites.
+        """
+        espera = 0.0
+        if self.mensajes and mensajes:
+            espera = self.mensajes.adeudar(mensajes, ahora)
+        if self.bytes and tamano:
+            espera = max(espera, self.bytes.adeudar(tamano, ahora))
+        return espera
+
+def crear_limitador(config):
+    """LimitadorCliente según las opciones --limite-*, o None si no hay límites."""
+    if config.limite_mensajes <= 0 and config.limite_bytes <= 0:
+        return None
+    return LimitadorCliente(config.limite_mensajes, config.limite_bytes, config.limite_rafaga_s)
@@ -0,0 +1,227 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+# Límites de los histogramas de duración, en segundos (de 10 µs a 10 s)
+LIMITES_DURACION = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Contador:
+    """Contador monótono. Un lock propio y sin contención: ~100 ns por incremento."""
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.valor = 0
+        self._lock = threading.Lock()
+
+    def incrementar(self, cantidad=1):
+        with self._lock:
+            self.valor += cantidad
+
+    def muestras(self):
+        return [(self.nombre, '', self.valor)]
+
+class Medidor(Contador):
+    """Valor que sube y baja (p. ej. conexiones activas)."""
+    tipo = 'gauge'
+
+    def sumar(self, cantidad):
+        self.incrementar(cantidad)
+
+class Tasa:
+    """
+    Eventos por segundo en los últimos `ventana` segundos, con un anillo de
+    contadores por segundo (sin guardar timestamps de cada evento).
+    """
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda, ventana=10):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.ventana = ventana
+        self._cuentas = [0] * ventana
+        self._segundos = [0] * ventana
+        self._lock = threading.Lock()
+
+    def registrar(self, cantidad=1):
+        segundo = int(time.monotonic())
+        i = segundo % self.ventana
+        with self._lock:
+            if self._segundos[i] != segundo:
+                self._segundos[i] = segundo
+                self._cuentas[i] = 0
+            self._cuentas[i] += cantidad
+
+    def valor(self):
+        # Se excluye el segundo en curso, que todavía está incompleto
+        actual = int(time.monotonic())
+        with self._lock:
+            total = sum(c for c, s in zip(self._cuentas, self._segundos)
+                        if actual - self.ventana <= s < actual)
+        return total / self.ventana
+
+    def muestras(self):
+        return [(self.nombre, '', self.valor())]
+
+class Histograma:
+    """Histograma de límites fijos: observar() es una búsqueda binaria y un incremento."""
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, limites=LIMITES_DURACION):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = tuple(limites)
+        self._cuentas = [0] * (len(self.limites) + 1)   # el último es +Inf
+        self.suma = 0.0
+        self.cantidad = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        i = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            self._cuentas[i] += 1
+            self.suma += valor
+            self.cantidad += 1
+
+    def muestras(self):
+        with self._lock:
+            cuentas = list(self._cuentas)
+            suma, cantidad = self.suma, self.cantidad
+        muestras = []
+        acumulado = 0
+        for limite, cuenta in zip(self.limites + (float('inf'),), cuentas):
+            acumulado += cuenta
+            le = '+Inf' if limite == float('inf') else repr(limite)
+            muestras.append((self.nombre + '_bucket', f'{{le="{le}"}}', acumulado))
+        muestras.append((self.nombre + '_sum', '', suma))
+        muestras.append((self.nombre + '_count', '', cantidad))
+        return muestras
+
+class LockMedido:
+    """
+    Envoltorio de un Lock que registra en un histograma cuánto se esperó para
+    tomarlo. Se usa igual que el lock original (`with lock:`).
+    """
+
+    def __init__(self, lock, histograma):
+        self._lock = lock
+        self._histograma = histograma
+
+    def acquire(self, blocking=True, timeout=-1):
+        inicio = time.perf_counter()
+        tomado = self._lock.acquire(blocking, timeout)
+        self._histograma.observar(time.perf_counter() - inicio)
+        return tomado
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class RegistroMetricas:
+    def __init__(self, prefijo='chat_'):
+        self.prefijo = prefijo
+        self._metricas = []
+
+    def _agregar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda):
+        return self._agregar(Contador(self.prefijo + nombre + '_total', ayuda))
+
+    def medidor(self, nombre, ayuda):
+        return self._agregar(Medidor(self.prefijo + nombre, ayuda))
+
+    def tasa(self, nombre, ayuda):
+        return self._agregar(Tasa(self.prefijo + nombre, ayuda))
+
+    def histograma(self, nombre, ayuda, limites=LIMITES_DURACION):
+        return self._agregar(Histograma(self.prefijo + nombre, ayuda, limites))
+
+    def texto(self):
+        """Todas las métricas en formato de texto de Prometheus."""
+        lineas = []
+        for metrica in self._metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            for nombre, etiquetas, valor in metrica.muestras():
+                lineas.append(f"{nombre}{etiquetas} {valor}")
+        return "\n".join(lineas) + "\n"
+
+class MetricasServidor:
+    """
+    Métricas estándar del servidor de chat, compartidas por ambos motores.
+    """
+
+    def __init__(self, registro=None):
+        self.registro = registro or RegistroMetricas()
+        r = self.registro
+        self.conexiones_activas = r.medidor('conexiones_activas', "Clientes conectados en este momento")
+        self.aceptaciones = r.contador('aceptaciones', "Conexiones aceptadas")
+        self.aceptaciones_por_segundo = r.tasa('aceptaciones_por_segundo', "Conexiones aceptadas por segundo (últimos 10 s)")
+        self.mensajes_entrantes = r.contador('mensajes_entrantes', "Mensajes recibidos de los clientes")
+        self.bytes_entrantes = r.contador('bytes_entrantes', "Bytes recibidos de los clientes")
+        self.mensajes_salientes = r.contador('mensajes_salientes', "Mensajes enviados a los clientes")
+        self.bytes_salientes = r.contador('bytes_salientes', "Bytes enviados a los clientes")
+        self.mensajes_descartados = r.contador('mensajes_descartados', "Mensajes perdidos por colas de salida llenas")
+        self.mensajes_limitados = r.contador('mensajes_limitados', "Mensajes descartados por superar el límite del cliente")
+        self.esperas_limite = r.contador('esperas_limite', "Veces que se frenó la lectura de un cliente por su límite")
+        self.conexiones_rechazadas = r.contador('conexiones_rechazadas', "Conexiones rechazadas por --max-conexiones")
+        self.bytes_ahorrados_compresion = r.contador('bytes_ahorrados_compresion', "Bytes de salida que se ahorraron al comprimir")
+        self.mensajes_directos = r.contador('mensajes_directos', "Mensajes directos (/msg) entregados a su destinatario")
+        self.fallos_envio = r.contador('fallos_envio', "Errores al escribir en el socket de un cliente")
+        self.bitacora_descartados = r.contador('bitacora_descartados', "Entradas que no llegaron a la bitácora por su cola llena")
+        self.registros_descartados = r.contador('registros_descartados', "Registros de log perdidos por la cola del registro llena")
+        self.duracion_broadcast = r.histograma('duracion_broadcast_segundos', "Tiempo de reparto de un broadcast a su sala")
+        self.espera_lock = r.histograma('espera_lock_clientes_segundos', "Espera para tomar el lock de la tabla de conexiones")
+
+    def registrar_aceptacion(self):
+        self.aceptaciones.incrementar()
+        self.aceptaciones_por_segundo.registrar()
+        self.conexiones_activas.sumar(1)
+
+class _ManejadorEstadisticas(BaseHTTPRequestHandler):
+    registro = None
+    rutas = {}   # ruta -> función(consulta) que devuelve (código, texto)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path in self.rutas:
+            codigo, texto = self.rutas[url.path](dict(parse_qsl(url.query)))
+            self._responder(codigo, texto, 'text/plain; charset=utf-8')
+        else:
+            self._responder(200, self.registro.texto(), 'text/plain; version=0.0.4; charset=utf-8')
+
+    def _responder(self, codigo, texto, tipo):
+        cuerpo = texto.encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass   # sin salida por cada consulta
+
+def iniciar_servidor_estadisticas(registro, puerto, host='127.0.0.1', rutas=None):
+    """
+    Sirve las métricas en texto por HTTP en loopback, desde un hilo propio.
+    `rutas` agrega rutas propias (p. ej. las del perfilado); el resto responde
+    las métricas.
+    """
+    manejador = type('ManejadorEstadisticas', (_ManejadorEstadisticas,),
+                     {'registro': registro, 'rutas': dict(rutas or {})})
+    servidor = ThreadingHTTPServer((host, puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
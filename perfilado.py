@@ -0,0 +1,216 @@
+import collections
+import contextlib
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+import registro
+
+# Perfilado bajo demanda del servidor en producción. Nada de esto corre hasta
+# que se pide: un muestreo de pilas o una diferencia de memoria se disparan con
+# una señal (SIGUSR1 / SIGUSR2) o por HTTP en el puerto de --stats-puerto, y
+# las secciones medidas solo existen con --perfil-secciones.
+
+SECCIONES = ('accept', 'recv', 'validacion', 'broadcast', 'remocion')
+INTERVALO_MUESTREO = 0.005   # 200 muestras por segundo de todos los hilos
+FRAMES_MEMORIA = 10          # profundidad de pila que guarda tracemalloc por asignación
+SEGUNDOS_MAXIMOS = 300
+
+_NULO = contextlib.nullcontext()
+
+class PerfilEnCurso(RuntimeError):
+    """Ya hay un perfilado corriendo: se hace uno a la vez."""
+
+class _Medicion:
+    __slots__ = ('_histograma', '_inicio')
+
+    def __init__(self, histograma):
+        self._histograma = histograma
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self._histograma.observar(time.perf_counter() - self._inicio)
+
+class Secciones:
+    """
+    Tiempos de secciones con nombre del camino caliente, cada una en un
+    histograma `chat_seccion_<nombre>_segundos`. Mientras están desactivadas,
+    medir() devuelve siempre el mismo contexto vacío: el costo es una llamada
+    y un `with`, sin leer el reloj.
+
+        with secciones.medir('broadcast'):
+            Broadcast_mensajes(...)
+    """
+
+    def __init__(self, registro_metricas, nombres=SECCIONES):
+        self.activas = False
+        self._registro = registro_metricas
+        self._nombres = nombres
+        self._histogramas = {}
+
+    def activar(self):
+        # Los histogramas se registran recién aquí para no ensuciar /metrics sin perfilado
+        if not self._histogramas:
+            for nombre in self._nombres:
+                self._histogramas[nombre] = self._registro.histograma(
+                    f'seccion_{nombre}_segundos', f"Duración de la sección '{nombre}' del servidor")
+        self.activas = True
+
+    def desactivar(self):
+        self.activas = False
+
+    def medir(self, nombre):
+        if not self.activas:
+            return _NULO
+        return _Medicion(self._histogramas[nombre])
+
+def _nombre_hilo(hilo):
+    # 'Thread-12 (manejo_de_cliente)' -> 'Thread (manejo_de_cliente)': un hilo por
+    # cliente no debe partir la gráfica en miles de raíces
+    return re.sub(r'-\d+', '', hilo.name)
+
+def _colapsar(nombre, marco):
+    pila = []
+    while marco is not None:
+        codigo = marco.f_code
+        pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)})")
+        marco = marco.f_back
+    pila.append(nombre)
+    return ';'.join(reversed(pila))
+
+def muestrear_pilas(segundos, intervalo=INTERVALO_MUESTREO):
+    """
+    Toma la pila de todos los hilos cada `intervalo` segundos durante
+    `segundos`. Devuelve un Counter pila colapsada -> muestras.
+    """
+    propio = threading.get_ident()
+    cuentas = collections.Counter()
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin:
+        nombres = {hilo.ident: _nombre_hilo(hilo) for hilo in threading.enumerate()}
+        for ident, marco in sys._current_frames().items():
+            if ident != propio:
+                cuentas[_colapsar(nombres.get(ident, 'hilo'), marco)] += 1
+        time.sleep(intervalo)
+    return cuentas
+
+def formato_colapsado(cuentas):
+    """Una línea 'raiz;...;hoja muestras' por pila: la entrada de flamegraph.pl o speedscope."""
+    return ''.join(f"{pila} {cuenta}\n" for pila, cuenta in sorted(cuentas.items()))
+
+def diferencia_memoria(segundos, limite=50):
+    """
+    Activa tracemalloc (si no lo estaba) durante `segundos` y devuelve, como
+    texto, las líneas de código que más memoria retuvieron en ese lapso.
+    """
+    iniciado = not tracemalloc.is_tracing()
+    if iniciado:
+        tracemalloc.start(FRAMES_MEMORIA)
+    try:
+        antes = tracemalloc.take_snapshot()
+        time.sleep(segundos)
+        despues = tracemalloc.take_snapshot()
+    finally:
+        if iniciado:
+            tracemalloc.stop()   # fuera del lapso pedido no cuesta nada
+
+    filtros = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    estadisticas = despues.filter_traces(filtros).compare_to(antes.filter_traces(filtros), 'lineno')
+    total = sum(estadistica.size_diff for estadistica in estadisticas)
+    lineas = [f"# Diferencia de memoria en {segundos} s: {total / 1024:+.1f} KiB"]
+    lineas.extend(str(estadistica) for estadistica in estadisticas[:limite])
+    return "\n".join(lineas) + "\n"
+
+class Perfilador:
+    """
+    Dispara los perfilados del servidor, de a uno por vez. Por señal corren en
+    un hilo propio y el resultado queda en `directorio`; por HTTP el resultado
+    es la respuesta.
+    """
+
+    def __init__(self, directorio, segundos=10):
+        self.directorio = directorio
+        self.segundos = segundos
+        self._lock = threading.Lock()
+
+    def _correr(self, funcion, segundos):
+        if not self._lock.acquire(blocking=False):
+            raise PerfilEnCurso("Ya hay un perfilado en curso")
+        try:
+            return funcion(segundos)
+        finally:
+            self._lock.release()
+
+    def pilas(self, segundos=None):
+        segundos = segundos or self.segundos
+        return formato_colapsado(self._correr(muestrear_pilas, segundos))
+
+    def memoria(self, segundos=None):
+        return self._correr(diferencia_memoria, segundos or self.segundos)
+
+    def a_archivo(self, tipo):
+        """Corre el perfilado `tipo` ('pilas' o 'memoria') en segundo plano y lo guarda."""
+        def correr():
+            try:
+                texto = getattr(self, tipo)()
+            except PerfilEnCurso as e:
+                registro.advertencia('perfil', str(e), tipo=tipo)
+                return
+            ruta = os.path.join(self.directorio, f"{tipo}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+            with open(ruta, 'w', encoding='utf-8') as archivo:
+                archivo.write(texto)
+            registro.info('perfil', "Perfilado guardado", tipo=tipo, ruta=ruta)
+
+        registro.info('perfil', "Perfilado iniciado", tipo=tipo, segundos=self.segundos)
+        threading.Thread(target=correr, name='perfilado', daemon=True).start()
+
+    def instalar_senales(self):
+        """
+        SIGUSR1 muestrea las pilas y SIGUSR2 mide la memoria (solo desde el
+        hilo principal). El manejador solo escribe el número de la señal en un
+        pipe: registrar o lanzar un hilo toma locks que el hilo interrumpido
+        puede tener tomados (p. ej. la cola del registro). Un hilo propio lee
+        el pipe y dispara el perfilado.
+        """
+        tipos = {signal.SIGUSR1: 'pilas', signal.SIGUSR2: 'memoria'}
+        lectura, escritura = os.pipe()
+        os.set_blocking(escritura, False)
+
+        def al_recibir(signum, frame):
+            try:
+                os.write(escritura, bytes([signum]))
+            except BlockingIOError:
+                pass   # ya hay cientos de pedidos sin atender
+
+        def despachar():
+            while True:
+                for signum in os.read(lectura, 64):
+                    self.a_archivo(tipos[signum])
+
+        threading.Thread(target=despachar, name='perfilado-senales', daemon=True).start()
+        for signum in tipos:
+            signal.signal(signum, al_recibir)
+
+    def rutas(self):
+        """Rutas para el servidor de estadísticas: GET /perfil/pilas?segundos=N y /perfil/memoria."""
+        def ruta(funcion):
+            def atender(consulta):
+                try:
+                    segundos = float(consulta.get('segundos', self.segundos))
+                except ValueError:
+                    return 400, "segundos debe ser un número\n"
+                if not 0 < segundos <= SEGUNDOS_MAXIMOS:
+                    return 400, f"segundos debe estar entre 0 y {SEGUNDOS_MAXIMOS}\n"
+                try:
+                    return 200, funcion(segundos)
+                except PerfilEnCurso as e:
+                    return 409, f"{e}\n"
+            return atender
+
+        return {'/perfil/pilas': ruta(self.pilas), '/perfil/memoria': ruta(self.memoria)}
@@ -0,0 +1,260 @@
+import os
+import struct
+
+from utils import bytes_utf8_incompletos
+
+# Modos de entramado
+LINEAS = 'lineas'     # compatibilidad: mensajes terminados en '\n' (o en el borde de cada recv)
+BINARIO = 'binario'   # cabecera de 4 bytes big-endian con la longitud + carga útil
+
+MODOS = (LINEAS, BINARIO)
+
+CABECERA = struct.Struct('!I')
+
+class ErrorProtocolo(Exception):
+    """El par envió una trama que no se puede reensamblar (p. ej. demasiado grande)."""
+
+class LectorTramas:
+    """
+    Buffer de recepción reutilizable de una conexión.
+
+    Los datos se leen con recv_into() directamente sobre un bytearray
+    reutilizado y las tramas completas se devuelven como memoryview sobre ese
+    mismo buffer, sin copias. Las vistas devueltas por tramas() solo son
+    válidas hasta la siguiente llamada a recibir_de() o alimentar().
+
+    El buffer empieza en `tamano_inicial` y crece al doble cuando una trama no
+    cabe, hasta `tamano_buffer` (la trama más grande admitida); pasada la trama
+    grande vuelve al tamaño inicial. Con miles de conexiones la mayoría solo
+    manda mensajes cortos y no debe reservar el máximo.
+    """
+
+    def __init__(self, modo=LINEAS, tamano_buffer=64 * 1024, tamano_inicial=4 * 1024):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de entramado desconocido: {modo}")
+
+        self.modo = modo
+        self._maximo = tamano_buffer
+        self._minimo = min(tamano_inicial, tamano_buffer)
+        self._buffer = bytearray(self._minimo)
+        self._vista = memoryview(self._buffer)
+        self._inicio = 0   # primer byte aún no consumido
+        self._fin = 0      # fin de los datos válidos
+
+    @property
+    def pendientes(self):
+        """Bytes recibidos que todavía no forman una trama completa."""
+        return self._fin - self._inicio
+
+    @property
+    def capacidad(self):
+        """Tamaño actual del buffer de recepción."""
+        return len(self._buffer)
+
+    def _reasignar(self, tamano):
+        # Buffer nuevo con el resto sin consumir al principio; las vistas ya
+        # entregadas siguen apuntando al anterior, que vive mientras existan
+        restante = self._fin - self._inicio
+        buffer = bytearray(tamano)
+        buffer[:restante] = self._vista[self._inicio:self._fin]
+        self._buffer = buffer
+        self._vista = memoryview(buffer)
+        self._inicio = 0
+        self._fin = restante
+
+    def _crecer(self, necesarios):
+        # Al doble (o a lo necesario si es más), nunca por encima del máximo
+        if necesarios > self._maximo:
+            raise ErrorProtocolo(f"Trama mayor que el buffer de recepción ({self._maximo} bytes)")
+        self._reasignar(min(self._maximo, max(necesarios, 2 * len(self._buffer))))
+
+    def _compactar(self):
+        # Mueve al principio solo el resto sin consumir (una trama incompleta)
+        if self._inicio == 0:
+            return
+        restante = self._fin - self._inicio
+        if len(self._buffer) > self._minimo and restante <= self._minimo:
+            self._reasignar(self._minimo)   # pasó la trama grande: se libera el buffer agrandado
+            return
+        if restante:
+            self._vista[:restante] = self._vista[self._inicio:self._fin]
+        self._inicio = 0
+        self._fin = restante
+
+    def _espacio_libre(self):
+        if self._fin == len(self._buffer):
+            self._compactar()
+        if self._fin == len(self._buffer):
+            self._crecer(self._fin + 1)
+        return self._vista[self._fin:]
+
+    def sin_consumir(self):
+        """Copia de los bytes recibidos que todavía no forman una trama completa."""
+        return bytes(self._vista[self._inicio:self._fin])
+
+    def libre(self):
+        """
+        Bytes que se pueden leer sin desbordar el buffer (nunca 0: si el buffer
+        está lleno con una trama incompleta se lanza ErrorProtocolo).
+        """
+        self._compactar()
+        return len(self._espacio_libre())
+
+    def recibir_de(self, sock):
+        """
+        Hace un único recv_into() sobre el espacio libre del buffer.
+        Devuelve el número de bytes leídos (0 si el par cerró la conexión).
+        """
+        self._compactar()
+        n = sock.recv_into(self._espacio_libre())
+        self._fin += n
+        return n
+
+    def alimentar(self, datos):
+        """
+        Añade datos ya leídos por otro medio (p. ej. StreamReader de asyncio).
+        """
+        self._compactar()
+        n = len(datos)
+        if n > len(self._buffer) - self._fin:
+            self._crecer(self._fin + n)
+        self._vista[self._fin:self._fin + n] = datos
+        self._fin += n
+
+    def tramas(self):
+        """
+        Extrae todas las tramas completas disponibles como memoryview.
+        """
+        if self.modo == BINARIO:
+            return self._tramas_binarias()
+        return self._tramas_lineas()
+
+    def _tramas_binarias(self):
+        tramas = []
+        tamano_cabecera = CABECERA.size
+        while self._fin - self._inicio >= tamano_cabecera:
+            (longitud,) = CABECERA.unpack_from(self._buffer, self._inicio)
+            if longitud > self._maximo - tamano_cabecera:
+                raise ErrorProtocolo(f"Trama de {longitud} bytes supera el buffer de recepción")
+            if tamano_cabecera + longitud > len(self._buffer):
+                self._crecer(tamano_cabecera + longitud)   # la carga llega en los próximos recv
+            inicio_carga = self._inicio + tamano_cabecera
+            fin_carga = inicio_carga + longitud
+            if fin_carga > self._fin:
+                break   # trama incompleta: se espera al próximo recv
+            tramas.append(self._vista[inicio_carga:fin_carga])
+            self._inicio = fin_carga
+        return tramas
+
+    def _tramas_lineas(self):
+        tramas = []
+        while self._inicio < self._fin:
+            salto = self._buffer.find(b'\n', self._inicio, self._fin)
+            if salto == -1:
+                # Compatibilidad con clientes que no terminan en '\n' (client.py):
+                # lo que queda al final de la lectura es un mensaje completo,
+                # salvo que termine en un carácter UTF-8 partido: entonces el
+                # recv cortó el mensaje y se espera al siguiente.
+                if bytes_utf8_incompletos(self._vista[self._inicio:self._fin]):
+                    break
+                salto = self._fin
+            tramas.append(self._vista[self._inicio:salto])
+            self._inicio = min(salto + 1, self._fin)
+        return tramas
+
+SALTO = b'\n'
+
+# Máximo de buffers por llamada a sendmsg() (IOV_MAX del sistema)
+try:
+    MAX_BUFFERS_POR_ENVIO = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    MAX_BUFFERS_POR_ENVIO = 1024
+
+def prefijo_para(direc):
+    """
+    Prefijo '[ip:puerto] ' de una conexión, ya codificado. Se calcula una vez al aceptarla.
+    """
+    return f"[{direc[0]}:{direc[1]}] ".encode('utf-8')
+
+def empaquetar(prefijo, cuerpo, modo=LINEAS):
+    """
+    Arma el mensaje de salida como una tupla inmutable de buffers, sin
+    concatenarlos: la misma tupla se encola para todos los destinatarios y
+    se envía con sendmsg() (scatter-gather).
+    """
+    if modo == BINARIO:
+        return (CABECERA.pack(len(prefijo) + len(cuerpo)), prefijo, cuerpo)
+    return (prefijo, cuerpo, SALTO)
+
+PREFIJO_SERVIDOR = b"[servidor] "
+
+# Latidos de aplicación: el servidor envía '[servidor] /ping' a una conexión
+# callada y espera '/pong'; un cliente también puede mandar '/ping'
+PING = '/ping'
+PONG = '/pong'
+
+def mensaje_del_servidor(texto, modo=LINEAS):
+    """
+    Respuesta del propio servidor a un cliente (confirmaciones, errores de comando).
+    """
+    return empaquetar(PREFIJO_SERVIDOR, texto.encode('utf-8'), modo)
+
+def interpretar_comando(cuerpo):
+    """
+    Si el mensaje es un comando ('/nombre argumento') devuelve (nombre, argumento);
+    si es texto normal devuelve None.
+    """
+    if not cuerpo.startswith(b'/'):
+        return None
+    comando, _, argumento = cuerpo.decode('utf-8').partition(' ')
+    return comando.lower(), argumento.strip()
+
+def tamano_mensaje(buffers):
+    total = 0
+    for buffer in buffers:
+        total += len(buffer)
+    return total
+
+def enviar_vectorizado(sock, buffers):
+    """
+    Envía todos los buffers con sendmsg(), reintentando si el kernel acepta
+    solo una parte. En plataformas sin sendmsg() (Windows) se concatena.
+    Devuelve la cantidad de bytes enviados.
+    """
+    total = tamano_mensaje(buffers)
+
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return total
+
+    enviados = sock.sendmsg(buffers)
+    if enviados == total:
+        return total
+
+    # Envío parcial: se descartan los bytes ya enviados y se reintenta con el resto
+    pendientes = [memoryview(buffer) for buffer in buffers]
+    while pendientes:
+        while enviados:
+            if enviados >= len(pendientes[0]):
+                enviados -= len(pendientes.pop(0))
+            else:
+                pendientes[0] = pendientes[0][enviados:]
+                enviados = 0
+        if pendientes:
+            enviados = sock.sendmsg(pendientes)
+    return total
+
+def enviar_lote(sock, mensajes):
+    """
+    Envía varios mensajes pendientes (cada uno una tupla de buffers) con la
+    menor cantidad de llamadas a sendmsg() posible, respetando el orden.
+    Devuelve la cantidad de bytes enviados.
+    """
+    if len(mensajes) == 1:
+        return enviar_vectorizado(sock, mensajes[0])
+
+    total = 0
+    buffers = [buffer for mensaje in mensajes for buffer in mensaje]
+    for inicio in range(0, len(buffers), MAX_BUFFERS_POR_ENVIO):
+        total += enviar_vectorizado(sock, buffers[inicio:inicio + MAX_BUFFERS_POR_ENVIO])
+    return total
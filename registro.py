@@ -0,0 +1,178 @@
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+log = logging.getLogger('chat')
+
+NIVELES = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+INTERVALO_AVISO_DESCARTES = 10.0   # como mucho un aviso de registros perdidos cada tantos segundos
+
+class ManejadorCola(QueueHandler):
+    """
+    Handler que solo deja el registro en una cola acotada: la escritura real
+    la hace el hilo del QueueListener. Si la cola está llena el registro se
+    descarta (y se cuenta) en lugar de bloquear al hilo que loguea; cuando
+    vuelve a haber lugar se avisa cuántos se perdieron.
+    """
+
+    def __init__(self, cola, al_descartar=None):
+        super().__init__(cola)
+        self.descartados = 0
+        self.al_descartar = al_descartar   # p. ej. el contador de métricas
+        self._sin_avisar = 0
+        self._ultimo_aviso = float('-inf')
+
+    def prepare(self, record):
+        # El listener está en el mismo proceso: no hace falta formatear ni
+        # copiar el registro en el hilo que loguea (eso se hace en el listener).
+        return record
+
+    def enqueue(self, record):
+        # Handler.handle() llama a emit() con el lock del handler: los contadores no necesitan otro
+        try:
+            if self._sin_avisar:
+                self._avisar_descartes()
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+            self._sin_avisar += 1
+            if self.al_descartar is not None:
+                self.al_descartar()
+
+    def _avisar_descartes(self):
+        ahora = time.monotonic()
+        if ahora - self._ultimo_aviso < INTERVALO_AVISO_DESCARTES:
+            return
+        aviso = log.makeRecord(log.name, logging.WARNING, __file__, 0,
+                               "Se perdieron registros por la cola del registro llena", (), None,
+                               extra={'evento': 'registro_lleno', 'campos': {'omitidos': self._sin_avisar}})
+        self.queue.put_nowait(aviso)   # si tampoco entra, queue.Full lo resuelve enqueue()
+        self._sin_avisar = 0
+        self._ultimo_aviso = ahora
+
+class LimitadorRepetidos(logging.Filter):
+    """
+    Deja pasar como mucho `maximo` registros de WARNING o más por evento cada
+    `intervalo` segundos. El primero que pasa después de un corte lleva el
+    campo `omitidos` con la cantidad que se suprimió.
+    """
+
+    def __init__(self, maximo=5, intervalo=10.0):
+        super().__init__()
+        self.maximo = maximo
+        self.intervalo = intervalo
+        self._ventanas = {}   # (evento, nivel) -> [inicio_ventana, emitidos, omitidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+
+        clave = (getattr(record, 'evento', None), record.levelno)
+        ahora = time.monotonic()
+        with self._lock:
+            ventana = self._ventanas.get(clave)
+            if ventana is None or ahora - ventana[0] >= self.intervalo:
+                omitidos = ventana[2] if ventana else 0
+                self._ventanas[clave] = [ahora, 1, 0]
+                if omitidos:
+                    record.campos = dict(getattr(record, 'campos', {}), omitidos=omitidos)
+                return True
+            if ventana[1] < self.maximo:
+                ventana[1] += 1
+                return True
+            ventana[2] += 1
+            return False
+
+class FormatoEstructurado(logging.Formatter):
+    """
+    Formato clave=valor (logfmt): `fecha NIVEL evento=... peer=ip:puerto ... mensaje`.
+    Corre en el hilo del listener, así que el costo de formatear no recae en
+    los hilos de clientes.
+    """
+
+    def format(self, record):
+        partes = [self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+                  record.levelname]
+        evento = getattr(record, 'evento', None)
+        if evento:
+            partes.append(f'evento={evento}')
+        for clave, valor in getattr(record, 'campos', {}).items():
+            partes.append(f'{clave}={formatear_valor(valor)}')
+        partes.append(record.getMessage())
+        if record.exc_info:
+            partes.append(self.formatException(record.exc_info))
+        return ' '.join(partes)
+
+def formatear_valor(valor):
+    if isinstance(valor, tuple) and len(valor) >= 2:
+        return f'{valor[0]}:{valor[1]}'   # dirección (ip, puerto)
+    if isinstance(valor, float):
+        return f'{valor:.3f}'
+    texto = str(valor)
+    return f'"{texto}"' if ' ' in texto else texto
+
+_listener = None
+_manejador = None
+
+def configurar_registro(nivel='INFO', destino=None, capacidad=10000):
+    """
+    Instala el logger 'chat' con cola acotada + hilo escritor. Se puede volver
+    a llamar (p. ej. en un worker recién creado con fork) y reemplaza la
+    configuración anterior.
+    """
+    global _listener, _manejador
+
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass   # el hilo no existe en un hijo recién creado con fork
+
+    salida = logging.StreamHandler(destino or sys.stdout)
+    salida.setFormatter(FormatoEstructurado())
+
+    cola = queue.Queue(capacidad)
+    _manejador = ManejadorCola(cola)
+    _manejador.addFilter(LimitadorRepetidos())
+
+    for manejador in list(log.handlers):
+        log.removeHandler(manejador)
+    log.addHandler(_manejador)
+    log.setLevel(nivel)
+    log.propagate = False
+
+    _listener = QueueListener(cola, salida)
+    _listener.start()
+    return _manejador
+
+def contar_descartes(al_descartar):
+    """Llama a `al_descartar()` por cada registro que se pierda (p. ej. un contador de métricas)."""
+    if _manejador is not None:
+        _manejador.al_descartar = al_descartar
+
+def detener_registro():
+    """Vacía la cola pendiente y detiene el hilo escritor."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def registrar(nivel, evento, mensaje, **campos):
+    if log.isEnabledFor(nivel):
+        log.log(nivel, mensaje, extra={'evento': evento, 'campos': campos})
+
+def depurar(evento, mensaje, **campos):
+    registrar(logging.DEBUG, evento, mensaje, **campos)
+
+def info(evento, mensaje, **campos):
+    registrar(logging.INFO, evento, mensaje, **campos)
+
+def advertencia(evento, mensaje, **campos):
+    registrar(logging.WARNING, evento, mensaje, **campos)
+
+def error(evento, mensaje, **campos):
+    registrar(logging.ERROR, evento, mensaje, **campos)
@@ -0,0 +1,96 @@
+import threading
+
+SALA_GENERAL = 'general'   # sala a la que entra todo cliente al conectarse
+MAX_LEN_SALA = 32
+
+class IndiceSalas:
+    """
+    Índice sala -> miembros. Cada sala guarda sus miembros en un dict mutable
+    (clave -> miembro), así que entrar o salir cuesta O(1). El broadcast lee
+    una tupla inmutable con la instantánea de la sala, sin tomar ningún lock;
+    un alta o baja solo descarta la instantánea, y la siguiente lectura la
+    arma una vez para todos los broadcasts hasta el próximo cambio.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._miembros = {}       # sala -> {clave: miembro}
+        self._instantaneas = {}   # sala -> tupla de miembros, mientras la sala no cambie
+        self._sala_de = {}        # clave -> sala
+
+    def unir(self, clave, miembro, sala):
+        """
+        Pone al miembro en la sala indicada, sacándolo de la anterior.
+        Devuelve la sala anterior (None si no estaba en ninguna).
+        """
+        with self._lock:
+            anterior = self._quitar(clave)
+            self._miembros.setdefault(sala, {})[clave] = miembro
+            self._instantaneas.pop(sala, None)
+            self._sala_de[clave] = sala
+        return anterior
+
+    def salir(self, clave):
+        """
+        Quita al miembro de su sala. Devuelve la sala que dejó (o None).
+        """
+        with self._lock:
+            return self._quitar(clave)
+
+    def _quitar(self, clave):
+        # Debe llamarse con el lock tomado
+        sala = self._sala_de.pop(clave, None)
+        if sala is None:
+            return None
+        miembros = self._miembros[sala]
+        del miembros[clave]
+        if not miembros:
+            del self._miembros[sala]
+        self._instantaneas.pop(sala, None)
+        return sala
+
+    def miembros(self, sala):
+        """
+        Instantánea de los miembros de la sala. Si la sala no cambió desde la
+        última lectura no toma el lock: la tupla es inmutable y la lectura de
+        un dict es atómica.
+        """
+        instantanea = self._instantaneas.get(sala)
+        if instantanea is not None:
+            return instantanea
+        with self._lock:
+            miembros = self._miembros.get(sala)
+            if miembros is None:
+                return ()
+            instantanea = self._instantaneas[sala] = tuple(miembros.values())
+            return instantanea
+
+    def sala_de(self, clave):
+        return self._sala_de.get(clave)
+
+    def ocupacion(self):
+        """Cantidad de miembros por sala."""
+        with self._lock:
+            return {sala: len(miembros) for sala, miembros in self._miembros.items()}
+
+def nombre_de_sala_valido(nombre):
+    return 0 < len(nombre) <= MAX_LEN_SALA and nombre.isprintable() and ' ' not in nombre
+
+def procesar_comando_sala(indice, clave, miembro, sala_actual, comando, argumento):
+    """
+    Atiende /join <sala> y /leave. Devuelve (sala en la que queda el cliente,
+    texto de respuesta), o None si el comando no es de salas.
+    """
+    if comando == '/join':
+        if not nombre_de_sala_valido(argumento):
+            return sala_actual, f"Nombre de sala inválido: '{argumento}'"
+        indice.unir(clave, miembro, argumento)
+        return argumento, f"Te uniste a la sala {argumento}"
+
+    if comando == '/leave':
+        if sala_actual == SALA_GENERAL:
+            return sala_actual, f"Ya estás en la sala {SALA_GENERAL}"
+        indice.unir(clave, miembro, SALA_GENERAL)
+        return SALA_GENERAL, f"Saliste de {sala_actual}, volviste a {SALA_GENERAL}"
+
+    return None
@@ -1,133 +1,882 @@
+import argparse
+import os
+import select
+import signal
 import socket      
+import tempfile
 import threading   
 import sys  
-from utils import validar_mensaje       
+import time
+from utils import validar_lote
+from colas import ColaSalida, POLITICAS, DESCARTAR_ANTIGUO
+from protocolo import (LectorTramas, MODOS, LINEAS, empaquetar, enviar_lote, prefijo_para,
+                       interpretar_comando, mensaje_del_servidor, tamano_mensaje, PING)
+from salas import IndiceSalas, SALA_GENERAL
+from bus import BusDifusion, crear_malla, extremos_del_worker
+from historial import HistorialMensajes
+from bitacora import POLITICAS_FSYNC, INTERVALO, abrir_bitacora
+from temporizador import RuedaTemporizadores, programar_revision
+from conexiones import TablaConexiones
+from comandos import Comandos
+from compresion import comprimir_mensaje
+from limites import POLITICAS_LIMITE, FRENAR, crear_limitador
+import traspaso
+from metricas import MetricasServidor, LockMedido, iniciar_servidor_estadisticas
+from perfilado import Perfilador, Secciones
+import registro
+from registro import NIVELES
 
 # Variables globales
-sockets_clientes = []  
-clientes_lock = threading.Lock()   
+metricas = MetricasServidor()
+# Conexiones activas por id; su lock registra cuánto se espera para tomarlo
+conexiones = TablaConexiones(LockMedido(threading.Lock(), metricas.espera_lock))
+salas = IndiceSalas()   # sala -> Conexion de sus miembros; el broadcast lo lee sin lock
+secciones = Secciones(metricas.registro)   # tiempos por sección, solo con --perfil-secciones
+bus = None   # BusDifusion hacia los demás workers cuando se usa --workers N
+historial = None   # HistorialMensajes de los últimos broadcasts, se crea en servir()
+# Ordena cada broadcast (guardarlo en el historial y leer la sala) con cada alta
+# (copiar el historial y entrar a la sala): un mensaje llega una sola vez, por
+# el historial o en vivo, nunca por ninguno de los dos
+orden_historial = threading.Lock()
+comandos = None   # Comandos del cliente (comandos.py), se crea en servir() con la configuración
+bitacora = None   # BitacoraMensajes durable, solo con --bitacora
+rueda = RuedaTemporizadores(time.monotonic())   # próxima revisión de inactividad de cada conexión
+listo = threading.Event()   # se activa cuando el servidor ya escucha (ver `direccion`)
+direccion = None   # (host, puerto) en el que escucha de verdad; con --port 0 lo elige el sistema
+parada = threading.Event()   # pedido de detención del motor de hilos, ver detener_servidor()
+socket_escucha = None
+despertador = None   # tubería (lectura, escritura) que hace soltar sus sockets a los hilos lectores en un traspaso
+canal_traspaso = None   # canal con el servidor nuevo que pidió el traspaso
+servidor_estadisticas = None   # servidor HTTP de --stats-puerto; lo cierra detener_servidor()
 
-def main():
-    global sockets_clientes
-    global clientes_lock
+# Línea que escribe --anunciar-listo en la salida estándar: 'LISTO <host> <puerto>'
+MARCA_LISTO = 'LISTO'
 
-    host = '127.0.0.1'   
-    port = 3001          
+def construir_parser():
+    """
+    Define las opciones de línea de comandos del servidor.
+    """
+    parser = argparse.ArgumentParser(description="Servidor de chat TCP")
+    parser.add_argument('--host', default='127.0.0.1', help="Dirección en la que escuchar")
+    parser.add_argument('--port', type=int, default=3001, help="Puerto en el que escuchar")
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads',
+                        help="Motor de concurrencia: un hilo por cliente (threads) o corrutinas (asyncio)")
+    parser.add_argument('--cola-capacidad', type=int, default=1024,
+                        help="Mensajes pendientes máximos por cliente antes de aplicar la política de desborde")
+    parser.add_argument('--cola-politica', choices=POLITICAS, default=DESCARTAR_ANTIGUO,
+                        help="Qué hacer cuando la cola de salida de un cliente está llena")
+    parser.add_argument('--protocolo', choices=MODOS, default=LINEAS,
+                        help="Entramado: líneas (compatible con client.py) o binario con cabecera de longitud")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Cantidad de procesos que comparten el puerto con SO_REUSEPORT (solo Linux/BSD)")
+    parser.add_argument('--ventana-ms', type=float, default=0,
+                        help="Ventana de agrupación de escrituras por cliente en ms (0 = enviar en cuanto haya datos)")
+    parser.add_argument('--ventana-bytes', type=int, default=64 * 1024,
+                        help="Bytes pendientes que fuerzan el envío antes de que termine la ventana")
+    parser.add_argument('--stats-puerto', type=int, default=None,
+                        help="Puerto de loopback donde servir las métricas en texto por HTTP "
+                             "(con --workers, el worker i usa este puerto + i)")
+    parser.add_argument('--historial', type=int, default=50,
+                        help="Últimos mensajes que se guardan y se reenvían a cada cliente nuevo (0 = sin historial)")
+    parser.add_argument('--historial-bytes', type=int, default=256 * 1024,
+                        help="Tamaño máximo del historial en bytes")
+    parser.add_argument('--bitacora', metavar='DIRECTORIO', default=None,
+                        help="Guarda cada broadcast en un log durable en este directorio")
+    parser.add_argument('--bitacora-fsync', choices=POLITICAS_FSYNC, default=INTERVALO,
+                        help="Cuándo sincronizar el log con el disco")
+    parser.add_argument('--bitacora-intervalo-ms', type=float, default=100,
+                        help="Intervalo entre sincronizaciones con --bitacora-fsync intervalo")
+    parser.add_argument('--bitacora-segmento-mb', type=float, default=64,
+                        help="Tamaño de cada segmento del log")
+    parser.add_argument('--bitacora-retencion-mb', type=float, default=None,
+                        help="Tamaño máximo del log; se borran los segmentos más viejos")
+    parser.add_argument('--bitacora-retencion-horas', type=float, default=None,
+                        help="Antigüedad máxima de los segmentos del log")
+    parser.add_argument('--ping-s', type=float, default=30,
+                        help="Segundos sin recibir nada tras los que se envía un latido '/ping' (0 = sin latidos)")
+    parser.add_argument('--inactividad-s', type=float, default=120,
+                        help="Segundos sin recibir nada tras los que se cierra la conexión (0 = nunca)")
+    parser.add_argument('--limite-mensajes', type=float, default=0,
+                        help="Mensajes por segundo que puede enviar cada cliente (0 = sin límite)")
+    parser.add_argument('--limite-bytes', type=float, default=0,
+                        help="Bytes por segundo que puede enviar cada cliente (0 = sin límite)")
+    parser.add_argument('--limite-rafaga-s', type=float, default=1.0,
+                        help="Segundos de tráfico a tasa máxima que se permiten de una sola vez")
+    parser.add_argument('--limite-politica', choices=POLITICAS_LIMITE, default=FRENAR,
+                        help="Con un cliente sobre su límite: dejar de leerlo (frenar) o descartar sus mensajes")
+    parser.add_argument('--max-conexiones', type=int, default=0,
+                        help="Clientes simultáneos máximos; los que llegan de más se rechazan (0 = sin tope)")
+    parser.add_argument('--backlog', type=int, default=128,
+                        help="Conexiones pendientes de aceptar que encola el kernel")
+    parser.add_argument('--compresion-umbral', type=int, default=128,
+                        help="Bytes a partir de los cuales se comprimen los mensajes para quien pidió /comprimir")
+    parser.add_argument('--compresion-nivel', type=int, choices=range(1, 10), default=6, metavar='1-9',
+                        help="Nivel de zlib para los mensajes comprimidos")
+    parser.add_argument('--traspaso', metavar='RUTA', default=None,
+                        help="Socket Unix para reinicios sin cortes: si ya hay un servidor en esa ruta, "
+                             "este hereda su socket de escucha y sus conexiones; luego espera ahí al siguiente")
+    parser.add_argument('--traspaso-plazo-s', type=float, default=2.0,
+                        help="Segundos que tiene cada conexión para terminar de enviar lo pendiente en un traspaso; "
+                             "la que no llega se cierra en lugar de entregarse")
+    parser.add_argument('--perfil-secciones', action='store_true',
+                        help="Mide accept, recv, validación, broadcast y remoción en histogramas de /metrics")
+    parser.add_argument('--perfil-segundos', type=float, default=10,
+                        help="Duración del muestreo de pilas (SIGUSR1) y de la diferencia de memoria (SIGUSR2)")
+    parser.add_argument('--perfil-dir', default=tempfile.gettempdir(),
+                        help="Directorio donde se guardan los perfilados pedidos por señal")
+    parser.add_argument('--anunciar-listo', action='store_true',
+                        help=f"Escribe '{MARCA_LISTO} <host> <puerto>' en la salida estándar al empezar a escuchar")
+    parser.add_argument('--log-nivel', choices=NIVELES, default='INFO',
+                        help="Nivel mínimo de los registros que se escriben")
+    parser.set_defaults(id_worker=0)
+    return parser
+
+# Configuración activa; main() la reemplaza con los argumentos recibidos
+config = construir_parser().parse_args([])
+
+def main(argv=None):
+    global config
+
+    parser = construir_parser()
+    args = parser.parse_args(argv)
+    config = args
+
+    if args.workers > 1 and (not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT')):
+        parser.error("--workers requiere fork() y SO_REUSEPORT (Linux/BSD)")
+    if args.workers > 1 and args.port == 0:
+        parser.error("--workers necesita un puerto fijo: con --port 0 cada worker escucharía en uno distinto")
+    if args.traspaso and (args.workers > 1 or not traspaso.disponible()):
+        parser.error("--traspaso requiere un solo worker y sockets Unix con SCM_RIGHTS (Linux)")
+
+    registro.configurar_registro(args.log_nivel)
+    try:
+        if args.workers > 1:
+            ejecutar_workers(args)
+        else:
+            # SIGTERM (p. ej. de ServidorChat.detener()) cierra ordenadamente como Ctrl+C
+            signal.signal(signal.SIGTERM, lambda signum, frame: detener_servidor())
+            arrancar(args)
+    finally:
+        registro.detener_registro()   # escribe lo que quede en la cola
+
+def arrancar(args, bus_workers=None, al_escuchar=None):
+    """
+    Arranca en este proceso el motor elegido con --engine y bloquea hasta que
+    termina. `al_escuchar(host, puerto)` se llama cuando el socket ya escucha
+    (por defecto, escuchando()).
+    """
+    al_escuchar = al_escuchar or escuchando
+    listo.clear()
+    perfilador = Perfilador(args.perfil_dir, args.perfil_segundos)
+    if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR1'):
+        perfilador.instalar_senales()
+
+    def escuchando_con_estadisticas(metricas_motor, tabla):
+        # Las métricas se sirven recién cuando el motor escucha: en un traspaso
+        # el puerto lo libera el servidor anterior al soltar (ver detener_estadisticas)
+        def avisar(host, puerto):
+            global servidor_estadisticas
+            servidor_estadisticas = iniciar_estadisticas(args, metricas_motor, tabla, perfilador)
+            al_escuchar(host, puerto)
+        return avisar
+
+    try:
+        if args.engine == 'asyncio':
+            # Import diferido: el motor asyncio solo se carga si se pide
+            import servidor_asyncio
+            if args.perfil_secciones:
+                servidor_asyncio.secciones.activar()
+            registro.contar_descartes(servidor_asyncio.metricas.registros_descartados.incrementar)
+            al_escuchar_motor = escuchando_con_estadisticas(servidor_asyncio.metricas, servidor_asyncio.conexiones)
+            servidor_asyncio.main(args.host, args.port, args, bus_workers, al_escuchar_motor, detener_estadisticas)
+            return
+
+        if args.perfil_secciones:
+            secciones.activar()
+        registro.contar_descartes(metricas.registros_descartados.incrementar)
+        servir(args.host, args.port, bus_workers, escuchando_con_estadisticas(metricas, conexiones),
+               detener_estadisticas)
+    finally:
+        detener_estadisticas()   # si no se cerró ya al soltar un traspaso
+        if bus_workers is not None:
+            bus_workers.cerrar()   # los demás workers ven EOF y dejan de leer este extremo
+        listo.clear()
 
-    socket_servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  
-    socket_servidor.bind((host,port))  
+def escuchando(host, puerto):
+    """
+    Anota la dirección real del servidor y avisa que ya acepta conexiones.
+    """
+    global direccion
+    direccion = (host, puerto)
+    listo.set()
+    if config.anunciar_listo:
+        # Una sola escritura: print() manda el salto aparte y se podría
+        # intercalar con una línea del hilo del registro
+        sys.stdout.write(f"{MARCA_LISTO} {host} {puerto}\n")
+        sys.stdout.flush()
+
+def detener_servidor():
+    """
+    Pide al servidor que corre en este proceso que termine: deja de aceptar y
+    cierra las conexiones y la bitácora. Se puede llamar desde otro hilo o
+    desde un manejador de señal.
+    """
+    detener_estadisticas()
+    if config.engine == 'asyncio':
+        import servidor_asyncio
+        servidor_asyncio.detener_servidor()
+        return
+
+    parada.set()
+    if socket_escucha is not None:
+        try:
+            socket_escucha.shutdown(socket.SHUT_RDWR)   # despierta al accept()
+        except OSError:
+            pass
+
+def iniciar_estadisticas(args, metricas_motor, tabla, perfilador=None):
+    """
+    Con --stats-puerto levanta el servidor HTTP de métricas y lo devuelve
+    (None sin la opción). Además de /metrics sirve /colas, con las colas de
+    salida de los clientes de `tabla`.
+    """
+    if args.stats_puerto is None:
+        return None
+    puerto = args.stats_puerto + args.id_worker
+    rutas = tabla.rutas()
+    if perfilador is not None:
+        rutas.update(perfilador.rutas())
+    servidor = iniciar_servidor_estadisticas(metricas_motor.registro, puerto, rutas=rutas)
+    registro.info('estadisticas', f"Métricas disponibles en http://127.0.0.1:{puerto}/metrics", puerto=puerto)
+    return servidor
 
-    socket_servidor.listen(5)   
+def detener_estadisticas():
+    """
+    Cierra el servidor de métricas y libera su puerto, para poder volver a
+    arrancar o para que lo tome el servidor nuevo de un traspaso.
+    """
+    global servidor_estadisticas
+    servidor, servidor_estadisticas = servidor_estadisticas, None
+    if servidor is not None:
+        servidor.shutdown()   # espera a que termine serve_forever() en su hilo
+        servidor.server_close()
+
+def ejecutar_workers(args):
+    """
+    Modo multiproceso: crea la malla del bus, lanza un hijo por worker y espera.
+    Cada hijo abre su propio socket en el mismo puerto (SO_REUSEPORT) y el
+    kernel reparte las conexiones entrantes entre ellos.
+    """
+    malla = crear_malla(args.workers)
+    hijos = []
+
+    def detener(signum, frame):
+        raise KeyboardInterrupt
+
+    # Antes del fork: un SIGTERM que llega mientras se lanzan los hijos igual los detiene
+    signal.signal(signal.SIGTERM, detener)
+
+    for id_worker in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            codigo = 0
+            try:
+                # Como en un solo proceso: SIGTERM cierra ordenadamente y sella la bitácora
+                signal.signal(signal.SIGTERM, lambda signum, frame: detener_servidor())
+                # El hilo escritor del registro no sobrevive al fork: se crea uno nuevo
+                registro.configurar_registro(args.log_nivel)
+                args.id_worker = id_worker
+                arrancar(args, BusDifusion(extremos_del_worker(malla, id_worker)))
+            except BaseException as e:
+                registro.error('worker', "Worker terminó con error", worker=id_worker, error=e)
+                codigo = 1
+            finally:
+                registro.detener_registro()
+                sys.stdout.flush()
+                os._exit(codigo)
+        hijos.append(pid)
+
+    # El proceso padre no participa del bus
+    for extremos in malla:
+        for sock in extremos.values():
+            sock.close()
+
+    registro.info('inicio', "Servidor multiproceso escuchando", workers=args.workers, direccion=(args.host, args.port))
+
+    try:
+        for pid in hijos:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        registro.info('detencion', "Deteniendo workers")
+    finally:
+        # Se reenvía SIGTERM a todos y recién después se espera: cada worker
+        # cierra sus conexiones y su bitácora en paralelo con los demás
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for pid in hijos:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in hijos:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass   # ya se esperó arriba
+
+def servir(host, port, bus_workers=None, al_escuchar=None, al_soltar=None):
+    """
+    Motor de hilos: acepta conexiones y lanza un hilo lector y uno escritor por
+    cliente, hasta Ctrl+C o detener_servidor(). `al_soltar()` se llama en un
+    traspaso cuando el servidor nuevo ya confirmó, antes de dejarlo atender.
+    """
+    global bus
+    global historial
+    global comandos
+    global bitacora
+    global socket_escucha
+    global parada
+    global despertador
+    global canal_traspaso
+
+    parada = threading.Event()   # uno nuevo por arranque: los hilos de uno anterior siguen viendo el suyo
+    canal_traspaso = None
+
+    # Con --traspaso y un servidor vivo en esa ruta, se hereda todo de él
+    herencia = traspaso.pedir(config.traspaso) if config.traspaso else None
+    if herencia is not None:
+        # Se confirma antes de cualquier trabajo lento: si el anterior ya desistió, esto falla y él sigue
+        herencia.confirmar()
+        socket_servidor = herencia.socket_escucha   # ya enlazado y escuchando
+    else:
+        socket_servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  
+        # Permite reiniciar el servidor sin esperar a que expiren las conexiones en TIME_WAIT
+        socket_servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if config.workers > 1:
+            # Varios workers escuchan en el mismo puerto; el kernel reparte las conexiones
+            socket_servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        socket_servidor.bind((host,port))  
+
+    historial = HistorialMensajes(config.historial, config.historial_bytes) if config.historial > 0 else None
+    comandos = Comandos(config, conexiones, salas, metricas, encolar_o_desconectar)
+    if config.bitacora:
+        # En un traspaso el servidor anterior cerró la bitácora antes de entregar
+        bitacora = abrir_bitacora(config, metricas.bitacora_descartados.incrementar)
+        cargar_historial_de_bitacora()
+    if herencia is not None:
+        heredar_historial(herencia.historial)
+
+    if bus_workers:
+        bus = bus_workers
+        bus.iniciar(entregar_de_otro_worker)
+
+    socket_servidor.listen(config.backlog)
 
     socket_servidor.settimeout(1.0)  
+    socket_escucha = socket_servidor
+    host, port = socket_servidor.getsockname()[:2]   # puerto real si se pidió el 0
+
+    control = None
+    if config.traspaso:
+        despertador = os.pipe()
+        control = traspaso.escuchar(config.traspaso)
+        threading.Thread(target=atender_traspaso, args=(control, parada), daemon=True).start()
 
-    print(f"Servidor escuchando en {host}:{port}")
+    if herencia is not None:
+        for meta, conex in herencia.conexiones:
+            aceptar_conexion(conex, tuple(meta['peer']), meta)
+        registro.info('traspaso', "Se heredaron el socket de escucha y las conexiones del servidor anterior",
+                      conexiones=len(herencia.conexiones))
+
+    registro.info('inicio', "Servidor escuchando", direccion=(host, port), motor='threads')
+    if al_escuchar:
+        al_escuchar(host, port)
+
+    if config.ping_s > 0 or config.inactividad_s > 0:
+        threading.Thread(target=vigilar_conexiones, args=(parada,), daemon=True).start()
     
     try:
         while True:
-            try:
-                conex, direc = socket_servidor.accept()  
-                                                         
-                print(f"Se ha conectado el cliente desde {direc[0]}:{direc[1]}")
-
-                with clientes_lock: 
-                    sockets_clientes.append(conex)  
-                
-                thread = threading.Thread(target=manejo_de_cliente, args=(conex,direc)) 
-                thread.daemon = True  
-                thread.start() 
-
-            except socket.timeout:
-                pass
-            except Exception as e:
-                print(f"Error inesperado en el servidor principal: {e}")
+            aceptar_hasta_parada(socket_servidor)
+            if canal_traspaso is None or traspasar(canal_traspaso, socket_servidor, al_soltar):
+                break
+            reanudar_tras_traspaso(control)
             
     except KeyboardInterrupt:
-                print("Servidor detenido por el usuario (Ctrl + C)")
+                registro.info('detencion', "Servidor detenido por el usuario (Ctrl + C)")
     except Exception as e:
-                print(f"Error inesperado en el servidor principal: {e}")
+                registro.error('servidor', "Error inesperado en el servidor principal", error=e)
     finally:
-                print("Cerrando sockets de clientes.....")
-                with clientes_lock:
-                    for s in list(sockets_clientes):
-                        remover_cliente(s)
+                registro.info('detencion', "Cerrando sockets de clientes")
+                socket_escucha = None
+                socket_servidor.close()
+                if control is not None:
+                    cerrar_control_traspaso(control)
+                for conexion in conexiones.instantanea():
+                    remover_cliente(conexion)
+                if bitacora is not None:
+                    bitacora.cerrar()
+                    bitacora = None
+                if despertador is not None:
+                    for fd in despertador:
+                        os.close(fd)
+                    despertador = None
+
+def aceptar_hasta_parada(socket_servidor):
+    """
+    Bucle de aceptación: da de alta cada conexión nueva hasta que se pide la
+    detención o un traspaso.
+    """
+    while not parada.is_set():
+        try:
+            conex, direc = socket_servidor.accept()  
+
+            if config.max_conexiones and len(conexiones) >= config.max_conexiones:
+                rechazar_conexion(conex, direc)
+                continue
 
+            registro.info('conexion', "Se ha conectado el cliente", peer=direc)
+            metricas.registrar_aceptacion()
 
-def manejo_de_cliente(conex, direc):
+            with secciones.medir('accept'):
+                # Sin Nagle: la agrupación de escrituras la hace el escritor del cliente
+                conex.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                aceptar_conexion(conex, direc)
+
+        except socket.timeout:
+            pass
+        except Exception as e:
+            if parada.is_set():
+                break   # detener_servidor() cerró el socket de escucha
+            registro.error('aceptacion', "Error inesperado en el servidor principal", error=e)
+
+def aceptar_conexion(conex, direc, heredada=None):
+    """
+    Da de alta una conexión recién aceptada (o heredada en un traspaso, con sus
+    metadatos) y lanza sus hilos lector y escritor.
+    """
+    cola = ColaSalida(config.cola_capacidad, config.cola_politica,
+                      al_descartar=metricas.mensajes_descartados.incrementar)
+    conexion = conexiones.agregar(conex, direc, prefijo_para(direc), cola, SALA_GENERAL)
+    conexion.limitador = crear_limitador(config)
+    pendiente = b''
+    if heredada is not None:
+        pendiente = traspaso.restaurar_conexion(conexion, heredada)
+        metricas.conexiones_activas.sumar(1)
+        if conexion.apodo:
+            conexiones.renombrar(conexion, conexion.apodo)
+    programar_revision(rueda, config, conexion, conexion.ultima_actividad)
+    if heredada is None and historial is not None:
+        # El historial se encola antes de entrar a la sala, así queda
+        # delante de los mensajes en vivo; lo envía el hilo escritor
+        with orden_historial:
+            reenviar_historial(cola, SALA_GENERAL)
+            salas.unir(conexion, conexion, conexion.sala)
+    else:
+        salas.unir(conexion, conexion, conexion.sala)
+
+    thread = threading.Thread(target=manejo_de_cliente, args=(conexion, pendiente)) 
+    thread.daemon = True  
+    escritor = threading.Thread(target=escritor_de_cliente, args=(conexion,), daemon=True)
+    conexion.tareas = (thread, escritor)
+    thread.start() 
+    escritor.start()
+
+def manejo_de_cliente(conexion, pendiente=b''):
     """
     Función que se ejecuta en un hilo separado para manejar la comunicación
-    con un cliente específico.
+    con un cliente específico. `pendiente` son los bytes de una trama a medio
+    recibir que dejó el servidor anterior en un traspaso.
     """
-    
-    print(f"Hilo de manejo de cliente iniciado para {direc[0]}:{direc[1]}")
+    conex = conexion.transporte
+    registro.depurar('hilo_cliente', "Hilo de manejo de cliente iniciado", peer=conexion.etiqueta)
+
+    lector = conexion.lector = LectorTramas(config.protocolo)
+    if pendiente:
+        lector.alimentar(pendiente)
+    limitador = conexion.limitador
+    descartar = limitador is not None and config.limite_politica != FRENAR
+    # Con --traspaso se espera con poll() para poder soltar el socket sin cerrarlo
+    esperar = crear_espera_lectura(conex) if despertador is not None else None
+    traspasada = False
 
     try:
         while True:  
+            if esperar is not None and not esperar():
+                traspasada = True
+                break
             
-            datos = conex.recv(1024) 
+            recibidos = lector.recibir_de(conex)
+            if recibidos == 0:  # recv() vacío: el cliente cerró la conexión
+                registro.info('desconexion', "El cliente cerró la conexión", peer=conexion.etiqueta,
+                              duracion_s=time.monotonic() - conexion.conectada_en)
+                break
+            metricas.bytes_entrantes.incrementar(recibidos)
+            conexion.bytes_recibidos += recibidos
+            # Solo se anota la hora: la rueda mira este valor cuando vence el plazo
+            conexion.ultima_actividad = ahora = time.monotonic()
 
-            mensaje = datos.decode('utf-8').strip()
+            # Un solo recv puede traer varias tramas completas (o ninguna)
+            # Copia única de cada trama: las vistas se invalidan en el próximo recv
+            with secciones.medir('recv'):
+                cuerpos = [bytes(trama).strip() for trama in lector.tramas()]
+            metricas.mensajes_entrantes.incrementar(len(cuerpos))
+            conexion.mensajes_recibidos += len(cuerpos)
 
-            if not validar_mensaje(mensaje):  
-                print(f"Cliente en {direc[0]}:{direc[1]} se ha desconectado.")
-                continue
+            # Se valida sobre los bytes, sin decodificar a str
+            with secciones.medir('validacion'):
+                validos = validar_lote(cuerpos)
+            for cuerpo, valido in zip(cuerpos, validos):
+                if not valido:
+                    registro.advertencia('mensaje_invalido', "Mensaje inválido, se descarta", peer=conexion.etiqueta)
+                    continue
+
+                comando = interpretar_comando(cuerpo)
+                if comando:
+                    conexion.sala = comandos.procesar(conexion, *comando)
+                    continue
+
+                # Los comandos no cuentan: lo que se limita es el reparto a la sala
+                if descartar and not limitador.admitir(len(cuerpo), ahora):
+                    metricas.mensajes_limitados.incrementar()
+                    continue
 
-            mensaje_para_broadcast = f"[{direc[0]}:{direc[1]}] {mensaje}\n"
+                # El mensaje se arma una sola vez y se comparte entre todos los destinatarios
+                mensaje_para_broadcast = empaquetar(conexion.prefijo, cuerpo, config.protocolo)
 
-            Broadcast_mensajes(mensaje_para_broadcast.encode('utf-8'), conex)
+                with secciones.medir('broadcast'):
+                    Broadcast_mensajes(mensaje_para_broadcast, conexion, conexion.sala)
+                    if bus:
+                        bus.publicar(conexion.sala, conexion.prefijo, cuerpo)
+                    if bitacora is not None:
+                        bitacora.agregar(conexion.sala, conexion.prefijo, cuerpo)
+
+            if limitador is not None and not descartar:
+                # Sin leer el socket se llena el buffer del kernel y TCP frena al cliente
+                espera = limitador.adeudar(len(cuerpos), recibidos, ahora)
+                if espera > 0:
+                    metricas.esperas_limite.incrementar()
+                    time.sleep(espera)
 
     except (ConnectionResetError, BrokenPipeError) as e:
-        print(f"Cliente {direc[0]}:{direc[1]} se desconectó abruptamente: {e}")
+        registro.info('desconexion', "El cliente se desconectó abruptamente", peer=conexion.etiqueta, error=e,
+                      duracion_s=time.monotonic() - conexion.conectada_en)
     except Exception as e:
-        print(f"Error inesperado con el cliente {direc[0]}:{direc[1]}: {e}")
+        if conexion.activa:
+            registro.error('error_cliente', "Error inesperado con el cliente", peer=conexion.etiqueta, error=e)
     finally:
-        remover_cliente(conex) 
+        if not traspasada:   # el socket sigue abierto para el servidor nuevo
+            remover_cliente(conexion) 
 
-def Broadcast_mensajes(bytes_mensajes, socket_envio):
-    global sockets_clientes
-    global clientes_lock
+def crear_espera_lectura(conex):
+    """
+    Devuelve una función que bloquea hasta que el socket tiene algo para leer
+    (True) o hasta que un traspaso pide soltarlo (False).
+    """
+    sondeo = select.poll()
+    sondeo.register(conex, select.POLLIN)
+    sondeo.register(despertador[0], select.POLLIN)
+    lectura = despertador[0]
 
-    clientes_para_enviar = []
+    def esperar():
+        return all(fd != lectura for fd, _ in sondeo.poll())
 
-    with clientes_lock:
-        clientes_para_enviar = list(sockets_clientes)
-    
-    for socket_cliente in clientes_para_enviar:
-        if socket_cliente != socket_envio:  
-            try:
-                socket_cliente.send(bytes_mensajes)
-            except (BrokenPipeError, ConnectionResetError, OSError) as e:
-                print(f"Error al enviar mensaje a {socket_cliente.getpeername()}: {e}")
-                remover_cliente(socket_cliente)
-            except Exception as e:
-                print(f"Error inesperado al enviar mensaje a {socket_cliente.getpeername()}: {e}")
-                remover_cliente(socket_cliente)
-
-def remover_cliente(socket_cliente):
-    global sockets_clientes
-    global clientes_lock
+    return esperar
+
+def atender_traspaso(control, parada):
+    """
+    Hilo que espera en el socket de control a que un servidor nuevo pida el
+    traspaso; entonces corta el bucle de aceptación y servir() le entrega todo.
+    """
+    global canal_traspaso
+    canal = traspaso.esperar_pedido(control)
+    if canal is None:
+        return   # el servidor se detuvo sin traspaso
+    registro.info('traspaso', "Un servidor nuevo pidió el traspaso")
+    canal_traspaso = canal
+    parada.set()
+
+def cerrar_control_traspaso(control):
+    # El archivo no se borra: después de un traspaso ya es el del servidor nuevo
+    try:
+        control.shutdown(socket.SHUT_RDWR)   # despierta el accept() de atender_traspaso
+    except OSError:
+        pass
+    control.close()
+
+def traspasar(canal, socket_servidor, al_soltar=None):
+    """
+    Entrega el socket de escucha y las conexiones vivas al servidor nuevo.
+    Antes se deja de leer de los clientes (lo no leído queda en el kernel para
+    el nuevo) y se termina de enviarles lo que tenían en cola, así el nuevo
+    sigue exactamente donde quedó este. Una conexión que no termina dentro de
+    --traspaso-plazo-s (un cliente que no lee) se cierra: no frena a las demás.
+
+    Devuelve True si el servidor nuevo recibió todo. Si no, este servidor
+    recupera las conexiones y la bitácora y devuelve False para seguir.
+    """
+    global bitacora
+
+    plazo = time.monotonic() + config.traspaso_plazo_s
+    a_traspasar = conexiones.instantanea()
+    os.write(despertador[1], b'x')   # los hilos lectores sueltan sus sockets
+    for conexion in a_traspasar:
+        conexion.tareas[0].join(max(0, plazo - time.monotonic()))
+    for conexion in a_traspasar:
+        conexion.cola.cerrar(vaciar=True)
+    for conexion in a_traspasar:
+        conexion.tareas[1].join(max(0, plazo - time.monotonic()))
+
+    for conexion in a_traspasar:
+        if any(hilo.is_alive() for hilo in conexion.tareas):
+            registro.advertencia('traspaso', "La conexión no terminó de enviar a tiempo, se cierra",
+                                 peer=conexion.etiqueta, plazo_s=config.traspaso_plazo_s)
+            remover_cliente(conexion)   # el shutdown() destraba al escritor
+
+    # Las que se cerraron mientras tanto ya no están en la tabla
+    vivas = [conexion for conexion in a_traspasar if conexiones.quitar(conexion) is not None]
+    for conexion in vivas:
+        salas.salir(conexion)
+        rueda.cancelar(conexion)
+    metricas.conexiones_activas.sumar(-len(vivas))
+    entregas = [(traspaso.describir_conexion(conexion), conexion.transporte) for conexion in vivas]
+
+    if bitacora is not None:
+        bitacora.cerrar()   # la abre el servidor nuevo
+        bitacora = None
 
     try:
-        nombre_cliente = socket_cliente.getpeername()
+        traspaso.entregar(canal, socket_servidor, entregas, historial.entradas() if historial is not None else (),
+                          al_soltar=al_soltar)
+    except (traspaso.ErrorTraspaso, OSError) as e:
+        registro.error('traspaso', "Falló el traspaso, este servidor sigue atendiendo", error=e)
+        canal.close()
+        os.read(despertador[0], 1)   # si no, los lectores nuevos soltarían sus sockets de inmediato
+        if config.bitacora:
+            bitacora = abrir_bitacora(config, metricas.bitacora_descartados.incrementar)
+        for meta, conex in entregas:
+            aceptar_conexion(conex, tuple(meta['peer']), meta)
+        return False
+
+    registro.info('traspaso', "Conexiones entregadas al servidor nuevo", conexiones=len(vivas))
+    for conexion in vivas:
+        conexion.transporte.close()   # sin shutdown(): la conexión sigue en el servidor nuevo
+    return True
+
+def reanudar_tras_traspaso(control):
+    """
+    Tras un traspaso fallido: se vuelve a aceptar, a vigilar las conexiones y
+    a esperar el próximo pedido en el mismo socket de control.
+    """
+    global canal_traspaso
+    canal_traspaso = None
+    parada.clear()
+    threading.Thread(target=atender_traspaso, args=(control, parada), daemon=True).start()
+    if config.ping_s > 0 or config.inactividad_s > 0:
+        threading.Thread(target=vigilar_conexiones, args=(parada,), daemon=True).start()
+
+def heredar_historial(entradas):
+    # Con bitácora el historial ya se cargó de disco; si no, se usa el del servidor anterior
+    if historial is not None and len(historial) == 0:
+        for sala, mensaje in entradas:
+            historial.agregar(sala, (mensaje,))
 
+def rechazar_conexion(conex, direc):
+    """
+    Cierra una conexión que supera --max-conexiones, avisándole al cliente si su
+    buffer de envío lo permite (sin bloquear el hilo que acepta).
+    """
+    metricas.conexiones_rechazadas.incrementar()
+    registro.advertencia('conexion_rechazada', "Servidor lleno, se rechaza la conexión", peer=direc,
+                         maximo=config.max_conexiones)
+    try:
+        conex.setblocking(False)
+        conex.send(b''.join(mensaje_del_servidor("Servidor lleno, intenta más tarde", config.protocolo)))
     except OSError:
-        nombre_cliente = "<desconocido>"
-    with clientes_lock:
-        if socket_cliente in sockets_clientes:
-            sockets_clientes.remove(socket_cliente)
-            print(f"Cliente {nombre_cliente} desconectado y removido de la lista. Clientes activos: {len(sockets_clientes)}")
-        else:
-            print(f"Intento de remover cliente {nombre_cliente} que ya no esta en la lista.")
+        pass
+    finally:
+        conex.close()
+
+def Broadcast_mensajes(buffers_mensaje, origen, sala=SALA_GENERAL):
+    """
+    Encola el mensaje en la cola de salida de cada miembro de la sala. No escribe
+    en ningún socket: de eso se encarga el escritor de cada cliente, así que un
+    receptor lento no frena al emisor ni al resto de la sala.
+    """
+    inicio = time.perf_counter()
+
+    if historial is not None:
+        with orden_historial:   # ver aceptar_conexion()
+            historial.agregar(sala, buffers_mensaje)
+            clientes_para_enviar = salas.miembros(sala)
+    else:
+        # Instantánea inmutable de la sala: no hace falta tomar ningún lock
+        clientes_para_enviar = salas.miembros(sala)
+    comprimido = None   # se comprime una sola vez, al aparecer el primer destinatario que lo pidió
+    ahorro = 0
+
+    for conexion in clientes_para_enviar:
+        if conexion is not origen:  
+            mensaje = buffers_mensaje
+            if conexion.comprime:
+                if comprimido is None:
+                    comprimido = comprimir_mensaje(buffers_mensaje, config.compresion_umbral, config.compresion_nivel)
+                mensaje = comprimido
+                ahorro += tamano_mensaje(buffers_mensaje) - tamano_mensaje(comprimido)
+            encolar_o_desconectar(conexion, mensaje)
+
+    if ahorro:
+        metricas.bytes_ahorrados_compresion.incrementar(ahorro)
+    duracion = time.perf_counter() - inicio
+    metricas.duracion_broadcast.observar(duracion)
+    registro.depurar('broadcast', "Mensaje repartido", sala=sala, destinatarios=len(clientes_para_enviar),
+                     latencia_ms=duracion * 1000)
+
+def encolar_o_desconectar(conexion, mensaje):
+    """
+    Encola en la cola de salida del cliente. Si la cola pide desconectarlo
+    (llena con --cola-politica desconectar) se lo da de baja y devuelve False.
+    """
+    if conexion.cola.encolar(mensaje):
+        return True
+    if conexion.cola.cerrada:
+        return False   # ya se está dando de baja (o traspasando): no es un consumidor lento
+    registro.advertencia('consumidor_lento', "Cola de salida llena, se desconecta al cliente lento",
+                         peer=conexion.etiqueta, pendientes=conexion.cola.profundidad)
+    remover_cliente(conexion)
+    return False
+
+def reenviar_historial(cola, sala):
+    """
+    Encola en la cola de un cliente recién llegado los últimos mensajes de la sala.
+    """
+    if historial is not None:
+        for mensaje in historial.recientes(sala):
+            cola.encolar((mensaje,))
+
+def cargar_historial_de_bitacora():
+    # Tras un reinicio, el historial en memoria arranca con lo último del log
+    if historial is not None:
+        for _, _, sala, prefijo, cuerpo in bitacora.ultimos(historial.capacidad_mensajes):
+            historial.agregar(sala, empaquetar(prefijo, cuerpo, config.protocolo))
+
+def entregar_de_otro_worker(sala, prefijo, cuerpo):
+    """
+    Reparte a los clientes de este worker un mensaje que llegó por el bus.
+    No se vuelve a publicar: cada worker publica solo lo que dicen sus clientes.
+    """
+    Broadcast_mensajes(empaquetar(prefijo, cuerpo, config.protocolo), None, sala)
+    if bitacora is not None:
+        bitacora.agregar(sala, prefijo, cuerpo)
+
+def escritor_de_cliente(conexion):
+    """
+    Hilo escritor de una conexión: vacía su cola de salida en el socket.
+    Todo lo pendiente sale en una sola llamada a sendmsg(); con --ventana-ms
+    además espera hasta ese tiempo (o hasta juntar --ventana-bytes) para
+    agrupar ráfagas. Termina cuando remover_cliente cierra la cola.
+    """
+    ventana = config.ventana_ms / 1000
+    socket_cliente = conexion.transporte
+    cola = conexion.cola
+
+    try:
+        while True:
+            pendientes = cola.extraer()
+            if pendientes is None:
+                break
+
+            if ventana > 0:
+                pendientes = completar_ventana(cola, pendientes, ventana)
+                if pendientes is None:
+                    break
+
+            metricas.bytes_salientes.incrementar(enviar_lote(socket_cliente, pendientes))
+            metricas.mensajes_salientes.incrementar(len(pendientes))
+    except (BrokenPipeError, ConnectionResetError, OSError) as e:
+        if not cola.cerrada:
+            metricas.fallos_envio.incrementar()
+            registro.advertencia('envio_fallido', "Error al enviar mensaje a un cliente",
+                                 peer=conexion.etiqueta, error=e)
+            remover_cliente(conexion)
+    except Exception as e:
+        metricas.fallos_envio.incrementar()
+        registro.error('envio_fallido', "Error inesperado al enviar mensaje a un cliente",
+                       peer=conexion.etiqueta, error=e)
+        remover_cliente(conexion)
+
+def completar_ventana(cola, pendientes, ventana):
+    """
+    Sigue sacando mensajes de la cola hasta que vence la ventana o se junta
+    --ventana-bytes. El orden se conserva porque hay un solo escritor por cola.
+    """
+    plazo = time.monotonic() + ventana
+    acumulado = sum(tamano_mensaje(mensaje) for mensaje in pendientes)
+
+    while acumulado < config.ventana_bytes:
+        restante = plazo - time.monotonic()
+        if restante <= 0:
+            break
+        nuevos = cola.extraer(restante)
+        if nuevos is None:
+            return None
+        pendientes.extend(nuevos)
+        acumulado += sum(tamano_mensaje(mensaje) for mensaje in nuevos)
+
+    return pendientes
+
+def revisar_conexion(conexion, ahora):
+    if not conexion.activa:
+        return   # ya se removió
+    ultima = conexion.ultima_actividad
+    inactivo = ahora - ultima
+
+    if config.inactividad_s > 0 and inactivo >= config.inactividad_s:
+        registro.info('inactividad', "Conexión sin actividad, se cierra", peer=conexion.etiqueta,
+                      inactivo_s=inactivo)
+        remover_cliente(conexion)
+        return
+
+    if config.ping_s > 0 and inactivo >= config.ping_s:
+        conexion.cola.encolar(mensaje_del_servidor(PING, config.protocolo))
+        programar_revision(rueda, config, conexion, ultima, ahora)
+    else:
+        programar_revision(rueda, config, conexion, ultima)
+
+def vigilar_conexiones(parada):
+    """
+    Hilo que avanza la rueda de temporizadores: envía latidos a las conexiones
+    calladas y cierra las que superan --inactividad-s. Cada tick solo toca las
+    conexiones cuyo plazo venció.
+    """
+    while not parada.wait(rueda.resolucion):
+        ahora = time.monotonic()
+        for conexion in rueda.avanzar(ahora):
+            revisar_conexion(conexion, ahora)
+
+def remover_cliente(conexion):
+    with secciones.medir('remocion'):
+        # Solo la primera baja de la conexión sigue adelante (O(1), sin recorrer listas)
+        activos = conexiones.quitar(conexion)
+        if activos is None:
+            registro.depurar('remocion', "Intento de remover un cliente que ya no esta en la lista",
+                             peer=conexion.etiqueta)
+            return
+
+        salas.salir(conexion)
+        rueda.cancelar(conexion)
+        metricas.conexiones_activas.sumar(-1)
+        registro.info('remocion', "Cliente removido de la lista", peer=conexion.etiqueta, activos=activos)
+
+        conexion.cola.cerrar()  # despierta al hilo escritor para que termine
     
     try:
-        socket_cliente.shutdown(socket.SHUT_RDWR)
+        conexion.transporte.shutdown(socket.SHUT_RDWR)
 
     except OSError as e:
-        print(f"Error al intentar apagar el socket {nombre_cliente}: {e}")
+        registro.depurar('cierre', "Error al intentar apagar el socket", peer=conexion.etiqueta, error=e)
 
     finally:
-        socket_cliente.close()
-        print(f"Socket {nombre_cliente} cerrado.")
+        conexion.transporte.close()
         
 if __name__ == '__main__':
     try:
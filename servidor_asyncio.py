@@ -0,0 +1,604 @@
+import asyncio
+import socket
+import threading
+import time
+from utils import validar_lote
+from colas import ColaSalida
+from protocolo import (LectorTramas, empaquetar, prefijo_para, interpretar_comando, mensaje_del_servidor,
+                       tamano_mensaje, PING)
+from salas import IndiceSalas, SALA_GENERAL
+from metricas import MetricasServidor
+from perfilado import Secciones
+from historial import HistorialMensajes
+from bitacora import abrir_bitacora
+from temporizador import RuedaTemporizadores, programar_revision
+from conexiones import TablaConexiones
+from compresion import comprimir_mensaje
+from comandos import Comandos
+from limites import FRENAR, crear_limitador
+import traspaso
+import registro
+
+TIMEOUT_CIERRE = 2   # segundos para cerrar las conexiones al detener; las que no cierran se abortan
+
+# Variables globales del motor asyncio. Todas las corrutinas corren en el mismo
+# hilo del bucle de eventos, así que estas estructuras no necesitan un lock.
+metricas = MetricasServidor()
+conexiones = TablaConexiones()   # id -> Conexion (transporte = StreamWriter)
+bus = None   # BusDifusion hacia los demás workers cuando se usa --workers N
+historial = None   # HistorialMensajes de los últimos broadcasts, se crea en main()
+comandos = None   # Comandos del cliente (comandos.py), se crea en main() con la configuración
+bitacora = None   # BitacoraMensajes durable, solo con --bitacora
+rueda = RuedaTemporizadores(time.monotonic())   # próxima revisión de inactividad de cada conexión
+salas = IndiceSalas()   # sala -> Conexion de sus miembros
+secciones = Secciones(metricas.registro)   # tiempos por sección, solo con --perfil-secciones
+tareas_en_curso = set()   # referencias a tareas lanzadas sin await, para que no las recolecte el GC
+config = None
+bucle = None   # bucle de eventos y tarea de servir() mientras el servidor corre, para detener_servidor()
+tarea_servidor = None
+tarea_traspaso = None   # entrega en curso al servidor nuevo (--traspaso)
+traspasando = False     # los lectores que ven EOF sueltan la conexión en vez de cerrarla
+tarea_vigilancia = None
+
+def main(host, port, args, bus_workers=None, al_escuchar=None, al_soltar=None):
+    """
+    Punto de entrada del motor asyncio: equivalente a server.main() pero con
+    una corrutina por cliente en lugar de un hilo. `al_escuchar(host, puerto)`
+    se llama cuando el socket ya escucha; `al_soltar()`, en un traspaso,
+    cuando el servidor nuevo ya confirmó.
+    """
+    global config
+    global bus
+    global historial
+    global comandos
+    global bitacora
+    config = args
+    bus = bus_workers
+    # Con --traspaso y un servidor vivo en esa ruta, se hereda todo de él (antes de abrir la bitácora)
+    herencia = traspaso.pedir(config.traspaso) if config.traspaso else None
+    if herencia is not None:
+        # Se confirma antes de cualquier trabajo lento: si el anterior ya desistió, esto falla y él sigue
+        herencia.confirmar()
+    historial = HistorialMensajes(config.historial, config.historial_bytes) if config.historial > 0 else None
+    comandos = Comandos(config, conexiones, salas, metricas, encolar_o_desconectar)
+    if config.bitacora:
+        bitacora = abrir_bitacora(config, metricas.bitacora_descartados.incrementar)
+        cargar_historial_de_bitacora()
+    if herencia is not None:
+        heredar_historial(herencia.historial)
+
+    try:
+        asyncio.run(servir(host, port, al_escuchar, herencia, al_soltar))
+    except KeyboardInterrupt:
+        registro.info('detencion', "Servidor detenido por el usuario (Ctrl + C)")
+
+def detener_servidor():
+    """
+    Cancela servir() desde cualquier hilo (o desde un manejador de señal); su
+    finally cierra las conexiones y la bitácora.
+    """
+    if bucle is not None:
+        bucle.call_soon_threadsafe(tarea_servidor.cancel)
+
+async def servir(host, port, al_escuchar=None, herencia=None, al_soltar=None):
+    global bucle
+    global tarea_servidor
+    global tarea_traspaso
+    global traspasando
+    global tarea_vigilancia
+    global bitacora
+
+    tarea_traspaso = None
+    traspasando = False
+    if herencia is not None:
+        # El socket heredado ya está enlazado y escuchando
+        servidor = await asyncio.start_server(manejo_de_cliente, sock=herencia.socket_escucha,
+                                              backlog=config.backlog)
+    else:
+        servidor = await asyncio.start_server(manejo_de_cliente, host, port, backlog=config.backlog,
+                                              reuse_port=config.workers > 1)
+
+    if bus:
+        loop = asyncio.get_running_loop()
+        # El bus entrega desde su propio hilo: se pasa el trabajo al bucle de eventos
+        bus.iniciar(lambda sala, prefijo, cuerpo:
+                    loop.call_soon_threadsafe(entregar_de_otro_worker, sala, prefijo, cuerpo))
+
+    host, port = servidor.sockets[0].getsockname()[:2]   # puerto real si se pidió el 0
+    bucle = asyncio.get_running_loop()
+    tarea_servidor = asyncio.current_task()
+
+    control = None
+    if config.traspaso:
+        control = traspaso.escuchar(config.traspaso)
+        threading.Thread(target=atender_traspaso, args=(control, bucle, servidor, al_soltar), daemon=True).start()
+
+    if herencia is not None:
+        for meta, sock in herencia.conexiones:
+            await adoptar_conexion(sock, meta)
+        registro.info('traspaso', "Se heredaron el socket de escucha y las conexiones del servidor anterior",
+                      conexiones=len(herencia.conexiones))
+
+    registro.info('inicio', "Servidor escuchando", direccion=(host, port), motor='asyncio')
+    if al_escuchar:
+        al_escuchar(host, port)
+
+    if config.ping_s > 0 or config.inactividad_s > 0:
+        tarea_vigilancia = asyncio.create_task(vigilar_conexiones())
+
+    try:
+        while True:
+            try:
+                async with servidor:
+                    await servidor.serve_forever()
+            except asyncio.CancelledError:
+                pass   # detener_servidor(), o traspasar() que cerró el servidor
+            if tarea_traspaso is None:
+                break
+            # Se entregan las conexiones antes de que se cierre nada; si falla, sigue este servidor
+            servidor = await tarea_traspaso
+            tarea_traspaso = None
+            if servidor is None:
+                break
+            reanudar_tras_traspaso(control, servidor, al_soltar)
+    finally:
+        if control is not None:
+            cerrar_control_traspaso(control)
+        bucle = None
+        registro.info('detencion', "Cerrando sockets de clientes")
+        restantes = conexiones.instantanea()
+        try:
+            # En paralelo: un cliente que no lee no demora el cierre de los demás
+            await asyncio.wait_for(asyncio.gather(*(remover_cliente(conexion) for conexion in restantes),
+                                                  return_exceptions=True), TIMEOUT_CIERRE)
+        except asyncio.TimeoutError:
+            for conexion in restantes:
+                conexion.transporte.transport.abort()
+        if bitacora is not None:
+            bitacora.cerrar()
+            bitacora = None
+
+async def manejo_de_cliente(reader, writer, heredada=None):
+    """
+    Corrutina que atiende a un cliente: lee sus mensajes y los reparte al resto.
+    `heredada` son los metadatos de una conexión recibida en un traspaso.
+    """
+    if heredada is None:
+        direc = writer.get_extra_info('peername')
+        if config.max_conexiones and len(conexiones) >= config.max_conexiones:
+            await rechazar_conexion(writer, direc)
+            return
+
+        registro.info('conexion', "Se ha conectado el cliente", peer=direc)
+        metricas.registrar_aceptacion()
+    else:
+        direc = tuple(heredada['peer'])
+        metricas.conexiones_activas.sumar(1)
+
+    with secciones.medir('accept'):
+        evento = asyncio.Event()
+        cola = ColaSalida(config.cola_capacidad, config.cola_politica, notificar=evento.set,
+                          al_descartar=metricas.mensajes_descartados.incrementar)
+
+        conexion = conexiones.agregar(writer, direc, prefijo_para(direc), cola, SALA_GENERAL)
+        conexion.limitador = limitador = crear_limitador(config)
+        conexion.entrada = reader
+        descartar = limitador is not None and config.limite_politica != FRENAR
+        lector = conexion.lector = LectorTramas(config.protocolo)
+        if heredada is not None:
+            lector.alimentar(traspaso.restaurar_conexion(conexion, heredada))
+            if conexion.apodo:
+                conexiones.renombrar(conexion, conexion.apodo)
+        programar_revision(rueda, config, conexion, conexion.ultima_actividad)
+        if heredada is None:
+            # El historial queda en la cola delante de los mensajes en vivo. Sin
+            # await entre copiarlo y entrar a la sala, ningún broadcast (tampoco
+            # uno del bus, que llega por el bucle) queda en el medio sin llegar
+            reenviar_historial(cola, SALA_GENERAL)
+        salas.unir(conexion, conexion, conexion.sala)
+        tarea_escritor = asyncio.create_task(escritor_de_cliente(conexion, evento))
+        conexion.tareas = (asyncio.current_task(), tarea_escritor)
+    traspasada = False
+
+    try:
+        while True:
+
+            datos = await reader.read(lector.libre())
+
+            if not datos and traspasando:
+                traspasada = True   # EOF puesto por traspasar(): el socket sigue abierto
+                break
+            if not datos:  # EOF: el cliente cerró la conexión
+                registro.info('desconexion', "El cliente cerró la conexión", peer=conexion.etiqueta,
+                              duracion_s=time.monotonic() - conexion.conectada_en)
+                break
+
+            lector.alimentar(datos)
+            metricas.bytes_entrantes.incrementar(len(datos))
+            conexion.bytes_recibidos += len(datos)
+            # Solo se anota la hora: la rueda mira este valor cuando vence el plazo
+            conexion.ultima_actividad = ahora = time.monotonic()
+
+            # Copia única de cada trama: las vistas se invalidan en el próximo recv
+            with secciones.medir('recv'):
+                cuerpos = [bytes(trama).strip() for trama in lector.tramas()]
+            metricas.mensajes_entrantes.incrementar(len(cuerpos))
+            conexion.mensajes_recibidos += len(cuerpos)
+
+            # Se valida sobre los bytes, sin decodificar a str
+            with secciones.medir('validacion'):
+                validos = validar_lote(cuerpos)
+            for cuerpo, valido in zip(cuerpos, validos):
+                if not valido:
+                    registro.advertencia('mensaje_invalido', "Mensaje inválido, se descarta", peer=conexion.etiqueta)
+                    continue
+
+                comando = interpretar_comando(cuerpo)
+                if comando:
+                    conexion.sala = comandos.procesar(conexion, *comando)
+                    continue
+
+                # Los comandos no cuentan: lo que se limita es el reparto a la sala
+                if descartar and not limitador.admitir(len(cuerpo), ahora):
+                    metricas.mensajes_limitados.incrementar()
+                    continue
+
+                # El mensaje se arma una sola vez y se comparte entre todos los destinatarios
+                mensaje_para_broadcast = empaquetar(conexion.prefijo, cuerpo, config.protocolo)
+
+                with secciones.medir('broadcast'):
+                    Broadcast_mensajes(mensaje_para_broadcast, conexion, conexion.sala)
+                    if bus:
+                        bus.publicar(conexion.sala, conexion.prefijo, cuerpo)
+                    if bitacora is not None:
+                        bitacora.agregar(conexion.sala, conexion.prefijo, cuerpo)
+
+            if limitador is not None and not descartar:
+                # Sin leer, el StreamReader pausa el transporte y TCP frena al cliente
+                espera = limitador.adeudar(len(cuerpos), len(datos), ahora)
+                if espera > 0:
+                    metricas.esperas_limite.incrementar()
+                    await asyncio.sleep(espera)
+
+    except (ConnectionResetError, BrokenPipeError) as e:
+        registro.info('desconexion', "El cliente se desconectó abruptamente", peer=conexion.etiqueta, error=e,
+                      duracion_s=time.monotonic() - conexion.conectada_en)
+    except Exception as e:
+        registro.error('error_cliente', "Error inesperado con el cliente", peer=conexion.etiqueta, error=e)
+    finally:
+        if not traspasada:   # traspasar() termina la escritura y entrega el socket
+            await remover_cliente(conexion)
+            await tarea_escritor
+
+def atender_traspaso(control, loop, servidor, al_soltar=None):
+    """
+    Hilo que espera en el socket de control a que un servidor nuevo pida el
+    traspaso y se lo pasa al bucle de eventos.
+    """
+    canal = traspaso.esperar_pedido(control)
+    if canal is not None:
+        loop.call_soon_threadsafe(iniciar_traspaso, canal, servidor, al_soltar)
+
+def iniciar_traspaso(canal, servidor, al_soltar=None):
+    global tarea_traspaso
+    registro.info('traspaso', "Un servidor nuevo pidió el traspaso")
+    tarea_traspaso = asyncio.create_task(traspasar(canal, servidor, al_soltar))
+
+def cerrar_control_traspaso(control):
+    # El archivo no se borra: después de un traspaso ya es el del servidor nuevo
+    try:
+        control.shutdown(socket.SHUT_RDWR)   # despierta el accept() de atender_traspaso
+    except OSError:
+        pass
+    control.close()
+
+async def traspasar(canal, servidor, al_soltar=None):
+    """
+    Entrega el socket de escucha y las conexiones vivas al servidor nuevo.
+    Se deja de leer de los clientes (lo no leído queda en el kernel para el
+    nuevo), se termina de escribirles todo lo pendiente y recién entonces se
+    pasan los sockets; al cerrar el servidor, servir() espera a esta tarea.
+    Una conexión que no termina dentro de --traspaso-plazo-s (un cliente que
+    no lee) se cierra: no frena a las demás.
+
+    Devuelve None si el servidor nuevo recibió todo. Si no, recupera las
+    conexiones y la bitácora y devuelve un servidor nuevo sobre el mismo
+    socket de escucha para que servir() siga.
+    """
+    global traspasando
+    global bitacora
+
+    loop = asyncio.get_running_loop()
+    limite = loop.time() + config.traspaso_plazo_s
+    escucha = servidor.sockets[0].dup()
+    servidor.close()   # deja de aceptar: lo que llegue espera en el backlog al servidor nuevo
+    traspasando = True
+
+    a_traspasar = conexiones.instantanea()
+    for conexion in a_traspasar:
+        conexion.transporte.transport.pause_reading()
+        conexion.entrada.feed_eof()   # el lector procesa lo ya leído y suelta la conexión
+    await esperar_hasta([conexion.tareas[0] for conexion in a_traspasar], limite)
+    for conexion in a_traspasar:
+        conexion.cola.cerrar(vaciar=True)
+    await esperar_hasta([conexion.tareas[1] for conexion in a_traspasar], limite)
+
+    drenajes = {}
+    for conexion in a_traspasar:
+        if all(tarea.done() for tarea in conexion.tareas):
+            conexion.transporte.transport.set_write_buffer_limits(0)   # drain() espera al buffer vacío
+            drenajes[conexion] = asyncio.ensure_future(conexion.transporte.drain())
+    await esperar_hasta(drenajes.values(), limite)
+
+    for conexion in a_traspasar:
+        drenaje = drenajes.get(conexion)
+        if drenaje is not None and drenaje.done():
+            drenaje.exception()   # un error de escritura lo descubre el servidor nuevo al usarla
+            continue
+        if drenaje is not None:
+            drenaje.cancel()
+        if conexion.activa:
+            registro.advertencia('traspaso', "La conexión no terminó de enviar a tiempo, se cierra",
+                                 peer=conexion.etiqueta, plazo_s=config.traspaso_plazo_s)
+            abortar_cliente(conexion)
+
+    # Las que se cerraron mientras tanto ya no están en la tabla
+    vivas = [conexion for conexion in a_traspasar if conexiones.quitar(conexion) is not None]
+    for conexion in vivas:
+        salas.salir(conexion)
+        rueda.cancelar(conexion)
+    metricas.conexiones_activas.sumar(-len(vivas))
+    entregas = [(traspaso.describir_conexion(conexion), conexion.transporte.get_extra_info('socket').dup())
+                for conexion in vivas]
+
+    if bitacora is not None:
+        bitacora.cerrar()   # la abre el servidor nuevo
+        bitacora = None
+
+    try:
+        await asyncio.to_thread(traspaso.entregar, canal, escucha, entregas,
+                                historial.entradas() if historial is not None else (), al_soltar=al_soltar)
+    except (traspaso.ErrorTraspaso, OSError) as e:
+        registro.error('traspaso', "Falló el traspaso, este servidor sigue atendiendo", error=e)
+        canal.close()
+        traspasando = False
+        if config.bitacora:
+            bitacora = abrir_bitacora(config, metricas.bitacora_descartados.incrementar)
+        for conexion in vivas:
+            conexion.transporte.close()   # el socket sigue abierto en su copia
+        for meta, sock in entregas:
+            await adoptar_conexion(sock, meta)
+        return await asyncio.start_server(manejo_de_cliente, sock=escucha, backlog=config.backlog)
+
+    registro.info('traspaso', "Conexiones entregadas al servidor nuevo", conexiones=len(vivas))
+    escucha.close()
+    for conexion, (_, sock) in zip(vivas, entregas):
+        sock.close()
+        conexion.transporte.close()   # sin shutdown: la conexión sigue en el servidor nuevo
+    return None
+
+async def esperar_hasta(tareas, limite):
+    # Como mucho hasta `limite` (hora del bucle); las que no terminan siguen corriendo
+    pendientes = [tarea for tarea in tareas if not tarea.done()]
+    if pendientes:
+        await asyncio.wait(pendientes, timeout=max(0, limite - asyncio.get_running_loop().time()))
+
+def reanudar_tras_traspaso(control, servidor, al_soltar=None):
+    """
+    Tras un traspaso fallido: se vuelve a vigilar las conexiones y a esperar
+    el próximo pedido en el mismo socket de control.
+    """
+    global tarea_vigilancia
+    threading.Thread(target=atender_traspaso, args=(control, bucle, servidor, al_soltar), daemon=True).start()
+    if (config.ping_s > 0 or config.inactividad_s > 0) and (tarea_vigilancia is None or tarea_vigilancia.done()):
+        tarea_vigilancia = asyncio.create_task(vigilar_conexiones())
+
+async def adoptar_conexion(sock, meta):
+    """Atiende una conexión recibida en un traspaso (o recuperada de uno fallido)."""
+    reader, writer = await asyncio.open_connection(sock=sock)
+    tarea = asyncio.create_task(manejo_de_cliente(reader, writer, meta))
+    tareas_en_curso.add(tarea)
+    tarea.add_done_callback(tareas_en_curso.discard)
+
+def heredar_historial(entradas):
+    # Con bitácora el historial ya se cargó de disco; si no, se usa el del servidor anterior
+    if historial is not None and len(historial) == 0:
+        for sala, mensaje in entradas:
+            historial.agregar(sala, (mensaje,))
+
+async def rechazar_conexion(writer, direc):
+    """
+    Cierra una conexión que supera --max-conexiones avisándole al cliente.
+    """
+    metricas.conexiones_rechazadas.incrementar()
+    registro.advertencia('conexion_rechazada', "Servidor lleno, se rechaza la conexión", peer=direc,
+                         maximo=config.max_conexiones)
+    writer.writelines(mensaje_del_servidor("Servidor lleno, intenta más tarde", config.protocolo))
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+
+def Broadcast_mensajes(buffers_mensaje, origen, sala=SALA_GENERAL):
+    """
+    Encola el mensaje en la cola de salida de cada miembro de la sala; la tarea
+    escritora de cada cliente lo envía. No hay await: el emisor nunca espera
+    a un receptor lento.
+    """
+    inicio = time.perf_counter()
+
+    if historial is not None:
+        historial.agregar(sala, buffers_mensaje)
+
+    comprimido = None   # se comprime una sola vez, al aparecer el primer destinatario que lo pidió
+    ahorro = 0
+
+    for conexion in salas.miembros(sala):
+        if conexion is not origen:
+            mensaje = buffers_mensaje
+            if conexion.comprime:
+                if comprimido is None:
+                    comprimido = comprimir_mensaje(buffers_mensaje, config.compresion_umbral, config.compresion_nivel)
+                mensaje = comprimido
+                ahorro += tamano_mensaje(buffers_mensaje) - tamano_mensaje(comprimido)
+            encolar_o_desconectar(conexion, mensaje)
+
+    if ahorro:
+        metricas.bytes_ahorrados_compresion.incrementar(ahorro)
+    duracion = time.perf_counter() - inicio
+    metricas.duracion_broadcast.observar(duracion)
+    registro.depurar('broadcast', "Mensaje repartido", sala=sala, latencia_ms=duracion * 1000)
+
+def encolar_o_desconectar(conexion, mensaje):
+    """
+    Encola en la cola de salida del cliente. Si la cola pide desconectarlo
+    (llena con --cola-politica desconectar) se lo da de baja en una tarea
+    aparte, sin esperar el cierre, y devuelve False.
+    """
+    if conexion.cola.encolar(mensaje):
+        return True
+    if conexion.cola.cerrada:
+        return False   # ya se está dando de baja (o traspasando): no es un consumidor lento
+    registro.advertencia('consumidor_lento', "Cola de salida llena, se desconecta al cliente lento",
+                         peer=conexion.etiqueta, pendientes=conexion.cola.profundidad)
+    tarea = asyncio.create_task(remover_cliente(conexion))
+    tareas_en_curso.add(tarea)
+    tarea.add_done_callback(tareas_en_curso.discard)
+    return False
+
+def reenviar_historial(cola, sala):
+    """
+    Encola en la cola de un cliente recién llegado los últimos mensajes de la sala.
+    """
+    if historial is not None:
+        for mensaje in historial.recientes(sala):
+            cola.encolar((mensaje,))
+
+def cargar_historial_de_bitacora():
+    # Tras un reinicio, el historial en memoria arranca con lo último del log
+    if historial is not None:
+        for _, _, sala, prefijo, cuerpo in bitacora.ultimos(historial.capacidad_mensajes):
+            historial.agregar(sala, empaquetar(prefijo, cuerpo, config.protocolo))
+
+def entregar_de_otro_worker(sala, prefijo, cuerpo):
+    # Mensaje de un cliente de otro worker: se reparte localmente sin volver a publicarlo
+    Broadcast_mensajes(empaquetar(prefijo, cuerpo, config.protocolo), None, sala)
+    if bitacora is not None:
+        bitacora.agregar(sala, prefijo, cuerpo)
+
+async def escritor_de_cliente(conexion, evento):
+    """
+    Tarea escritora de una conexión: vacía su cola de salida con una sola
+    escritura y espera a que el transporte drene. Con --ventana-ms agrupa los
+    mensajes que lleguen dentro de la ventana. Termina cuando remover_cliente
+    cierra la cola.
+    """
+    ventana = config.ventana_ms / 1000
+    loop = asyncio.get_running_loop()
+    escritor = conexion.transporte
+    cola = conexion.cola
+
+    try:
+        while True:
+            if not cola.cerrada:   # cerrada con vaciar=True: se sigue sin esperar aviso
+                await evento.wait()
+            evento.clear()
+            pendientes = cola.extraer(timeout=0)
+            if pendientes is None:
+                break
+
+            if ventana > 0:
+                plazo = loop.time() + ventana
+                acumulado = sum(tamano_mensaje(mensaje) for mensaje in pendientes)
+                while acumulado < config.ventana_bytes and loop.time() < plazo:
+                    try:
+                        await asyncio.wait_for(evento.wait(), plazo - loop.time())
+                    except asyncio.TimeoutError:
+                        break
+                    evento.clear()
+                    nuevos = cola.extraer(timeout=0)
+                    if nuevos is None:
+                        return
+                    pendientes.extend(nuevos)
+                    acumulado += sum(tamano_mensaje(mensaje) for mensaje in nuevos)
+
+            buffers = [buffer for mensaje in pendientes for buffer in mensaje]
+            escritor.writelines(buffers)
+            metricas.mensajes_salientes.incrementar(len(pendientes))
+            metricas.bytes_salientes.incrementar(tamano_mensaje(buffers))
+            await escritor.drain()
+    except (BrokenPipeError, ConnectionResetError, OSError) as e:
+        if not cola.cerrada:
+            metricas.fallos_envio.incrementar()
+            registro.advertencia('envio_fallido', "Error al enviar mensaje a un cliente",
+                                 peer=conexion.etiqueta, error=e)
+            await remover_cliente(conexion)
+    except Exception as e:
+        metricas.fallos_envio.incrementar()
+        registro.error('envio_fallido', "Error inesperado al enviar mensaje a un cliente",
+                       peer=conexion.etiqueta, error=e)
+        await remover_cliente(conexion)
+
+def revisar_conexion(conexion, ahora):
+    if not conexion.activa:
+        return   # ya se removió
+    ultima = conexion.ultima_actividad
+    inactivo = ahora - ultima
+
+    if config.inactividad_s > 0 and inactivo >= config.inactividad_s:
+        registro.info('inactividad', "Conexión sin actividad, se cierra", peer=conexion.etiqueta,
+                      inactivo_s=inactivo)
+        abortar_cliente(conexion)   # sin esperar el cierre: la rueda no se frena
+        return
+
+    if config.ping_s > 0 and inactivo >= config.ping_s:
+        conexion.cola.encolar(mensaje_del_servidor(PING, config.protocolo))
+        programar_revision(rueda, config, conexion, ultima, ahora)
+    else:
+        programar_revision(rueda, config, conexion, ultima)
+
+async def vigilar_conexiones():
+    """
+    Tarea que avanza la rueda de temporizadores: envía latidos a las conexiones
+    calladas y cierra las que superan --inactividad-s.
+    """
+    while not traspasando:
+        await asyncio.sleep(rueda.resolucion)
+        ahora = time.monotonic()
+        for conexion in rueda.avanzar(ahora):
+            revisar_conexion(conexion, ahora)
+
+def dar_de_baja(conexion):
+    """
+    Saca a la conexión de la tabla, de su sala y de la rueda, sin cerrar el
+    socket. Devuelve False si ya se había dado de baja.
+    """
+    with secciones.medir('remocion'):
+        # Solo la primera baja de la conexión sigue adelante (O(1), sin recorrer listas)
+        activos = conexiones.quitar(conexion)
+        if activos is None:
+            registro.depurar('remocion', "Intento de remover un cliente que ya no esta en la lista",
+                             peer=conexion.etiqueta)
+            return False
+
+        salas.salir(conexion)
+        rueda.cancelar(conexion)
+        conexion.cola.cerrar()  # despierta a la tarea escritora para que termine
+        metricas.conexiones_activas.sumar(-1)
+        registro.info('remocion', "Cliente removido de la lista", peer=conexion.etiqueta, activos=activos)
+    return True
+
+def abortar_cliente(conexion):
+    """Baja y cierre inmediato: lo que quedaba en el buffer de escritura se descarta."""
+    if dar_de_baja(conexion):
+        conexion.transporte.transport.abort()
+
+async def remover_cliente(conexion):
+    if not dar_de_baja(conexion):
+        return
+    try:
+        conexion.transporte.close()
+        await conexion.transporte.wait_closed()
+    except OSError as e:
+        registro.depurar('cierre', "Error al intentar cerrar el socket", peer=conexion.etiqueta, error=e)
@@ -0,0 +1,133 @@
+import os
+import subprocess
+import sys
+import threading
+
+import registro
+import server
+from server import MARCA_LISTO
+
+RUTA_SERVIDOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+_lock_en_proceso = threading.Lock()   # se toma mientras corre el servidor en proceso
+
+class ServidorChat:
+    """
+    Servidor de chat para embeber en tests y benchmarks. Por defecto escucha en
+    un puerto libre elegido por el sistema (puerto 0): cuando `listo` se
+    activa, `direccion` tiene el (host, puerto) real.
+
+    Con en_proceso=True corre en un hilo de este mismo proceso y arranca en
+    milisegundos, pero como los motores guardan su estado en variables de
+    módulo solo puede haber uno a la vez. Si no, lanza server.py en un
+    subproceso y se pueden tener tantos en paralelo como haga falta.
+
+        with ServidorChat('--historial', '0') as servidor:
+            socket.create_connection(servidor.direccion)
+    """
+
+    def __init__(self, *opciones, host='127.0.0.1', puerto=0, motor='threads', en_proceso=False):
+        self.opciones = [str(opcion) for opcion in opciones]
+        self.host = host
+        self.puerto = puerto
+        self.motor = motor
+        self.en_proceso = en_proceso
+        self.listo = threading.Event()
+        self.direccion = None
+        self.proceso = None
+        self._hilo = None
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    def iniciar(self, timeout=10):
+        """
+        Arranca el servidor y espera a que escuche. Devuelve (host, puerto).
+        """
+        argumentos = ['--engine', self.motor, '--host', self.host, '--port', str(self.puerto), *self.opciones]
+        if self.en_proceso:
+            self._iniciar_en_proceso(argumentos)
+        else:
+            self._iniciar_subproceso(argumentos)
+
+        if not self._esperar_listo(timeout):
+            self.detener()
+            raise RuntimeError(f"El servidor no empezó a escuchar en {timeout} s (o terminó antes)")
+        return self.direccion
+
+    def _esperar_listo(self, timeout):
+        # Se mira de a poco para no esperar todo el plazo si el servidor ya murió
+        for _ in range(int(timeout / 0.05) + 1):
+            if self.listo.wait(0.05):
+                return True
+            if not self._sigue_vivo():
+                return False
+        return False
+
+    def _sigue_vivo(self):
+        if self.proceso is not None:
+            return self.proceso.poll() is None
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def _iniciar_en_proceso(self, argumentos):
+        if not _lock_en_proceso.acquire(blocking=False):
+            raise RuntimeError("Ya hay un servidor en proceso corriendo: usar en_proceso=False para tener varios")
+        args = server.construir_parser().parse_args(argumentos)
+        server.config = args
+
+        def escuchando(host, puerto):
+            server.escuchando(host, puerto)
+            self.direccion = (host, puerto)
+            self.listo.set()
+
+        def correr():
+            # Como server.main(): registro con cola acotada y hilo escritor propio
+            registro.configurar_registro(args.log_nivel)
+            try:
+                server.arrancar(args, al_escuchar=escuchando)
+            finally:
+                registro.detener_registro()
+                _lock_en_proceso.release()
+
+        self._hilo = threading.Thread(target=correr, name='servidor-chat', daemon=True)
+        self._hilo.start()
+
+    def _iniciar_subproceso(self, argumentos):
+        self.proceso = subprocess.Popen(
+            [sys.executable, RUTA_SERVIDOR, *argumentos, '--anunciar-listo'],
+            stdout=subprocess.PIPE,   # registros + el anuncio de listo
+            text=True,
+        )
+        threading.Thread(target=self._leer_salida, args=(self.proceso,), daemon=True).start()
+
+    def _leer_salida(self, proceso):
+        # Busca el anuncio y sigue leyendo hasta el final para que la tubería no se llene
+        for linea in proceso.stdout:
+            if not self.listo.is_set() and linea.startswith(MARCA_LISTO + ' '):
+                _, host, puerto = linea.split()
+                self.direccion = (host, int(puerto))
+                self.listo.set()
+        proceso.stdout.close()
+
+    def detener(self, timeout=5):
+        """
+        Detención ordenada: deja de aceptar, cierra las conexiones y la
+        bitácora, y vuelve cuando el servidor terminó.
+        """
+        if self.proceso is not None:
+            self.proceso.terminate()   # server.py trata SIGTERM como Ctrl+C
+            try:
+                self.proceso.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.proceso.kill()
+                self.proceso.wait()
+            self.proceso = None
+        elif self._hilo is not None:
+            server.detener_servidor()
+            self._hilo.join(timeout)
+            self._hilo = None
+        self.listo.clear()
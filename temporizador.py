@@ -0,0 +1,75 @@
+import math
+import threading
+
+class RuedaTemporizadores:
+    """
+    Rueda de temporizadores con hash: cada plazo cae en la ranura de su tick
+    (tiempo / resolucion) módulo la cantidad de ranuras. Programar, cancelar y
+    avanzar un tick cuestan O(1) por temporizador, sin importar cuántas
+    conexiones haya. Los plazos más lejanos que una vuelta completa se quedan
+    en su ranura y se vuelven a mirar en la vuelta siguiente.
+    """
+
+    def __init__(self, ahora, resolucion=0.25, ranuras=512):
+        self.resolucion = resolucion
+        self._ranuras = [{} for _ in range(ranuras)]   # clave -> plazo
+        self._ubicacion = {}                             # clave -> índice de ranura
+        self._tick = int(ahora / resolucion)             # último tick procesado
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ubicacion)
+
+    def programar(self, clave, plazo):
+        """Programa (o reprograma) el temporizador de `clave` para el instante `plazo`."""
+        # Se redondea hacia arriba: cuando se procesa la ranura el plazo ya venció
+        tick = max(math.ceil(plazo / self.resolucion), self._tick + 1)
+        indice = tick % len(self._ranuras)
+        with self._lock:
+            anterior = self._ubicacion.get(clave)
+            if anterior is not None:
+                del self._ranuras[anterior][clave]
+            self._ranuras[indice][clave] = plazo
+            self._ubicacion[clave] = indice
+
+    def cancelar(self, clave):
+        with self._lock:
+            indice = self._ubicacion.pop(clave, None)
+            if indice is not None:
+                del self._ranuras[indice][clave]
+
+    def avanzar(self, ahora):
+        """
+        Procesa los ticks hasta `ahora` y devuelve las claves cuyo plazo venció.
+        Los temporizadores vencidos se quitan de la rueda.
+        """
+        vencidos = []
+        objetivo = int(ahora / self.resolucion)
+        with self._lock:
+            # Tras una pausa larga basta con recorrer cada ranura una vez
+            pasos = min(objetivo - self._tick, len(self._ranuras))
+            for paso in range(1, pasos + 1):
+                ranura = self._ranuras[(self._tick + paso) % len(self._ranuras)]
+                for clave, plazo in list(ranura.items()):
+                    if plazo <= ahora:
+                        del ranura[clave]
+                        del self._ubicacion[clave]
+                        vencidos.append(clave)
+            self._tick = max(self._tick, objetivo)
+        return vencidos
+
+def programar_revision(rueda, config, clave, ultima, ahora=None):
+    """
+    Programa en la rueda la próxima revisión de una conexión: cuando toque
+    enviarle un latido (--ping-s) o cerrarla por inactividad (--inactividad-s),
+    lo que llegue antes. `ultima` es su última actividad; `ahora`, si ya se le
+    envió un latido en esta revisión.
+    """
+    plazos = []
+    if config.ping_s > 0:
+        # Si ya se le envió un latido, el próximo va un intervalo después
+        plazos.append(max(ultima, (ahora or ultima)) + config.ping_s)
+    if config.inactividad_s > 0:
+        plazos.append(ultima + config.inactividad_s)
+    if plazos:
+        rueda.programar(clave, min(plazos))
@@ -3,64 +3,82 @@ import pytest
 import socket
 import threading
 import time
-import subprocess
-import os
+from servidor_chat import ServidorChat
 
 # --- CONFIGURACIÓN Y FIXTURE (SETUP/TEARDOWN) ---
 
 TEST_HOST = '127.0.0.1'
-TEST_PORT = 3001 # IMPORTANTE: Asegúrate que server.py use este puerto
+TEST_PORT = None # puerto que eligió el sistema para el servidor del fixture (se pide el 0)
 SERVER_PROCESS = None
+MOTOR_ACTUAL = None # motor con el que corre el servidor del fixture (threads / asyncio)
 
 """
 Usar el servidor real(server.py) en un subproceso con la libreria subprocess.
 Funciona creando dos entornos separados que se comunican a traves de la red real. El servidor real
 corre en el fondo mientras otros programas (los clientes de prueba) se conectan a el.
-La llamadaa subprocess.Popen() lanza el servidor com un proceso completamente nuevo e independiente
-(un subproceso o hijo).
+ServidorChat lanza el servidor com un proceso completamente nuevo e independiente
+(un subproceso o hijo) y espera a que anuncie que ya escucha.
 """
 
-@pytest.fixture(scope="module", autouse=True)
-def iniciar_y_detener_servidor():
+@pytest.fixture(scope="module", autouse=True, params=["threads", "asyncio"])
+def iniciar_y_detener_servidor(request):
     """
     La función iniciar_y_detener_servidor es un 
     fixture (accesorio o configuración) de pytest. Su único propósito es 
     garantizar que el servidor de chat esté corriendo y disponible para ser probado 
     antes de que se ejecute cualquier test de integración, y que se detenga 
     limpiamente después de que todos los tests hayan finalizado.
+    Está parametrizado por motor: todos los tests se ejecutan contra el
+    servidor de hilos y contra el servidor asyncio.
     """
     global SERVER_PROCESS
+    global MOTOR_ACTUAL
+    global TEST_PORT
     
-    # Obtiene la ruta absoluta completa del archivo server.py
-    server_path = os.path.abspath("server.py") 
-    
-    print(f"\n[SETUP] Iniciando servidor para tests en {TEST_PORT}...")
+    motor = request.param
+    MOTOR_ACTUAL = motor
+
+    print(f"\n[SETUP] Iniciando servidor ({motor}) para tests en un puerto libre...")
     
-    """Esta instrucción utiliza el módulo subprocess de Python para ejecutar un programa 
-    externo (en este caso, tu server.py) como un proceso hijo separado del script que está 
-    ejecutando Pytest."""
+    """Esta instrucción utiliza ServidorChat (con el módulo subprocess de Python) para ejecutar
+    un programa externo (en este caso, tu server.py) como un proceso hijo separado del script
+    que está ejecutando Pytest."""
    
-    SERVER_PROCESS = subprocess.Popen(
-        ['python', server_path],
-        stdout=subprocess.PIPE, # configuracion captura de salida del texto del servidor
-        stderr=subprocess.PIPE, # configuracion de captura de mensajes de errores
-        text=True  # se indica a Popen que las entradas y salidas seran como cadena de texto y no como bytes.
-    )
+    # Sin historial: el servidor se comparte entre tests y cada uno espera
+    # recibir solo sus propios mensajes
+    SERVER_PROCESS = ServidorChat('--historial', '0', motor=motor)
     
-    # Espera para que el servidor inicie y escuche
-    time.sleep(1.5) 
+    # iniciar() vuelve en cuanto el servidor anuncia que ya escucha, con la dirección real
+    _, TEST_PORT = SERVER_PROCESS.iniciar()
 
     yield # Ejecución de los tests
 
     # TEARDOWN: Detener el servidor
     print("[TEARDOWN] Deteniendo servidor...")
     if SERVER_PROCESS:
-        SERVER_PROCESS.terminate() # Enviar señal de terminación
-        try:
-            SERVER_PROCESS.wait(timeout=3)
-        except subprocess.TimeoutExpired:
-            SERVER_PROCESS.kill() # Matar si no termina
+        SERVER_PROCESS.detener() # SIGTERM y espera; lo mata si no termina
         print("[TEARDOWN] Servidor detenido.")
+
+@pytest.fixture
+def servidor_extra():
+    """
+    Permite lanzar, dentro de un test, servidores adicionales con opciones propias
+    (otro protocolo, otros límites...) usando el mismo motor que el fixture principal.
+    Escuchan en un puerto libre (servidor.direccion) salvo que se pida uno.
+    Se detienen al terminar el test.
+    """
+    servidores = []
+
+    def lanzar(*opciones, puerto=0):
+        servidor = ServidorChat(*opciones, puerto=puerto, motor=MOTOR_ACTUAL)
+        servidores.append(servidor)
+        servidor.iniciar() # vuelve cuando el servidor ya escucha
+        return servidor
+
+    yield lanzar
+
+    for servidor in servidores:
+        servidor.detener()
         
 """
 Esta funcion es un auxiliar clave para las pruebas de integración. 
@@ -68,6 +86,12 @@ Su objetivo es crear y configurar un cliente socket de forma rápida y confiable
 lista para interactuar con el servidor de chat que iniciaste en el fixture.
 """
 
+def puerto_libre():
+    """Un puerto libre en loopback, para opciones que necesitan uno fijo (--workers, --stats-puerto)."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((TEST_HOST, 0))
+        return s.getsockname()[1]
+
 def conectar_cliente(host, port, timeout=0.05): # tiempo maximo que el socket esperara por una operacion de bloqueo.
     """Conecta un socket cliente de prueba al servidor."""
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # se crea un objeto socket
@@ -278,3 +302,879 @@ def test_orden_y_unicidad_en_broadcast():
         # Aseguramos la limpieza total
         if cliente_emisor: cliente_emisor.close()
         if cliente_receptor: cliente_receptor.close()
+
+# --- TESTS DE INTEGRACIÓN: PROTOCOLO BINARIO (TRAMAS CON LONGITUD) ---
+
+def test_protocolo_binario_reensambla_tramas_unidas_y_partidas(servidor_extra):
+    """
+    En modo binario el servidor debe separar varias tramas llegadas en un solo
+    paquete y reconstruir una trama que llega partida en dos envíos.
+    """
+    import struct
+
+    puerto = servidor_extra('--protocolo', 'binario').direccion[1]
+
+    emisor = None
+    receptor = None
+
+    def trama(texto):
+        datos = texto.encode('utf-8')
+        return struct.pack('!I', len(datos)) + datos
+
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto)
+        receptor = conectar_cliente(TEST_HOST, puerto, timeout=1.0)
+
+        # Tres tramas en un solo envío y una cuarta partida a la mitad
+        emisor.sendall(trama("uno") + trama("dos") + trama("tres"))
+        partida = trama("cuatro")
+        emisor.sendall(partida[:5])
+        time.sleep(0.1)
+        emisor.sendall(partida[5:])
+
+        recibidos = []
+        datos = b''
+        while len(recibidos) < 4:
+            datos += receptor.recv(8192)
+            while len(datos) >= 4:
+                (longitud,) = struct.unpack('!I', datos[:4])
+                if len(datos) < 4 + longitud:
+                    break
+                recibidos.append(datos[4:4 + longitud].decode('utf-8').split('] ', 1)[1])
+                datos = datos[4 + longitud:]
+
+        assert recibidos == ["uno", "dos", "tres", "cuatro"]
+
+    finally:
+        if emisor: emisor.close()
+        if receptor: receptor.close()
+
+# --- TESTS DE INTEGRACIÓN: SALAS ---
+
+def test_mensajes_de_una_sala_solo_llegan_a_sus_miembros():
+    """
+    Dos clientes entran a la misma sala con /join: lo que dice uno le llega al otro,
+    pero no a un tercero que sigue en la sala general.
+    """
+    cliente_a = None
+    cliente_b = None
+    cliente_c = None
+
+    try:
+        cliente_a = conectar_cliente(TEST_HOST, TEST_PORT, timeout=0.5)
+        cliente_b = conectar_cliente(TEST_HOST, TEST_PORT, timeout=0.5)
+        cliente_c = conectar_cliente(TEST_HOST, TEST_PORT, timeout=0.5)
+
+        # Cada uno recibe la confirmación del servidor al entrar
+        for cliente in (cliente_a, cliente_b):
+            cliente.sendall(b"/join proyecto\n")
+            assert b"Te uniste a la sala proyecto" in cliente.recv(1024)
+
+        cliente_a.sendall("Solo para la sala proyecto".encode('utf-8'))
+
+        assert "Solo para la sala proyecto" in cliente_b.recv(1024).decode('utf-8')
+        with pytest.raises(socket.timeout):
+            cliente_c.recv(1024)
+
+    finally:
+        if cliente_a: cliente_a.close()
+        if cliente_b: cliente_b.close()
+        if cliente_c: cliente_c.close()
+
+def test_mensaje_directo_llega_solo_al_destinatario_con_acuse():
+    """
+    /msg entrega a un único cliente, por apodo o por #id, y el emisor recibe
+    el acuse; el resto de la sala no recibe nada. Al desconectarse el
+    destinatario su apodo queda libre.
+    """
+    cliente_a = None
+    cliente_b = None
+    cliente_c = None
+
+    try:
+        cliente_a = conectar_cliente(TEST_HOST, TEST_PORT, timeout=0.5)
+        cliente_b = conectar_cliente(TEST_HOST, TEST_PORT, timeout=0.5)
+        cliente_c = conectar_cliente(TEST_HOST, TEST_PORT, timeout=0.5)
+
+        cliente_a.sendall(b"/nick Ana\n")
+        respuesta = cliente_a.recv(1024).decode('utf-8')
+        assert respuesta.startswith("[servidor] Ahora eres Ana (#")
+        id_ana = respuesta.split('(#')[1].split(')')[0]
+
+        cliente_b.sendall(b"/nick ana\n")
+        assert cliente_b.recv(1024) == b"[servidor] El apodo ana ya est\xc3\xa1 en uso\n"
+        cliente_b.sendall(b"/nick beto\n")
+        assert cliente_b.recv(1024).startswith(b"[servidor] Ahora eres beto")
+
+        cliente_b.sendall("/msg ana Hola en privado\n".encode('utf-8'))
+        assert cliente_a.recv(1024) == b"[privado de beto] Hola en privado\n"
+        assert cliente_b.recv(1024) == b"[servidor] Entregado a ana\n"
+
+        cliente_b.sendall(f"/msg #{id_ana} Por id\n".encode('utf-8'))
+        assert cliente_a.recv(1024) == b"[privado de beto] Por id\n"
+        assert cliente_b.recv(1024) == f"[servidor] Entregado a #{id_ana}\n".encode('utf-8')
+
+        with pytest.raises(socket.timeout):
+            cliente_c.recv(1024)
+
+        cliente_a.close()
+        cliente_a = None
+        time.sleep(0.2)
+        cliente_b.sendall(b"/msg ana Sigues ahi?\n")
+        assert cliente_b.recv(1024) == b"[servidor] No hay nadie conectado como ana\n"
+        cliente_c.sendall(b"/nick ana\n")
+        assert cliente_c.recv(1024).startswith(b"[servidor] Ahora eres ana")
+
+    finally:
+        if cliente_a: cliente_a.close()
+        if cliente_b: cliente_b.close()
+        if cliente_c: cliente_c.close()
+
+# --- TESTS DE INTEGRACIÓN: VARIOS WORKERS (SO_REUSEPORT + BUS) ---
+
+def test_workers_reenvian_broadcast_entre_procesos(servidor_extra):
+    """
+    Con --workers 2 las conexiones se reparten entre dos procesos; aun así todos
+    los clientes deben recibir lo que dice uno, sin importar en qué worker cayó.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        pytest.skip("SO_REUSEPORT no disponible en esta plataforma")
+
+    puerto = puerto_libre()   # con --workers cada proceso abre el suyo: no se puede pedir el 0
+    servidor_extra('--workers', '2', puerto=puerto)
+
+    clientes = []
+    mensaje = "Hola desde algún worker"
+
+    try:
+        # Con varias conexiones es prácticamente seguro que caigan en ambos workers
+        for _ in range(8):
+            clientes.append(conectar_cliente(TEST_HOST, puerto, timeout=1.0))
+
+        clientes[0].sendall(mensaje.encode('utf-8'))
+
+        for receptor in clientes[1:]:
+            assert mensaje in receptor.recv(1024).decode('utf-8')
+
+    finally:
+        for cliente in clientes:
+            cliente.close()
+
+def test_workers_sellan_su_bitacora_al_detenerse(servidor_extra, tmp_path):
+    """
+    SIGTERM al proceso padre llega a cada worker, que cierra su bitácora: los
+    segmentos quedan recortados a lo escrito en lugar del tamaño preasignado.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        pytest.skip("SO_REUSEPORT no disponible en esta plataforma")
+
+    import os
+    puerto = puerto_libre()
+    servidor = servidor_extra('--workers', '2', '--bitacora', str(tmp_path), '--bitacora-segmento-mb', '1',
+                              puerto=puerto)
+
+    clientes = []
+    try:
+        for i in range(8):
+            clientes.append(conectar_cliente(TEST_HOST, puerto, timeout=1.0))
+        for i, cliente in enumerate(clientes):
+            cliente.sendall(f"Mensaje del cliente {i}\n".encode('utf-8'))
+        time.sleep(0.3)
+    finally:
+        for cliente in clientes:
+            cliente.close()
+
+    proceso = servidor.proceso
+    servidor.detener()
+    assert proceso.returncode == 0   # terminó solo, sin tener que matarlo
+
+    segmentos = [os.path.join(raiz, nombre) for raiz, _, nombres in os.walk(tmp_path)
+                 for nombre in nombres if nombre.endswith('.log')]
+    assert segmentos
+    for ruta in segmentos:
+        assert 0 < os.path.getsize(ruta) < 1024 * 1024, ruta
+
+# --- TESTS DE INTEGRACIÓN: AGRUPACIÓN DE ESCRITURAS ---
+
+def test_ventana_de_escritura_conserva_orden_y_cantidad(servidor_extra):
+    """
+    Con una ventana de agrupación activa, una ráfaga de mensajes debe llegar
+    completa y en orden aunque el servidor los junte en pocos envíos.
+    """
+    puerto = servidor_extra('--ventana-ms', '20').direccion[1]
+
+    emisor = None
+    receptor = None
+    enviados = [f"Rafaga {i}" for i in range(50)]
+
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto)
+        receptor = conectar_cliente(TEST_HOST, puerto, timeout=1.0)
+
+        for msg in enviados:
+            emisor.sendall((msg + "\n").encode('utf-8'))
+
+        datos = b''
+        while datos.count(b'\n') < len(enviados):
+            datos += receptor.recv(8192)
+
+        recibidos = [linea.split('] ', 1)[1] for linea in datos.decode('utf-8').splitlines()]
+        assert recibidos == enviados
+
+    finally:
+        if emisor: emisor.close()
+        if receptor: receptor.close()
+
+# --- TESTS DE INTEGRACIÓN: MÉTRICAS ---
+
+def test_endpoint_de_metricas_refleja_el_trafico(servidor_extra):
+    """
+    El endpoint de estadísticas debe contar las conexiones activas y los
+    mensajes que entran y salen del servidor.
+    """
+    import urllib.request
+
+    puerto_stats = puerto_libre()
+    puerto = servidor_extra('--stats-puerto', str(puerto_stats)).direccion[1]
+
+    emisor = None
+    receptor = None
+
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto)
+        receptor = conectar_cliente(TEST_HOST, puerto, timeout=1.0)
+
+        emisor.sendall("Mensaje medido".encode('utf-8'))
+        assert "Mensaje medido" in receptor.recv(1024).decode('utf-8')
+        time.sleep(0.2) # el escritor actualiza los contadores justo después de enviar
+
+        with urllib.request.urlopen(f"http://{TEST_HOST}:{puerto_stats}/metrics", timeout=2) as respuesta:
+            texto = respuesta.read().decode('utf-8')
+
+        assert "chat_conexiones_activas 2" in texto
+        assert "chat_mensajes_entrantes_total 1" in texto
+        assert "chat_mensajes_salientes_total 1" in texto
+        assert "chat_duracion_broadcast_segundos_count 1" in texto
+
+        # /colas: una línea por cliente con los contadores de su cola de salida
+        with urllib.request.urlopen(f"http://{TEST_HOST}:{puerto_stats}/colas", timeout=2) as respuesta:
+            colas = [dict(campo.split('=', 1) for campo in linea.split())
+                     for linea in respuesta.read().decode('utf-8').splitlines()]
+
+        assert len(colas) == 2
+        assert sorted(int(cola['encolados']) for cola in colas) == [0, 1]
+        assert all(cola['descartados'] == '0' for cola in colas)
+
+    finally:
+        if emisor: emisor.close()
+        if receptor: receptor.close()
+
+# --- TESTS DE INTEGRACIÓN: HISTORIAL ---
+
+def test_cliente_que_llega_durante_una_rafaga_no_pierde_mensajes(servidor_extra):
+    """
+    Un cliente que se conecta mientras otro publica recibe, entre el
+    historial y lo que llega en vivo, todos los mensajes desde el primero que
+    ve: sin huecos ni repetidos. (En binario, para que ninguna lectura parta
+    un mensaje como puede pasar con líneas sin terminar.)
+    """
+    import struct
+
+    puerto = servidor_extra('--protocolo', 'binario', '--historial', '1000',
+                            '--cola-capacidad', '100000').direccion[1]
+    total = 3000
+
+    emisor = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+    tardios = []
+
+    def publicar():
+        for i in range(total):
+            datos = str(i).encode('utf-8')
+            emisor.sendall(struct.pack('!I', len(datos)) + datos)
+
+    hilo = threading.Thread(target=publicar)
+    try:
+        hilo.start()
+        while hilo.is_alive() and len(tardios) < 20:
+            tardios.append(socket.create_connection((TEST_HOST, puerto), timeout=5))
+        hilo.join()
+
+        for tardio in tardios:
+            numeros = []
+            datos = b''
+            while not numeros or numeros[-1] != total - 1:
+                datos += tardio.recv(65536)
+                while len(datos) >= 4 and len(datos) >= 4 + struct.unpack('!I', datos[:4])[0]:
+                    (longitud,) = struct.unpack('!I', datos[:4])
+                    numeros.append(int(datos[4:4 + longitud].split(b'] ', 1)[1]))
+                    datos = datos[4 + longitud:]
+            assert numeros == list(range(numeros[0], total))
+
+    finally:
+        hilo.join()
+        emisor.close()
+        for tardio in tardios:
+            tardio.close()
+
+def test_cliente_nuevo_recibe_el_historial_reciente(servidor_extra):
+    """
+    Un cliente que se conecta tarde recibe los últimos mensajes de la sala
+    general (como mucho --historial), en orden y antes de los mensajes en vivo.
+    """
+    puerto = servidor_extra('--historial', '3').direccion[1]
+
+    emisor = None
+    tardio = None
+
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto)
+        for i in range(5):
+            emisor.sendall(f"Historico {i}\n".encode('utf-8'))
+        time.sleep(0.2)
+
+        tardio = conectar_cliente(TEST_HOST, puerto, timeout=1.0)
+        emisor.sendall("En vivo\n".encode('utf-8'))
+
+        datos = b''
+        while datos.count(b'\n') < 4:
+            datos += tardio.recv(1024)
+
+        recibidos = [linea.split('] ', 1)[1] for linea in datos.decode('utf-8').splitlines()]
+        assert recibidos == ["Historico 2", "Historico 3", "Historico 4", "En vivo"]
+
+    finally:
+        if emisor: emisor.close()
+        if tardio: tardio.close()
+
+def test_historial_sobrevive_a_un_reinicio_con_bitacora(servidor_extra, tmp_path):
+    """
+    Con --bitacora los mensajes quedan en disco: tras reiniciar el servidor,
+    un cliente nuevo recibe los últimos mensajes de antes del reinicio.
+    """
+    opciones = ('--historial', '2', '--bitacora', str(tmp_path), '--bitacora-fsync', 'siempre')
+    servidor = servidor_extra(*opciones)
+    puerto = servidor.direccion[1]
+
+    emisor = None
+    tardio = None
+
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto)
+        for i in range(3):
+            emisor.sendall(f"Antes del reinicio {i}\n".encode('utf-8'))
+        time.sleep(0.3)
+        emisor.close()
+        emisor = None
+
+        servidor.detener()
+        puerto = servidor_extra(*opciones).direccion[1]
+
+        tardio = conectar_cliente(TEST_HOST, puerto, timeout=1.0)
+        datos = b''
+        while datos.count(b'\n') < 2:
+            datos += tardio.recv(1024)
+
+        recibidos = [linea.split('] ', 1)[1] for linea in datos.decode('utf-8').splitlines()]
+        assert recibidos == ["Antes del reinicio 1", "Antes del reinicio 2"]
+
+    finally:
+        if emisor: emisor.close()
+        if tardio: tardio.close()
+
+# --- TESTS DE INTEGRACIÓN: LATIDOS E INACTIVIDAD ---
+
+def test_latidos_y_cierre_de_conexiones_calladas(servidor_extra):
+    """
+    Una conexión callada recibe '/ping'; si contesta '/pong' sigue conectada y
+    si no contesta se cierra al superar --inactividad-s.
+    """
+    puerto = servidor_extra('--ping-s', '0.5', '--inactividad-s', '1.5').direccion[1]
+
+    callado = None
+    atento = None
+
+    try:
+        callado = conectar_cliente(TEST_HOST, puerto, timeout=3.0)
+        atento = conectar_cliente(TEST_HOST, puerto, timeout=3.0)
+
+        assert b"[servidor] /ping" in callado.recv(1024)
+        for _ in range(3):
+            assert b"[servidor] /ping" in atento.recv(1024)
+            atento.sendall(b"/pong\n")
+
+        # Sin respuesta: el servidor cierra la conexión (recv vacío)
+        datos = callado.recv(1024)
+        while datos:
+            datos = callado.recv(1024)
+
+        atento.sendall(b"/ping\n")
+        assert b"[servidor] /pong" in atento.recv(1024)
+
+    finally:
+        if callado: callado.close()
+        if atento: atento.close()
+
+# --- TESTS DE INTEGRACIÓN: LÍMITES POR CLIENTE Y ADMISIÓN ---
+
+def test_limite_de_mensajes_y_tope_de_conexiones(servidor_extra):
+    """
+    Con --limite-politica descartar, un cliente que envía de más solo reparte
+    lo que le permite su cubo; con --max-conexiones, la conexión que sobra
+    recibe un aviso y se cierra.
+    """
+    puerto = servidor_extra('--historial', '0', '--max-conexiones', '2',
+                            '--limite-mensajes', '5', '--limite-politica', 'descartar').direccion[1]
+
+    emisor = None
+    receptor = None
+    sobrante = None
+
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto)
+        receptor = conectar_cliente(TEST_HOST, puerto, timeout=0.5)
+        time.sleep(0.1)
+
+        sobrante = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        datos = sobrante.recv(1024)
+        assert b"[servidor] Servidor lleno" in datos
+        while datos:
+            datos = sobrante.recv(1024)
+
+        emisor.sendall(b''.join(f"Rafaga {i}\n".encode('utf-8') for i in range(20)))
+
+        datos = b''
+        try:
+            while True:
+                recibido = receptor.recv(4096)
+                if not recibido:
+                    break
+                datos += recibido
+        except socket.timeout:
+            pass
+
+        recibidos = [linea.split('] ', 1)[1] for linea in datos.decode('utf-8').splitlines()]
+        # La ráfaga permitida es de un segundo a 5 mensajes/s
+        assert recibidos == [f"Rafaga {i}" for i in range(5)]
+
+    finally:
+        if emisor: emisor.close()
+        if receptor: receptor.close()
+        if sobrante: sobrante.close()
+
+# --- TESTS DE INTEGRACIÓN: COMPRESIÓN NEGOCIADA ---
+
+def test_compresion_negociada_convive_con_clientes_sin_compresion(servidor_extra):
+    """
+    Quien pidió /comprimir recibe los mensajes largos comprimidos (y los cortos
+    sin comprimir); un cliente que no lo pidió los sigue recibiendo en claro.
+    """
+    import struct
+    from compresion import leer_cabecera, descomprimir
+
+    puerto = servidor_extra('--protocolo', 'binario', '--historial', '0', '--compresion-umbral', '64').direccion[1]
+
+    emisor = None
+    comprime = None
+    legado = None
+
+    def trama(texto):
+        datos = texto.encode('utf-8')
+        return struct.pack('!I', len(datos)) + datos
+
+    def leer_tramas(sock, cantidad):
+        tramas = []
+        datos = b''
+        while len(tramas) < cantidad:
+            datos += sock.recv(8192)
+            while len(datos) >= 4:
+                longitud, comprimida = leer_cabecera(datos[:4])
+                if len(datos) < 4 + longitud:
+                    break
+                carga = datos[4:4 + longitud]
+                tramas.append((comprimida, descomprimir(carga) if comprimida else carga))
+                datos = datos[4 + longitud:]
+        return tramas
+
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto)
+        comprime = conectar_cliente(TEST_HOST, puerto, timeout=1.0)
+        legado = conectar_cliente(TEST_HOST, puerto, timeout=1.0)
+
+        comprime.sendall(trama("/comprimir zlib"))
+        assert leer_tramas(comprime, 1) == [(False, "[servidor] Compresión zlib activada".encode('utf-8'))]
+
+        largo = "hola a todos, " * 20
+        emisor.sendall(trama(largo) + trama("corto"))
+
+        for sock, esperada in ((comprime, True), (legado, False)):
+            (comprimida, carga), (comprimida_corto, carga_corto) = leer_tramas(sock, 2)
+            assert comprimida is esperada and not comprimida_corto
+            assert carga.decode('utf-8').split('] ', 1)[1] == largo.strip()
+            assert carga_corto.decode('utf-8').split('] ', 1)[1] == "corto"
+
+    finally:
+        if emisor: emisor.close()
+        if comprime: comprime.close()
+        if legado: legado.close()
+
+# --- TESTS DE INTEGRACIÓN: SERVIDOR EMBEBIDO ---
+
+def test_servidor_en_proceso_en_puerto_efimero():
+    """
+    ServidorChat en proceso escucha en un puerto elegido por el sistema,
+    avisa cuando está listo y al detenerse cierra el puerto y los clientes.
+    """
+    servidor = ServidorChat('--historial', '0', motor=MOTOR_ACTUAL, en_proceso=True)
+    emisor = None
+    receptor = None
+
+    try:
+        host, puerto = servidor.iniciar()
+        assert servidor.listo.is_set() and puerto != 0
+
+        emisor = conectar_cliente(host, puerto)
+        receptor = conectar_cliente(host, puerto, timeout=1.0)
+        emisor.sendall(b"Embebido\n")
+        assert receptor.recv(1024).endswith(b"] Embebido\n")
+
+        servidor.detener()
+        assert not servidor.listo.is_set()
+        assert receptor.recv(1024) == b""
+        with pytest.raises(OSError):
+            socket.create_connection((host, puerto), timeout=1.0)
+
+    finally:
+        servidor.detener()
+        if emisor: emisor.close()
+        if receptor: receptor.close()
+
+def test_servidor_en_proceso_se_reinicia_con_estadisticas():
+    """
+    Al detenerse, el servidor en proceso también cierra el de --stats-puerto:
+    arrancarlo de nuevo en el mismo puerto de métricas no falla.
+    """
+    import urllib.request
+
+    puerto_stats = puerto_libre()
+    for _ in range(2):
+        with ServidorChat('--historial', '0', '--stats-puerto', str(puerto_stats),
+                          motor=MOTOR_ACTUAL, en_proceso=True):
+            with urllib.request.urlopen(f"http://{TEST_HOST}:{puerto_stats}/metrics", timeout=5) as respuesta:
+                assert "chat_conexiones_activas" in respuesta.read().decode('utf-8')
+
+        with pytest.raises(OSError):
+            urllib.request.urlopen(f"http://{TEST_HOST}:{puerto_stats}/metrics", timeout=1)
+
+# --- TESTS DE INTEGRACIÓN: BIBLIOTECA CLIENTE ---
+
+def test_cliente_chat_reensambla_y_reconecta_a_su_sala(servidor_extra):
+    """
+    ClienteChat entrega cada mensaje de una ráfaga por separado y, si el
+    servidor se reinicia, reconecta solo y vuelve a la sala en la que estaba.
+    """
+    import asyncio
+    from cliente_chat import ClienteChat
+
+    opciones = ('--historial', '0')
+    servidor = servidor_extra(*opciones)
+    puerto = servidor.direccion[1]
+
+    confirmacion_sala = "Te uniste a la sala pruebas".encode('utf-8')
+
+    async def escenario():
+        emisor = await ClienteChat(TEST_HOST, puerto, espera_inicial=0.05).iniciar(timeout=5)
+        receptor = await ClienteChat(TEST_HOST, puerto, espera_inicial=0.05).iniciar(timeout=5)
+        try:
+            for cliente in (emisor, receptor):
+                cliente.enviar("/join pruebas")
+                assert (await cliente.recibir()).endswith(confirmacion_sala)
+
+            for i in range(100):
+                emisor.enviar(f"Rafaga {i}")
+            recibidos = [(await receptor.recibir()).split(b'] ', 1)[1] for _ in range(100)]
+            assert recibidos == [f"Rafaga {i}".encode('utf-8') for i in range(100)]
+
+            await asyncio.to_thread(servidor.detener)
+            # En el mismo puerto: el cliente reconecta a la dirección que ya conoce
+            await asyncio.to_thread(lambda: servidor_extra(*opciones, puerto=puerto))
+
+            # Al reconectar cada cliente repite su /join: llega la confirmación
+            for cliente in (emisor, receptor):
+                assert (await asyncio.wait_for(cliente.recibir(), 5)).endswith(confirmacion_sala)
+                assert cliente.reconexiones == 1
+
+            emisor.enviar("Tras el reinicio")
+            assert (await asyncio.wait_for(receptor.recibir(), 2)).endswith(b"] Tras el reinicio")
+        finally:
+            await emisor.cerrar()
+            await receptor.cerrar()
+
+    asyncio.run(escenario())
+
+def test_cliente_chat_no_repite_su_estado_en_la_primera_conexion(servidor_extra):
+    """Lo enviado antes de conectar sale una sola vez: /join y /nick no se duplican."""
+    import asyncio
+    from cliente_chat import ClienteChat
+
+    servidor = servidor_extra('--historial', '0')
+
+    async def escenario():
+        cliente = ClienteChat(TEST_HOST, servidor.direccion[1])
+        cliente.enviar("/join pruebas")
+        cliente.enviar("/nick ana")
+        await cliente.iniciar(timeout=5)
+        try:
+            assert (await cliente.recibir()).endswith("Te uniste a la sala pruebas".encode('utf-8'))
+            assert (await cliente.recibir()).endswith(b"Ahora eres ana (#1)")
+            cliente.enviar("/ping")
+            assert (await asyncio.wait_for(cliente.recibir(), 2)).endswith(b"/pong")
+        finally:
+            await cliente.cerrar()
+
+    asyncio.run(escenario())
+
+def test_cliente_chat_reconecta_tras_una_trama_invalida():
+    """Una línea mayor que el límite del lector es un error de entramado: se reconecta."""
+    import asyncio
+    from cliente_chat import ClienteChat
+
+    async def escenario():
+        conexiones = []
+
+        async def atender(reader, writer):
+            conexiones.append(writer)
+            if len(conexiones) == 1:
+                writer.write(b"x" * (256 * 1024))   # sin salto de línea
+            else:
+                writer.write(b"hola\n")
+            await writer.drain()
+
+        servidor = await asyncio.start_server(atender, TEST_HOST, 0)
+        cliente = ClienteChat(TEST_HOST, servidor.sockets[0].getsockname()[1], espera_inicial=0.05)
+        await cliente.iniciar(timeout=5)
+        try:
+            assert await asyncio.wait_for(cliente.recibir(), 5) == b"hola"
+            assert cliente.reconexiones == 1
+        finally:
+            await cliente.cerrar()
+            for writer in conexiones:
+                writer.close()
+            servidor.close()
+            await servidor.wait_closed()
+
+    asyncio.run(escenario())
+
+# --- TESTS DE INTEGRACIÓN: REINICIO SIN CORTES ---
+
+def test_traspaso_sin_cortes_conserva_conexiones_y_sala(servidor_extra, tmp_path):
+    """
+    Un servidor nuevo lanzado con el mismo --traspaso hereda el socket de
+    escucha y las conexiones del anterior, que termina solo. Los clientes
+    siguen en su sala sin reconectar, y un mensaje que quedó a medio enviar
+    (cortado dentro de un carácter UTF-8) se completa en el servidor nuevo.
+    """
+    opciones = ('--historial', '0', '--traspaso', str(tmp_path / 'traspaso.sock'))
+    viejo = servidor_extra(*opciones)
+    puerto = viejo.direccion[1]
+
+    emisor, receptor, otro = None, None, None
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        receptor = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        for cliente in (emisor, receptor):
+            cliente.sendall(b"/join pruebas\n")
+            assert cliente.recv(1024).endswith(b"Te uniste a la sala pruebas\n")
+
+        mensaje = "Traspaso sin cortes: ñandú\n".encode('utf-8')
+        emisor.sendall(mensaje[:-2])   # corta la 'ú' por la mitad
+        time.sleep(0.2)
+
+        nuevo = servidor_extra(*opciones)   # hereda el socket: termina en el mismo puerto
+        assert nuevo.direccion == viejo.direccion
+        assert viejo.proceso.wait(5) == 0   # el anterior entregó todo y terminó
+
+        emisor.sendall(mensaje[-2:])
+        assert receptor.recv(1024).endswith(b"] " + mensaje)
+
+        # Las conexiones nuevas las atiende el servidor nuevo, en la sala general
+        otro = conectar_cliente(TEST_HOST, puerto, timeout=0.3)
+        emisor.sendall(b"Solo para la sala\n")
+        assert receptor.recv(1024).endswith(b"] Solo para la sala\n")
+        with pytest.raises(socket.timeout):
+            otro.recv(1024)
+
+    finally:
+        for cliente in (emisor, receptor, otro):
+            if cliente: cliente.close()
+
+def test_traspaso_no_espera_a_un_cliente_que_no_lee(servidor_extra, tmp_path):
+    """
+    Un cliente que nunca lee deja al servidor bloqueado escribiéndole. El
+    traspaso no lo espera más que --traspaso-plazo-s: esa conexión se cierra
+    y las demás pasan al servidor nuevo.
+    """
+    opciones = ('--historial', '0', '--traspaso', str(tmp_path / 'traspaso.sock'), '--traspaso-plazo-s', '0.5')
+    viejo = servidor_extra(*opciones)
+    puerto = viejo.direccion[1]
+
+    lento, emisor, receptor = None, None, None
+    try:
+        lento = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        lento.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        lento.connect((TEST_HOST, puerto))
+        emisor = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        receptor = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        for cliente in (emisor, receptor):
+            cliente.sendall(b"/join pruebas\n")
+            assert cliente.recv(1024).endswith(b"Te uniste a la sala pruebas\n")
+
+        # El lento sigue en la sala general: lo llena un segundo emisor hasta que
+        # el servidor queda bloqueado escribiéndole
+        relleno = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        linea = b"x" * 1000 + b"\n"
+        relleno.sendall(linea * 8000)
+        relleno.close()
+        time.sleep(0.5)
+
+        inicio = time.monotonic()
+        servidor_extra(*opciones)
+        assert viejo.proceso.wait(5) == 0
+        assert time.monotonic() - inicio < 4   # sin plazo quedaría colgado
+
+        emisor.sendall(b"Tras el traspaso\n")
+        assert receptor.recv(1024).endswith(b"] Tras el traspaso\n")
+
+        # Al lento se le cerró la conexión: tras lo que quedó en su buffer, EOF
+        lento.settimeout(2.0)
+        while lento.recv(65536):
+            pass
+
+    finally:
+        for cliente in (lento, emisor, receptor):
+            if cliente: cliente.close()
+
+def test_traspaso_con_estadisticas_pasa_el_puerto_de_metricas(servidor_extra, tmp_path):
+    """
+    Con --stats-puerto el servidor anterior libera el puerto de métricas al
+    soltar el traspaso y el nuevo lo toma recién entonces: el traspaso no
+    falla por el puerto ocupado y /metrics lo sirve el nuevo.
+    """
+    import urllib.request
+
+    puerto_stats = puerto_libre()
+    opciones = ('--historial', '0', '--traspaso', str(tmp_path / 'traspaso.sock'),
+                '--stats-puerto', str(puerto_stats))
+    viejo = servidor_extra(*opciones)
+    puerto = viejo.direccion[1]
+
+    cliente = None
+    try:
+        cliente = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        cliente.sendall(b"/join pruebas\n")
+        assert cliente.recv(1024).endswith(b"Te uniste a la sala pruebas\n")
+
+        nuevo = servidor_extra(*opciones)
+        assert nuevo.direccion == viejo.direccion
+        assert viejo.proceso.wait(5) == 0
+
+        with urllib.request.urlopen(f"http://{TEST_HOST}:{puerto_stats}/metrics", timeout=2) as respuesta:
+            assert "chat_conexiones_activas 1" in respuesta.read().decode('utf-8')
+
+        cliente.sendall(b"/ping\n")
+        assert cliente.recv(1024).endswith(b"/pong\n")
+    finally:
+        if cliente: cliente.close()
+
+def test_traspaso_fallido_deja_al_servidor_anterior_atendiendo(servidor_extra, tmp_path):
+    """
+    Si el servidor nuevo no confirma el traspaso (murió al arrancar), el
+    anterior recupera el socket de escucha y sus conexiones y sigue.
+    """
+    import traspaso
+
+    ruta = str(tmp_path / 'traspaso.sock')
+    viejo = servidor_extra('--historial', '0', '--traspaso', ruta)
+    puerto = viejo.direccion[1]
+
+    emisor, receptor, otro = None, None, None
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        receptor = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        for cliente in (emisor, receptor):
+            cliente.sendall(b"/join pruebas\n")
+            assert cliente.recv(1024).endswith(b"Te uniste a la sala pruebas\n")
+
+        herencia = traspaso.pedir(ruta, timeout=5)
+        herencia.socket_escucha.close()
+        for _, sock in herencia.conexiones:
+            sock.close()   # sin shutdown: las conexiones siguen en el servidor anterior
+        herencia.canal.close()   # sin confirmar
+        time.sleep(0.5)
+        assert viejo.proceso.poll() is None
+
+        emisor.sendall(b"Sigue el anterior\n")
+        assert receptor.recv(1024).endswith(b"] Sigue el anterior\n")
+
+        otro = conectar_cliente(TEST_HOST, puerto, timeout=2.0)
+        otro.sendall(b"/join pruebas\n")
+        assert otro.recv(1024).endswith(b"Te uniste a la sala pruebas\n")
+        otro.sendall(b"Recien llegado\n")
+        assert receptor.recv(1024).endswith(b"] Recien llegado\n")
+
+        # Y un traspaso posterior funciona
+        servidor_extra('--historial', '0', '--traspaso', ruta)
+        assert viejo.proceso.wait(5) == 0
+        emisor.sendall(b"Ya en el nuevo\n")
+        assert receptor.recv(1024).endswith(b"] Ya en el nuevo\n")
+
+    finally:
+        for cliente in (emisor, receptor, otro):
+            if cliente: cliente.close()
+
+# --- TESTS DE INTEGRACIÓN: PERFILADO BAJO DEMANDA ---
+
+def test_perfilado_por_http_y_por_senal(servidor_extra, tmp_path):
+    """
+    Con --perfil-secciones los tiempos por sección aparecen en /metrics. Un
+    muestreo de pilas se puede pedir por HTTP (la respuesta son pilas
+    colapsadas) o con SIGUSR1, que lo guarda en --perfil-dir.
+    """
+    import signal
+    import urllib.request
+
+    puerto_stats = puerto_libre()
+    servidor = servidor_extra('--stats-puerto', str(puerto_stats), '--perfil-secciones',
+                              '--perfil-segundos', '0.3', '--perfil-dir', str(tmp_path))
+    puerto = servidor.direccion[1]
+
+    def consultar(ruta):
+        with urllib.request.urlopen(f"http://{TEST_HOST}:{puerto_stats}{ruta}", timeout=5) as respuesta:
+            return respuesta.read().decode('utf-8')
+
+    emisor, receptor = None, None
+    try:
+        emisor = conectar_cliente(TEST_HOST, puerto)
+        receptor = conectar_cliente(TEST_HOST, puerto, timeout=1.0)
+        emisor.sendall(b"Mensaje perfilado\n")
+        assert receptor.recv(1024).endswith(b"] Mensaje perfilado\n")
+
+        metricas = consultar("/metrics")
+        for seccion in ('accept', 'recv', 'validacion', 'broadcast'):
+            assert f"chat_seccion_{seccion}_segundos_count" in metricas
+        assert "chat_seccion_broadcast_segundos_count 1" in metricas
+
+        pilas = consultar("/perfil/pilas?segundos=0.2").splitlines()
+        assert pilas and all(linea.rsplit(' ', 1)[1].isdigit() for linea in pilas)
+        assert any("serve_forever" in linea or "servir" in linea for linea in pilas)
+
+        servidor.proceso.send_signal(signal.SIGUSR1)
+        for _ in range(50):
+            archivos = list(tmp_path.glob("pilas-*.txt"))
+            if archivos and archivos[0].stat().st_size > 0:
+                break
+            time.sleep(0.1)
+        assert archivos and archivos[0].read_text(encoding='utf-8').strip()
+
+    finally:
+        if emisor: emisor.close()
+        if receptor: receptor.close()
@@ -1,5 +1,7 @@
 import pytest
-from utils import validar_mensaje
+from utils import validar_mensaje, ValidadorMensaje, validar_bytes, validar_lote
+
+# --- VALIDACIÓN DE MENSAJES ---
 
 def test_validar_mensaje_vacio_falla():
     """Caso Negativo: Verifica que un mensaje vacío (solo espacios o None) sea rechazado."""
@@ -23,3 +25,590 @@ def test_validar_mensaje_demasiado_largo_falla():
     mensaje_largo = "A" * 1025
     
     assert validar_mensaje(mensaje_largo) is False
+
+def test_validador_acepta_caracter_partido_entre_trozos():
+    """Un carácter multibyte partido entre dos trozos es válido; uno truncado o mal formado no."""
+    validador = ValidadorMensaje()
+    datos = "¡Hola ñandú!".encode('utf-8')
+    assert validador.alimentar(memoryview(datos)[:1]) is True   # primer byte de '¡'
+    assert validador.alimentar(memoryview(datos)[1:]) is True
+    assert validador.terminar() is True
+
+    assert validar_bytes("ñ".encode('utf-8')[:1]) is False
+    assert validar_bytes(b"\xff\xfe") is False
+
+def test_validar_lote_aplica_vacio_y_limite_a_cada_trama():
+    """Cada trama se valida por separado: vacía, demasiado larga, no UTF-8 o correcta."""
+    tramas = [b"hola", b"   ", b"A" * 1025, b"ok \xc3\xb1", b"\xc3"]
+    assert validar_lote(tramas) == [True, False, False, True, False]
+
+def test_validacion_trata_los_blancos_unicode_como_vacios():
+    """Como str.strip(): espacios no ASCII y los separadores \\x1c-\\x1f no cuentan como contenido."""
+    for blanco in ("\xa0", "\u3000", "\u2003\n", "\x1c", " \x1f\t", "\u2028\x85"):
+        assert validar_mensaje(blanco) is False, repr(blanco)
+    assert validar_mensaje("\u3000hola\u3000") is True
+    assert validar_mensaje("\x00") is True   # no es blanco para str.strip()
+
+    # El blanco no ASCII partido entre trozos sigue siendo blanco
+    ideografico = "\u3000".encode('utf-8')
+    validador = ValidadorMensaje()
+    validador.alimentar(b"  " + ideografico[:1])
+    validador.alimentar(ideografico[1:])
+    assert validador.terminar() is False
+
+    assert validar_lote([b"\xc2\xa0", b"\xc2\xa0x", b"\xe3\x80\x80\xc3\xb1"]) == [False, True, True]
+
+def test_lector_lineas_espera_un_caracter_partido_al_final():
+    """Sin salto, un final con un carácter UTF-8 a medias no se entrega hasta completarlo."""
+    lector = LectorTramas(LINEAS, tamano_buffer=64)
+    datos = "año".encode('utf-8')
+
+    lector.alimentar(datos[:2])
+    assert lector.tramas() == []
+
+    lector.alimentar(datos[2:])
+    assert [bytes(t) for t in lector.tramas()] == [datos]
+
+# --- COLAS DE SALIDA POR CLIENTE ---
+
+from colas import ColaSalida, DESCARTAR_ANTIGUO, DESCARTAR_NUEVO, DESCONECTAR
+
+def test_cola_descartar_antiguo_conserva_los_ultimos():
+    """Con la cola llena se descarta el mensaje más viejo y se cuenta la pérdida."""
+    cola = ColaSalida(capacidad=2, politica=DESCARTAR_ANTIGUO)
+
+    for mensaje in (b"1", b"2", b"3"):
+        assert cola.encolar(mensaje) is True
+
+    assert cola.extraer(timeout=0) == [b"2", b"3"]
+    assert cola.descartados == 1
+    assert cola.profundidad_maxima == 2
+
+def test_cola_descartar_nuevo_conserva_los_primeros():
+    """Con la cola llena se descarta el mensaje entrante."""
+    cola = ColaSalida(capacidad=2, politica=DESCARTAR_NUEVO)
+
+    for mensaje in (b"1", b"2", b"3"):
+        assert cola.encolar(mensaje) is True
+
+    assert cola.extraer(timeout=0) == [b"1", b"2"]
+    assert cola.descartados == 1
+
+def test_cola_desconectar_pide_desconexion_y_cerrada_devuelve_none():
+    """La política 'desconectar' avisa al llamador; una cola cerrada ya no entrega nada."""
+    cola = ColaSalida(capacidad=1, politica=DESCONECTAR)
+
+    assert cola.encolar(b"1") is True
+    assert cola.encolar(b"2") is False
+
+    cola.cerrar()
+    assert cola.extraer(timeout=0) is None
+    assert cola.encolar(b"3") is False
+
+# --- ENTRAMADO (LectorTramas) ---
+
+import struct
+from protocolo import LectorTramas, ErrorProtocolo, BINARIO, LINEAS
+
+def test_lector_binario_separa_tramas_y_espera_las_incompletas():
+    """Varias tramas en un mismo bloque salen juntas; una trama a medias espera al siguiente bloque."""
+    lector = LectorTramas(BINARIO, tamano_buffer=64)
+
+    lector.alimentar(struct.pack('!I', 3) + b"uno" + struct.pack('!I', 3) + b"do")
+    assert [bytes(t) for t in lector.tramas()] == [b"uno"]
+
+    lector.alimentar(b"s")
+    assert [bytes(t) for t in lector.tramas()] == [b"dos"]
+    assert lector.pendientes == 0
+
+def test_lector_lineas_separa_por_salto_y_acepta_mensaje_sin_salto():
+    """Modo compatibilidad: se corta en '\\n' y el resto de la lectura cuenta como un mensaje."""
+    lector = LectorTramas(LINEAS)
+
+    lector.alimentar(b"hola\nmundo\nsin salto")
+    assert [bytes(t) for t in lector.tramas()] == [b"hola", b"mundo", b"sin salto"]
+
+def test_lector_crece_para_una_trama_grande_y_vuelve_al_tamano_inicial():
+    """El buffer empieza chico, crece hasta el máximo solo si una trama lo necesita y después se achica."""
+    lector = LectorTramas(BINARIO, tamano_buffer=64 * 1024, tamano_inicial=4 * 1024)
+    assert lector.capacidad == 4 * 1024
+
+    grande = b"x" * 20000
+    datos = struct.pack('!I', len(grande)) + grande
+    lector.alimentar(datos[:1000])
+    assert lector.tramas() == []
+    assert lector.capacidad >= len(datos)
+    lector.alimentar(datos[1000:])
+    assert [bytes(t) for t in lector.tramas()] == [grande]
+
+    lector.alimentar(struct.pack('!I', 4) + b"chau")
+    assert lector.capacidad == 4 * 1024
+    assert [bytes(t) for t in lector.tramas()] == [b"chau"]
+
+    with pytest.raises(ErrorProtocolo):
+        lector.alimentar(struct.pack('!I', 64 * 1024) + b"y")
+        lector.tramas()
+
+def test_lector_lineas_crece_con_una_linea_larga():
+    """Una línea más larga que el buffer inicial se reensambla; más larga que el máximo es error."""
+    lector = LectorTramas(LINEAS, tamano_buffer=16 * 1024, tamano_inicial=1024)
+
+    linea = b"x" * 6000
+    lector.alimentar(linea[:3000])
+    lector.alimentar(linea[3000:] + b"\n")   # sin tramas() entre medio: los bloques se acumulan
+    assert [bytes(t) for t in lector.tramas()] == [linea]
+    assert lector.capacidad > 1024
+
+    with pytest.raises(ErrorProtocolo):
+        lector.alimentar(b"z" * (16 * 1024 + 1))
+
+# --- SALAS ---
+
+from salas import IndiceSalas, SALA_GENERAL
+
+def test_indice_salas_mueve_miembros_y_reemplaza_instantaneas():
+    """Unirse a otra sala saca al miembro de la anterior; las instantáneas viejas no cambian."""
+    indice = IndiceSalas()
+    indice.unir("a", "miembro_a", SALA_GENERAL)
+    indice.unir("b", "miembro_b", SALA_GENERAL)
+
+    instantanea = indice.miembros(SALA_GENERAL)
+    assert indice.unir("a", "miembro_a", "proyecto") == SALA_GENERAL
+
+    assert instantanea == ("miembro_a", "miembro_b")   # la instantánea no cambia
+    assert indice.miembros(SALA_GENERAL) == ("miembro_b",)
+    assert indice.miembros("proyecto") == ("miembro_a",)
+
+    indice.salir("a")
+    assert indice.miembros("proyecto") == ()
+    assert indice.sala_de("a") is None
+
+def test_indice_salas_arma_la_instantanea_una_vez_por_cambio():
+    """Sin cambios en la sala, cada lectura devuelve la misma tupla; un alta la invalida."""
+    indice = IndiceSalas()
+    for numero in range(1000):
+        indice.unir(numero, f"miembro_{numero}", SALA_GENERAL)
+
+    primera = indice.miembros(SALA_GENERAL)
+    assert len(primera) == 1000
+    assert indice.miembros(SALA_GENERAL) is primera
+
+    indice.salir(500)
+    segunda = indice.miembros(SALA_GENERAL)
+    assert len(segunda) == 999 and "miembro_500" not in segunda
+    assert indice.ocupacion() == {SALA_GENERAL: 999}
+
+# --- BUS ENTRE WORKERS ---
+
+import threading
+from bus import BusDifusion, crear_malla
+
+def test_bus_entrega_a_los_otros_workers():
+    """Lo que publica un worker llega a todos los demás con sala, prefijo y cuerpo intactos."""
+    malla = crear_malla(3)
+    buses = [BusDifusion(extremos) for extremos in malla]
+    recibidos = {0: [], 1: [], 2: []}
+    listos = threading.Event()
+
+    def receptor(id_worker):
+        def al_recibir(sala, prefijo, cuerpo):
+            recibidos[id_worker].append((sala, prefijo, cuerpo))
+            if recibidos[1] and recibidos[2]:
+                listos.set()
+        return al_recibir
+
+    buses[0].iniciar(receptor(0))
+    buses[1].iniciar(receptor(1))
+    buses[2].iniciar(receptor(2))
+    try:
+        buses[0].publicar("proyecto", b"[1.2.3.4:5] ", b"hola")
+        assert listos.wait(2.0)
+        assert recibidos[1] == recibidos[2] == [("proyecto", b"[1.2.3.4:5] ", b"hola")]
+        assert recibidos[0] == []
+    finally:
+        for bus in buses:
+            bus.cerrar()
+
+# --- ENVÍO AGRUPADO ---
+
+from protocolo import enviar_lote
+
+class SocketParcial:
+    """Socket falso que acepta como mucho `limite` bytes por llamada a sendmsg()."""
+
+    def __init__(self, limite):
+        self.limite = limite
+        self.recibido = b''
+        self.llamadas = 0
+
+    def sendmsg(self, buffers):
+        self.llamadas += 1
+        datos = b''.join(bytes(b) for b in buffers)[:self.limite]
+        self.recibido += datos
+        return len(datos)
+
+def test_enviar_lote_junta_mensajes_y_completa_envios_parciales():
+    """Varios mensajes salen en orden y sin perder bytes aunque el kernel acepte solo una parte."""
+    sock = SocketParcial(limite=5)
+
+    enviar_lote(sock, [(b"[a] ", b"uno", b"\n"), (b"[a] ", b"dos", b"\n")])
+
+    assert sock.recibido == b"[a] uno\n[a] dos\n"
+    assert sock.llamadas == 4
+
+    sock = SocketParcial(limite=1024)
+    enviar_lote(sock, [(b"[a] ", b"uno", b"\n"), (b"[a] ", b"dos", b"\n")])
+    assert sock.llamadas == 1
+
+# --- MÉTRICAS ---
+
+from metricas import RegistroMetricas
+
+def test_metricas_se_exponen_en_formato_texto():
+    """Contadores y histogramas aparecen en el texto con sus valores acumulados."""
+    registro = RegistroMetricas()
+    mensajes = registro.contador('mensajes', "Mensajes de prueba")
+    duracion = registro.histograma('duracion_segundos', "Duración de prueba", limites=(0.1, 1))
+
+    mensajes.incrementar()
+    mensajes.incrementar(2)
+    duracion.observar(0.05)
+    duracion.observar(0.5)
+    duracion.observar(5)
+
+    texto = registro.texto()
+    assert "# TYPE chat_mensajes_total counter" in texto
+    assert "chat_mensajes_total 3" in texto
+    assert 'chat_duracion_segundos_bucket{le="0.1"} 1' in texto
+    assert 'chat_duracion_segundos_bucket{le="1"} 2' in texto
+    assert 'chat_duracion_segundos_bucket{le="+Inf"} 3' in texto
+    assert "chat_duracion_segundos_count 3" in texto
+
+import io
+import logging
+import queue
+import registro as modulo_registro
+from registro import ManejadorCola, LimitadorRepetidos
+
+def test_registro_limita_repetidos_y_no_bloquea_con_la_cola_llena():
+    """Las advertencias repetidas se cortan y una cola llena descarta en lugar de bloquear."""
+    limitador = LimitadorRepetidos(maximo=2, intervalo=60)
+    registro = logging.LogRecord('chat', logging.WARNING, __file__, 1, "x", None, None)
+    registro.evento = 'envio_fallido'
+    assert [limitador.filter(registro) for _ in range(4)] == [True, True, False, False]
+
+    manejador = ManejadorCola(queue.Queue(1))
+    manejador.handle(registro)
+    manejador.handle(registro)   # no bloquea
+    assert manejador.descartados == 1
+
+    salida = io.StringIO()
+    modulo_registro.configurar_registro('INFO', destino=salida)
+    modulo_registro.info('conexion', "Se ha conectado el cliente", peer=('127.0.0.1', 5000))
+    modulo_registro.depurar('broadcast', "no se escribe")
+    modulo_registro.detener_registro()
+    texto = salida.getvalue()
+    assert "evento=conexion peer=127.0.0.1:5000 Se ha conectado el cliente" in texto
+    assert "broadcast" not in texto
+
+def test_registro_avisa_cuantos_registros_perdio_la_cola_llena():
+    """Los registros perdidos se cuentan con `al_descartar` y, al haber lugar, se avisa cuántos fueron."""
+    perdidos = []
+    cola = queue.Queue(1)
+    manejador = ManejadorCola(cola, al_descartar=lambda: perdidos.append(1))
+    registro = logging.LogRecord('chat', logging.INFO, __file__, 1, "x", None, None)
+    for _ in range(4):
+        manejador.handle(registro)
+    assert manejador.descartados == 3 and len(perdidos) == 3
+
+    cola.get_nowait()   # el listener vació la cola
+    manejador.handle(registro)
+    aviso = cola.get_nowait()
+    assert aviso.evento == 'registro_lleno' and aviso.campos == {'omitidos': 3}
+    assert manejador.descartados == 4   # el registro que disparó el aviso ya no entró
+
+from historial import HistorialMensajes
+
+def test_historial_descarta_lo_viejo_por_cantidad_y_por_bytes():
+    """El historial conserva solo lo que entra en sus límites y separa por sala."""
+    historial = HistorialMensajes(capacidad_mensajes=3, capacidad_bytes=16)
+
+    for i in range(4):
+        historial.agregar('general', (b"m", str(i).encode(), b"\n"))
+    historial.agregar('otra', (b"x\n",))
+    assert historial.recientes('general') == [b"m2\n", b"m3\n"]   # 3 entradas como mucho
+    assert historial.recientes('otra') == [b"x\n"]
+
+    # 10 bytes más no entran al final del buffer: se vuelve al principio y se pisa lo viejo
+    historial.agregar('general', (b"0123456789",))
+    assert historial.recientes('general') == [b"0123456789"]
+    assert historial.recientes('general', limite=0) == []
+    assert historial.recientes('sin_mensajes') == []
+
+import os
+from bitacora import BitacoraMensajes, NUNCA, SIEMPRE
+
+def test_bitacora_reproduce_desde_secuencia_y_tiempo_y_se_recupera(tmp_path):
+    """El log rota segmentos, busca por secuencia o tiempo y se reabre sin perder entradas."""
+    bitacora = BitacoraMensajes(str(tmp_path), tamano_segmento=512, politica_fsync=SIEMPRE)
+    bitacora.iniciar()
+    for i in range(40):
+        bitacora.agregar('general', b"[p] ", b"mensaje %d" % i)
+    bitacora.cerrar()
+
+    bitacora = BitacoraMensajes(str(tmp_path), tamano_segmento=512)
+    assert bitacora.ultima_secuencia == 40
+    assert [e[4] for e in bitacora.leer_desde(38)] == [b"mensaje 37", b"mensaje 38", b"mensaje 39"]
+
+    todas = bitacora.leer_desde(1)
+    assert [e[0] for e in todas] == list(range(1, 41))
+    assert [e[0] for e in bitacora.leer_desde_tiempo(todas[20][1], limite=2)] == [21, 22]
+    assert [(e[2], e[3]) for e in bitacora.ultimos(1)] == [('general', b"[p] ")]
+    bitacora.cerrar()
+
+def test_bitacora_cuenta_y_avisa_las_entradas_descartadas(tmp_path):
+    """Con la cola del escritor llena la entrada se pierde, pero no en silencio."""
+    avisos = []
+    bitacora = BitacoraMensajes(str(tmp_path), capacidad_cola=2, al_descartar=lambda: avisos.append(1))
+    for i in range(5):   # sin iniciar(): nadie vacía la cola
+        bitacora.agregar('general', b"[p] ", b"mensaje %d" % i)
+    assert bitacora.descartados == 3
+    assert len(avisos) == 3
+    bitacora.cerrar()
+
+def test_bitacora_lee_mientras_escribe_y_compacta_sin_esperar_a_rotar(tmp_path):
+    """Las lecturas ven un prefijo consecutivo del log; la retención se aplica sin rotar el segmento."""
+    bitacora = BitacoraMensajes(str(tmp_path), tamano_segmento=1024, politica_fsync=NUNCA)
+    bitacora.iniciar()
+    for i in range(50):
+        bitacora.agregar('general', b"[p] ", b"viejo %d" % i)
+    bitacora.cerrar()
+    viejos = sorted(os.listdir(tmp_path))
+    assert len([nombre for nombre in viejos if nombre.endswith('.log')]) > 1
+
+    # Segmento grande: durante la prueba no rota, así que solo compacta por el umbral de bytes
+    bitacora = BitacoraMensajes(str(tmp_path), tamano_segmento=8 * 1024 * 1024, politica_fsync=NUNCA,
+                                retencion_bytes=4096)
+    bitacora.iniciar()
+    cuerpo = b"x" * 4000
+    for i in range(400):
+        bitacora.agregar('general', b"[p] ", cuerpo)
+        if i % 50 == 0:
+            secuencias = [e[0] for e in bitacora.leer_desde(1)]
+            assert secuencias == list(range(secuencias[0], secuencias[0] + len(secuencias)))
+    bitacora.cerrar()
+
+    restantes = [nombre for nombre in os.listdir(tmp_path) if nombre.endswith('.log')]
+    assert len(restantes) == 1 and restantes[0] not in viejos
+
+from temporizador import RuedaTemporizadores
+
+def test_rueda_de_temporizadores_vence_reprograma_y_cancela():
+    """Solo vencen los plazos cumplidos; reprogramar mueve el plazo y cancelar lo quita."""
+    rueda = RuedaTemporizadores(ahora=0, resolucion=1.0, ranuras=4)
+    rueda.programar('a', 2.5)
+    rueda.programar('b', 3.0)
+    rueda.programar('c', 9.0)   # más de una vuelta de la rueda
+    rueda.programar('d', 1.0)
+    rueda.cancelar('d')
+
+    assert rueda.avanzar(2.0) == []
+    assert sorted(rueda.avanzar(3.0)) == ['a', 'b']
+
+    rueda.programar('b', 5.0)
+    assert rueda.avanzar(6.0) == ['b']
+    assert rueda.avanzar(9.0) == ['c']
+    assert len(rueda) == 0
+
+from conexiones import TablaConexiones
+
+def test_tabla_de_conexiones_alta_baja_e_instantanea():
+    """Las bajas repetidas no tienen efecto y la instantánea solo cambia cuando cambia la tabla."""
+    tabla = TablaConexiones()
+    a = tabla.agregar(object(), ('127.0.0.1', 5000), b"[127.0.0.1:5000] ", None, 'general')
+    b = tabla.agregar(object(), ('127.0.0.1', 5001), b"[127.0.0.1:5001] ", None, 'general')
+
+    assert a.id != b.id and a.etiqueta == "127.0.0.1:5000"
+    instantanea = tabla.instantanea()
+    assert instantanea == (a, b) and tabla.instantanea() is instantanea
+
+    assert tabla.quitar(a) == 1
+    assert tabla.quitar(a) is None
+    assert a.activa is False and a not in tabla
+    assert tabla.instantanea() == (b,)
+    assert tabla.obtener(b.id) is b
+
+from limites import CuboTokens, LimitadorCliente
+
+def test_cubo_de_tokens_recarga_admite_y_adeuda():
+    """El cubo admite hasta su capacidad, se recarga con el tiempo y adeuda la espera por lo que falta."""
+    cubo = CuboTokens(10, capacidad=5, ahora=0.0)
+    assert all(cubo.consumir(1, 0.0) for _ in range(5))
+    assert not cubo.consumir(1, 0.0)
+    assert cubo.consumir(1, 0.1)          # 0.1 s a 10/s recarga un token
+    assert cubo.adeudar(4, 0.1) == pytest.approx(0.4)
+
+    # El límite de bytes rechaza sin descontar el de mensajes
+    limitador = LimitadorCliente(mensajes_por_s=2, bytes_por_s=100, ahora=0.0)
+    assert not limitador.admitir(150, 0.0)
+    assert limitador.admitir(50, 0.0) and limitador.admitir(50, 0.0)
+    assert not limitador.admitir(1, 0.0)
+    assert limitador.adeudar(1, 0, 0.5) == pytest.approx(0.0)
+
+from compresion import comprimir_mensaje, leer_cabecera, descomprimir
+from protocolo import empaquetar, BINARIO
+
+def test_comprimir_mensaje_respeta_umbral_y_se_puede_descomprimir():
+    corto = empaquetar(b"[1.2.3.4:5] ", b"hola", BINARIO)
+    assert comprimir_mensaje(corto, umbral=64) is corto
+
+    largo = empaquetar(b"[1.2.3.4:5] ", "¿alguien sabe dónde está la sala? ".encode('utf-8') * 10, BINARIO)
+    cabecera, carga = comprimir_mensaje(largo, umbral=64)
+    longitud, comprimida = leer_cabecera(cabecera)
+    assert comprimida and longitud == len(carga) < len(b''.join(largo[1:]))
+    assert descomprimir(carga) == b''.join(largo[1:])
+
+import socket
+import threading
+import traspaso
+
+@pytest.mark.skipif(not traspaso.disponible(), reason="requiere sockets Unix con SCM_RIGHTS")
+def test_traspaso_entrega_sockets_metadatos_e_historial(tmp_path):
+    """Los descriptores llegan vivos (en lotes), con sus metadatos y el historial en orden."""
+    ruta = str(tmp_path / 'control.sock')
+    assert traspaso.pedir(ruta) is None   # nadie escuchando: arranque normal
+
+    control = traspaso.escuchar(ruta)
+    escucha = socket.socket()
+    pares = [socket.socketpair() for _ in range(traspaso.MAX_FDS_POR_MENSAJE + 1)]
+    conexiones = [({'peer': ['127.0.0.1', i], 'sala': 'pruebas'}, propio) for i, (propio, _) in enumerate(pares)]
+    historial = [('general', b"x" * traspaso.BYTES_HISTORIAL_POR_MENSAJE), ('pruebas', "ñandú".encode('utf-8'))]
+
+    def viejo():
+        traspaso.entregar(traspaso.esperar_pedido(control), escucha, conexiones, historial)
+
+    hilo = threading.Thread(target=viejo)
+    hilo.start()
+    herencia = traspaso.pedir(ruta, timeout=5)
+    herencia.confirmar()
+    hilo.join(5)
+
+    assert herencia.socket_escucha.family == escucha.family
+    assert [meta['peer'][1] for meta, _ in herencia.conexiones] == list(range(len(pares)))
+    assert herencia.historial == historial
+
+    # El socket heredado es el mismo extremo: lo que envía llega al par original
+    herencia.conexiones[-1][1].sendall(b"sigo aqui")
+    assert pares[-1][1].recv(64) == b"sigo aqui"
+
+    for _, sock in herencia.conexiones:
+        sock.close()
+    for propio, remoto in pares:
+        propio.close()
+        remoto.close()
+    herencia.socket_escucha.close()
+    escucha.close()
+    control.close()
+
+@pytest.mark.skipif(not traspaso.disponible(), reason="requiere sockets Unix con SCM_RIGHTS")
+def test_traspaso_confirmado_tarde_no_se_usa(tmp_path):
+    """Si el viejo ya desistió cuando llega la confirmación, el nuevo no recibe 'soltado' y aborta."""
+    ruta = str(tmp_path / 'control.sock')
+    control = traspaso.escuchar(ruta)
+    escucha = socket.socket()
+    errores = []
+
+    def viejo():
+        try:
+            traspaso.entregar(traspaso.esperar_pedido(control), escucha, [], timeout=0.1)
+        except (traspaso.ErrorTraspaso, OSError) as e:
+            errores.append(e)
+
+    hilo = threading.Thread(target=viejo)
+    hilo.start()
+    herencia = traspaso.pedir(ruta, timeout=5)
+    hilo.join(5)   # el viejo se cansó de esperar la confirmación
+    assert errores
+
+    with pytest.raises(traspaso.ErrorTraspaso):
+        herencia.confirmar(timeout=1)
+    assert herencia.socket_escucha.fileno() == -1   # la copia heredada se cerró
+    escucha.close()
+    control.close()
+
+from metricas import RegistroMetricas
+from perfilado import Secciones, muestrear_pilas, formato_colapsado
+
+def test_secciones_desactivadas_no_miden_y_activas_observan():
+    registro_metricas = RegistroMetricas()
+    secciones = Secciones(registro_metricas, ('recv',))
+    assert secciones.medir('recv') is secciones.medir('recv')   # contexto vacío compartido
+    assert "seccion" not in registro_metricas.texto()
+
+    secciones.activar()
+    with secciones.medir('recv'):
+        pass
+    assert "chat_seccion_recv_segundos_count 1" in registro_metricas.texto()
+
+def test_muestreo_de_pilas_ve_a_los_otros_hilos():
+    listo = threading.Event()
+
+    def esperar_en_hilo_propio():
+        listo.wait(5)
+
+    hilo = threading.Thread(target=esperar_en_hilo_propio, name='Thread-7 (prueba)')
+    hilo.start()
+    try:
+        cuentas = muestrear_pilas(0.05, intervalo=0.01)
+    finally:
+        listo.set()
+        hilo.join()
+
+    pilas = [pila for pila in cuentas if 'esperar_en_hilo_propio' in pila]
+    assert pilas and all(pila.startswith('Thread (prueba);') for pila in pilas)
+    assert formato_colapsado({'a;b': 3}) == "a;b 3\n"
+
+def test_indice_de_apodos_unico_y_en_sincronia_con_las_bajas():
+    """Los apodos son únicos sin distinguir mayúsculas y una baja los libera."""
+    tabla = TablaConexiones()
+    a = tabla.agregar(object(), ('127.0.0.1', 5000), b"[127.0.0.1:5000] ", None, 'general')
+    b = tabla.agregar(object(), ('127.0.0.1', 5001), b"[127.0.0.1:5001] ", None, 'general')
+
+    assert tabla.renombrar(a, 'Ana')
+    assert not tabla.renombrar(b, 'ANA')
+    assert tabla.buscar('ana') is a and tabla.buscar(f'#{b.id}') is b
+    assert tabla.renombrar(a, 'ana2') and tabla.buscar('ana') is None
+
+    tabla.quitar(a)
+    assert tabla.buscar('ana2') is None and tabla.buscar(f'#{a.id}') is None
+    assert not tabla.renombrar(a, 'zombi')
+    assert tabla.renombrar(b, 'ana2')
+
+from types import SimpleNamespace
+from comandos import Comandos
+from metricas import MetricasServidor
+
+def test_comandos_entregan_el_directo_con_el_envio_del_motor():
+    """/msg usa el `enviar` del motor; si éste rechaza al destinatario, el acuse lo dice."""
+    tabla = TablaConexiones()
+    ana = tabla.agregar(object(), ('127.0.0.1', 5000), b"[127.0.0.1:5000] ", None, 'general')
+    bea = tabla.agregar(object(), ('127.0.0.1', 5001), b"[127.0.0.1:5001] ", None, 'general')
+    tabla.renombrar(bea, 'bea')
+    config = SimpleNamespace(protocolo=LINEAS, limite_politica=None,
+                             compresion_umbral=0, compresion_nivel=6)
+    enviados = []
+    aceptar = [True]
+
+    def enviar(conexion, mensaje):
+        enviados.append((conexion, mensaje))
+        return aceptar[0] or conexion is ana
+
+    comandos = Comandos(config, tabla, IndiceSalas(), MetricasServidor(), enviar)
+    assert comandos.procesar(ana, '/msg', 'bea hola') == 'general'
+    assert enviados[0][0] is bea
+    assert b"".join(enviados[0][1]) == b"[privado de 127.0.0.1:5000] hola\n"
+    assert b"Entregado a bea" in b"".join(enviados[1][1]) and enviados[1][0] is ana
+
+    aceptar[0] = False
+    comandos.procesar(ana, '/msg', 'bea otra vez')
+    assert b"No se pudo entregar a bea" in b"".join(enviados[-1][1])
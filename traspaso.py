@@ -0,0 +1,216 @@
+import base64
+import json
+import os
+import socket
+import time
+
+# Reinicio sin cortes (--traspaso RUTA): el servidor nuevo se conecta al socket
+# Unix de control del viejo y recibe, como descriptores (SCM_RIGHTS), el socket
+# de escucha y el de cada cliente, junto con lo necesario para seguir
+# atendiéndolos (sala, contadores, bytes de una trama a medio recibir). Los
+# clientes no notan nada: sus conexiones TCP nunca se cierran.
+#
+# Cada mensaje del canal es un registro SOCK_SEQPACKET con un JSON y, si
+# corresponde, descriptores adjuntos:
+#   nuevo -> viejo   {"tipo": "pedido"}
+#   viejo -> nuevo   {"tipo": "escucha"}                    + socket de escucha
+#                    {"tipo": "conexiones", "lote": [...]}  + un socket por entrada
+#                    {"tipo": "historial", "lote": [...]}
+#                    {"tipo": "fin"}
+#   nuevo -> viejo   {"tipo": "recibido"}
+#   viejo -> nuevo   {"tipo": "soltado"}
+#
+# El nuevo confirma apenas recibe todo, antes de abrir la bitácora o cargar el
+# historial, y solo empieza a atender cuando llega "soltado": si el viejo ya
+# había desistido (no le llegó "recibido" a tiempo), el nuevo no recibe
+# "soltado" y aborta, así nunca atienden los dos los mismos sockets.
+
+MAX_FDS_POR_MENSAJE = 200          # SCM_MAX_FD en Linux es 253
+BYTES_HISTORIAL_POR_MENSAJE = 48 * 1024
+TAMANO_MAXIMO_MENSAJE = 1024 * 1024
+TIMEOUT_ENTREGA = 10               # segundos para que el servidor nuevo confirme
+TIMEOUT_SOLTADO = 10               # segundos que espera el nuevo a que el viejo suelte todo
+
+class ErrorTraspaso(Exception):
+    """El otro proceso cortó el canal o envió algo inesperado."""
+
+def disponible():
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket, 'SOCK_SEQPACKET') and hasattr(socket, 'send_fds')
+
+def _enviar(canal, mensaje, fds=()):
+    datos = json.dumps(mensaje).encode('utf-8')
+    if fds:
+        socket.send_fds(canal, [datos], list(fds))
+    else:
+        canal.sendall(datos)
+
+def _recibir(canal, tipo=None):
+    datos, fds, banderas, _ = socket.recv_fds(canal, TAMANO_MAXIMO_MENSAJE, MAX_FDS_POR_MENSAJE)
+    if not datos:
+        raise ErrorTraspaso("El otro proceso cerró el canal de traspaso")
+    if banderas & (socket.MSG_TRUNC | socket.MSG_CTRUNC):
+        raise ErrorTraspaso("Mensaje de traspaso truncado")
+    mensaje = json.loads(datos)
+    if tipo is not None and mensaje.get('tipo') != tipo:
+        raise ErrorTraspaso(f"Se esperaba '{tipo}' y llegó '{mensaje.get('tipo')}'")
+    return mensaje, fds
+
+def escuchar(ruta):
+    """
+    Abre el socket de control en el que este servidor atiende un pedido de
+    traspaso. Un archivo que quedó de un servidor anterior se reemplaza.
+    """
+    try:
+        os.unlink(ruta)
+    except FileNotFoundError:
+        pass
+    control = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    control.bind(ruta)
+    control.listen(1)
+    return control
+
+def esperar_pedido(control):
+    """
+    Bloquea hasta que un servidor nuevo pide el traspaso. Devuelve el canal
+    con ese servidor, o None si se cerró el socket de control.
+    """
+    while True:
+        try:
+            canal, _ = control.accept()
+        except OSError:
+            return None
+        try:
+            _recibir(canal, 'pedido')
+            return canal
+        except (ErrorTraspaso, ValueError, OSError):
+            canal.close()   # no era un servidor: se sigue esperando
+
+def describir_conexion(conexion):
+    """Metadatos de una conexión para el servidor que la hereda."""
+    pendiente = conexion.lector.sin_consumir() if conexion.lector is not None else b''
+    return {
+        'peer': list(conexion.peer),
+        'sala': conexion.sala,
+        'antiguedad_s': time.monotonic() - conexion.conectada_en,
+        'mensajes_recibidos': conexion.mensajes_recibidos,
+        'bytes_recibidos': conexion.bytes_recibidos,
+        'comprime': conexion.comprime,
+        'apodo': conexion.apodo,
+        'pendiente': base64.b64encode(pendiente).decode('ascii'),
+    }
+
+def restaurar_conexion(conexion, meta):
+    """
+    Aplica a una conexión heredada los metadatos de describir_conexion().
+    Devuelve los bytes de la trama que quedó a medio recibir.
+    """
+    conexion.sala = meta['sala']
+    conexion.conectada_en = time.monotonic() - meta['antiguedad_s']
+    conexion.mensajes_recibidos = meta['mensajes_recibidos']
+    conexion.bytes_recibidos = meta['bytes_recibidos']
+    conexion.comprime = meta['comprime']
+    conexion.apodo = meta['apodo']   # el que hereda lo vuelve a indexar con renombrar()
+    return base64.b64decode(meta['pendiente'])
+
+def entregar(canal, socket_escucha, conexiones, historial=(), timeout=TIMEOUT_ENTREGA, al_soltar=None):
+    """
+    Lado del servidor viejo: envía el socket de escucha, las conexiones (pares
+    (metadatos, socket)) y el historial (pares (sala, bytes)), y espera la
+    confirmación del nuevo. Si el nuevo se cae o no confirma a tiempo lanza
+    ErrorTraspaso u OSError y los sockets siguen siendo del viejo.
+
+    Con la confirmación se llama a `al_soltar()` (p. ej. para liberar el
+    puerto de métricas) y se le avisa al nuevo que ya puede atender.
+    """
+    canal.settimeout(timeout)
+    _enviar(canal, {'tipo': 'escucha'}, [socket_escucha.fileno()])
+
+    for inicio in range(0, len(conexiones), MAX_FDS_POR_MENSAJE):
+        lote = conexiones[inicio:inicio + MAX_FDS_POR_MENSAJE]
+        _enviar(canal, {'tipo': 'conexiones', 'lote': [meta for meta, _ in lote]},
+                [sock.fileno() for _, sock in lote])
+
+    lote = []
+    acumulado = 0
+    for sala, mensaje in historial:
+        lote.append([sala, base64.b64encode(mensaje).decode('ascii')])
+        acumulado += len(mensaje)
+        if acumulado >= BYTES_HISTORIAL_POR_MENSAJE:
+            _enviar(canal, {'tipo': 'historial', 'lote': lote})
+            lote = []
+            acumulado = 0
+    if lote:
+        _enviar(canal, {'tipo': 'historial', 'lote': lote})
+
+    _enviar(canal, {'tipo': 'fin'})
+    _recibir(canal, 'recibido')
+    if al_soltar is not None:
+        al_soltar()
+    _enviar(canal, {'tipo': 'soltado'})
+    canal.close()
+
+class Herencia:
+    """Lo que recibe el servidor nuevo en un traspaso."""
+
+    def __init__(self, canal):
+        self.canal = canal
+        self.socket_escucha = None
+        self.conexiones = []   # (metadatos, socket)
+        self.historial = []    # (sala, bytes)
+
+    def confirmar(self, timeout=TIMEOUT_SOLTADO):
+        """
+        Confirma lo recibido y espera a que el viejo lo suelte. Si el viejo ya
+        desistió, cierra todo lo heredado y lanza ErrorTraspaso: el viejo sigue.
+        """
+        try:
+            self.canal.settimeout(timeout)
+            _enviar(self.canal, {'tipo': 'recibido'})
+            _recibir(self.canal, 'soltado')
+        except (ErrorTraspaso, ValueError, OSError) as e:
+            self.soltar()
+            raise ErrorTraspaso(f"El servidor anterior no soltó el traspaso: {e}") from e
+        finally:
+            self.canal.close()
+
+    def soltar(self):
+        # Solo se cierran las copias de este proceso: el servidor anterior conserva las suyas
+        if self.socket_escucha is not None:
+            self.socket_escucha.close()
+        for _, sock in self.conexiones:
+            sock.close()
+
+def _adoptar(fd):
+    # El modo no bloqueante es del archivo compartido: el motor asyncio lo deja activado
+    sock = socket.socket(fileno=fd)
+    sock.setblocking(True)
+    return sock
+
+def pedir(ruta, timeout=30):
+    """
+    Lado del servidor nuevo: pide el traspaso al servidor que atiende `ruta`.
+    Devuelve una Herencia, o None si no hay ningún servidor escuchando ahí.
+    """
+    canal = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        canal.connect(ruta)
+    except (FileNotFoundError, ConnectionRefusedError):
+        canal.close()
+        return None
+
+    canal.settimeout(timeout)
+    _enviar(canal, {'tipo': 'pedido', 'pid': os.getpid()})
+    herencia = Herencia(canal)
+    while True:
+        mensaje, fds = _recibir(canal)
+        tipo = mensaje['tipo']
+        if tipo == 'escucha':
+            herencia.socket_escucha = _adoptar(fds[0])
+        elif tipo == 'conexiones':
+            herencia.conexiones.extend((meta, _adoptar(fd)) for meta, fd in zip(mensaje['lote'], fds))
+        elif tipo == 'historial':
+            herencia.historial.extend((sala, base64.b64decode(datos)) for sala, datos in mensaje['lote'])
+        elif tipo == 'fin':
+            return herencia
+        else:
+            raise ErrorTraspaso(f"Mensaje de traspaso desconocido: {tipo}")
@@ -1,15 +1,128 @@
+import codecs
+import re
 
 MAX_LEN_MENSAJE = 1024 # Limite para el mensaje
 
+# re trabaja directamente sobre bytes, bytearray o memoryview, sin copiarlos.
+# Un byte ASCII que no es blanco para str.strip() (que también quita \x1c-\x1f)
+_NO_BLANCO_ASCII = re.compile(rb'[\x00-\x08\x0e-\x1b\x21-\x7f]')
+_NO_ASCII = re.compile(rb'[\x80-\xff]')
+
+_decodificador_utf8 = codecs.getincrementaldecoder('utf-8')
+
+class ValidadorMensaje:
+    """
+    Valida un mensaje en bytes que puede llegar en varios trozos: que no esté
+    vacío, que no supere MAX_LEN_MENSAJE y que sea UTF-8 válido aunque un
+    carácter multibyte quede partido entre dos trozos.
+
+    Los trozos ASCII (el caso común) se revisan sin decodificarlos. Con
+    bytes no ASCII el texto se decodifica de todos modos para validar el
+    UTF-8, y "vacío" se decide como str.strip(): '\xa0' o '\u3000' solos
+    también son blancos.
+    """
+
+    def __init__(self, limite=MAX_LEN_MENSAJE):
+        self.limite = limite
+        self.reiniciar()
+
+    def reiniciar(self):
+        """Deja el validador listo para el próximo mensaje."""
+        self.largo = 0
+        self.con_contenido = False
+        self.valido = True
+        self._decodificador = None   # solo se crea si aparece un byte no ASCII
+
+    def alimentar(self, trozo) -> bool:
+        """
+        Agrega un trozo (bytes, bytearray o memoryview). Devuelve False en
+        cuanto el mensaje ya no puede ser válido.
+        """
+        if not self.valido:
+            return False
+
+        self.largo += len(trozo)
+        if self.largo > self.limite:
+            self.valido = False
+            return False
+
+        if not self.con_contenido and _NO_BLANCO_ASCII.search(trozo):
+            self.con_contenido = True
+
+        if self._decodificador is None:
+            if not _NO_ASCII.search(trozo):
+                return True   # ASCII puro: siempre es UTF-8 válido
+            self._decodificador = _decodificador_utf8()
+
+        try:
+            # final=False: una secuencia incompleta al final queda pendiente
+            texto = self._decodificador.decode(trozo, False)
+        except UnicodeDecodeError:
+            self.valido = False
+            return False
+        if not self.con_contenido and texto and not texto.isspace():
+            self.con_contenido = True
+        return True
+
+    def terminar(self) -> bool:
+        """Resultado final: el mensaje completo es válido y tiene contenido."""
+        if self.valido and self._decodificador is not None:
+            try:
+                self._decodificador.decode(b'', True)
+            except UnicodeDecodeError:
+                self.valido = False   # terminó a mitad de un carácter
+        return self.valido and self.con_contenido
+
+def validar_bytes(datos) -> bool:
+    """
+    Valida un mensaje completo en bytes (o memoryview) sin decodificarlo a str.
+    """
+    validador = ValidadorMensaje()
+    validador.alimentar(datos)
+    return validador.terminar()
+
+def validar_lote(tramas) -> list:
+    """
+    Valida varias tramas de una vez reutilizando un único validador.
+    Devuelve una lista de booleanos en el mismo orden.
+    """
+    validador = ValidadorMensaje()
+    resultados = []
+    for trama in tramas:
+        validador.reiniciar()
+        validador.alimentar(trama)
+        resultados.append(validador.terminar())
+    return resultados
+
+def bytes_utf8_incompletos(datos) -> int:
+    """
+    Cuántos bytes del final de `datos` son el comienzo de un carácter UTF-8
+    que todavía no terminó de llegar (0 a 3).
+    """
+    fin = len(datos)
+    i = fin - 1
+    # Retrocede sobre los bytes de continuación (10xxxxxx), como mucho 3
+    while i >= 0 and fin - i <= 3 and datos[i] & 0xC0 == 0x80:
+        i -= 1
+    if i < 0:
+        return 0
+    inicial = datos[i]
+    if inicial >= 0xF0:
+        necesarios = 4
+    elif inicial >= 0xE0:
+        necesarios = 3
+    elif inicial >= 0xC0:
+        necesarios = 2
+    else:
+        return 0
+    presentes = fin - i
+    return presentes if presentes < necesarios else 0
+
 def validar_mensaje(contenido: str) -> bool:
     """
     Valida que el contenido del mensaje no esté vacío ni exceda el límite de bytes.
     """
-    if not contenido or contenido.strip() == "":
-        return False
-        
-    # Asumimos que el tamaño del contenido se acerca al número de bytes
-    if len(contenido.encode('utf-8')) > MAX_LEN_MENSAJE:
+    if not contenido:
         return False
-        
-    return True
+
+    return validar_bytes(contenido.encode('utf-8'))